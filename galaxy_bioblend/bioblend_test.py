@@ -5,8 +5,10 @@ from bioblend.galaxy.datasets import DatasetClient
 from bioblend.galaxy.tools.inputs import inputs
 from bioblend.galaxy.jobs import JobsClient
 from pprint import pprint
-import time
-from itertools import cycle
+
+from galaxy_index import InputResolver
+from galaxy_monitor import GalaxyMonitor
+from galaxy_upload import UploadManager
 
 # ----------------------------------------------------------------------------
 # Dataset 
@@ -36,30 +38,17 @@ def Datasets(names):
 # Upload File / Create history in Galaxy
 
 def monitor_files(gi: GalaxyInstance, history_id: str, watch_states=["queued", "running"], update_interval=0.5):
-    animation_chars = cycle(["⢿", "⣻", "⣽", "⣾", "⣷", "⣯", "⣟", "⡿"])
-    
-    def update_display(hdas, animation_char):
+    def update_display(kind, history_id, hdas):
         for hda in hdas:
-            status_char = animation_char if hda["state"] in watch_states else "✅" if hda["state"] == "ok" else ""
+            status_char = "✅" if hda["state"] == "ok" else ""
             print(f'File: {hda["name"]} - State: {hda["state"]} {status_char}')
 
-    hdas = gi.histories.show_history(history_id=history_id, contents=True, deleted=False)
-    print(f"Number of files : {len(hdas)}")
-
-    while any(hda["state"] in watch_states for hda in hdas):
-        print("\033c", end="")
-        update_display(hdas, next(animation_chars))
-        time.sleep(update_interval)
-        hdas = gi.histories.show_history(history_id=history_id, contents=True)
-
-    print("\033c", end="")
-    update_display(hdas, "")
-
-def verify_unique_occurrences(A, B):
-    for item in A:
-        if B.count(item) != 1:
-            return False
-    return True
+    # Only the changes of the history are printed
+    monitor = GalaxyMonitor(gi, min_interval=update_interval, pending_dataset_states=watch_states)
+    monitor.watch_history(history_id)
+    monitor.add_listener(update_display)
+    monitor.wait()
+    print(f"Number of files : {len(monitor.histories[history_id]['contents'])}")
 
 def create_history_with_inputs(gi: GalaxyInstance, tool_client: ToolClient, input_datasets_names: str) -> str:
     # Create a history client
@@ -68,73 +57,38 @@ def create_history_with_inputs(gi: GalaxyInstance, tool_client: ToolClient, inpu
     # Try to get the history
     hist_list = gi.histories.get_histories(name="Test")
 
-    # Create input datasets
-    input_datasets = Datasets(input_datasets_names)
-
     if not hist_list:
         # Create a new history
         new_history = history_client.create_history(name="Test")
         history_id = new_history['id']
-
-        # Upload files to Galaxy
-        for dataset in input_datasets:
-            uploaded_dataset = tool_client.upload_file(dataset.get_name(), history_id, file_type=dataset.get_extension())
-
-        monitor_files(gi, history_id)
-
     else:
         hist = hist_list[-1]
         history_id = hist['id']
 
-        # Check if the datasets name fetched match with our list
-        hdas = gi.histories.show_history(history_id=history_id, contents=True, deleted=False)
-        history_dataset_names = [dataset["name"] for dataset in hdas]
-
-        if (verify_unique_occurrences(input_datasets_names, history_dataset_names)):
-            print("Check inputs names: OK")
-        else:
-            print("Error: input_datasets_names not found in history_dataset_names or may found multiple occurences of a dataset name.")
-            print(f"input_datasets_names: {input_datasets_names}")
-            print(f"history_dataset_names: {history_dataset_names}")
-            quit()
+    # Upload the files missing from the history, recognised by their content
+    UploadManager(gi).upload(history_id, input_datasets_names)
+
+    monitor_files(gi, history_id)
     return history_id
 
-def prepare_inputs(gi: GalaxyInstance, tool_client: ToolClient, tool_id: str, history_id: str) -> inputs:
-    # Build tool in order to get informations about inputs
-    tool_build = tool_client.build(tool_id=tool_id, history_id=history_id)
-
-    hdas = gi.histories.show_history(history_id=history_id, contents=True)
-
-    # Prepare inputs
-    tool_inputs = inputs()
-    for input in tool_build["inputs"]:
-        if (input['model_class'] == 'DataToolParameter'):
-            files_extensions = input["extensions"]
-            for hda in hdas:
-                if (hda['extension'] in files_extensions):
-                    tool_inputs.set_dataset_param(name=input['name'], value={'values': [{'id': hda['id'], 'src': 'hda'}]})
-                    break
-    return tool_inputs
+def prepare_inputs(gi: GalaxyInstance, tool_client: ToolClient, tool_id: str, history_id: str, resolver: InputResolver = None) -> inputs:
+    # The history datasets and the tool builds are cached by the resolver,
+    # pass the same one to prepare many tool runs
+    resolver = resolver or InputResolver(gi, tool_client)
+    return resolver.prepare_inputs(tool_id, history_id)
 # ----------------------------------------------------------------------------
 # Job managment
 
 def monitor_job(jobs_client: JobsClient, job_id: str, watch_states=["new", "queued", "running"], update_interval=0.5):
-    animation_chars = cycle(["⢿", "⣻", "⣽", "⣾", "⣷", "⣯", "⣟", "⡿"])
-
-    def update_display(state, animation_char):
-        status_char = animation_char if state in watch_states else "✅" if state == "ok" else ""
-        print(f'Job: {job_id} - State: {state} {status_char}')
-    
-    current_state = jobs_client.get_state(job_id)
-
-    while current_state in watch_states:
-        print("\033c", end="")
-        update_display(current_state, next(animation_chars))
-        time.sleep(update_interval)
-        current_state = jobs_client.get_state(job_id)
-
-    print("\033c", end="")
-    update_display(current_state, "")
+    def update_display(kind, job_id, job):
+        status_char = "✅" if job["state"] == "ok" else ""
+        print(f'Job: {job_id} - State: {job["state"]} {status_char}')
+
+    # Only the changes of state are printed
+    monitor = GalaxyMonitor(jobs_client.gi, min_interval=update_interval, pending_job_states=watch_states)
+    monitor.watch_job(job_id)
+    monitor.add_listener(update_display)
+    monitor.wait()
 
 # ----------------------------------------------------------------------------
 def main():
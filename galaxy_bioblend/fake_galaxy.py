@@ -0,0 +1,320 @@
+"""
+Local fake of the parts of the Galaxy API used by the scripts of this
+directory, to try them without a Galaxy server:
+
+    server = FakeGalaxy()
+    url = server.start()
+    history_id = server.add_history("Test")
+    job_id = server.add_job(history_id, "gmx_rmsd")
+    gi = GalaxyInstance(url=url, key="fake")
+
+Jobs and datasets go through their states over time, one state every `step`
+seconds, and the update_time of a history follows the changes of its
+datasets. Files are uploaded through the resumable (tus) endpoint and the
+fetch API, or fetched from a URL (the content of the dataset is then its
+URL). Running a tool creates a job and one output dataset which follow the
+states given to add_tool. Every request is recorded in `requests` as
+(method, path).
+"""
+
+import json
+import hashlib
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+JOB_STATES = ("new", "queued", "running", "ok")
+DATASET_STATES = ("queued", "running", "ok")
+
+
+def _isoformat(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).replace(tzinfo=None).isoformat()
+
+
+class _Item:
+    """a job or a dataset whose state advances every step seconds"""
+
+    def __init__(self, states, step):
+        self.id = uuid.uuid4().hex[:16]
+        self.created = time.time()
+        self.states = states
+        self.step = step
+
+    def _index(self):
+        if not self.step:
+            return len(self.states) - 1
+        return min(int((time.time() - self.created) / self.step), len(self.states) - 1)
+
+    @property
+    def state(self):
+        return self.states[self._index()]
+
+    @property
+    def update_time(self):
+        return self.created + self._index() * self.step
+
+
+class FakeGalaxy:
+
+    def __init__(self, step=0.2):
+        self.step = step
+        self.histories = {}
+        self.datasets = {}
+        self.jobs = {}
+        self.uploads = {}
+        self.tools = {}
+        self.tool_states = {}
+        self.requests = []
+        self._lock = threading.Lock()
+        self._server = None
+
+    # ------------------------------------------------------------------------
+    # Content
+
+    def add_history(self, name):
+        history_id = uuid.uuid4().hex[:16]
+        self.histories[history_id] = {"name": name, "created": time.time(), "datasets": [],
+                                      "hid": 0}
+        return history_id
+
+    def add_dataset(self, history_id, name, extension=None, states=DATASET_STATES,
+                    content=b""):
+        dataset = _Item(states, self.step)
+        dataset.name = name
+        dataset.extension = extension or name.rsplit(".", 1)[-1]
+        dataset.history_id = history_id
+        dataset.content = content
+        dataset.hashes = []
+        dataset.deleted = False
+        self.histories[history_id]["hid"] += 1
+        dataset.hid = self.histories[history_id]["hid"]
+        self.datasets[dataset.id] = dataset
+        self.histories[history_id]["datasets"].append(dataset.id)
+        return dataset.id
+
+    def add_tool(self, tool_id, data_inputs, states=JOB_STATES):
+        """
+        a tool whose data inputs are given as {name: [extensions]}; its jobs
+        go through states, ending in "error" for a failing tool
+        """
+        self.tools[tool_id] = [
+            {"model_class": "DataToolParameter", "name": name, "extensions": list(extensions)}
+            for name, extensions in data_inputs.items()]
+        self.tool_states[tool_id] = states
+
+    def delete_dataset(self, dataset_id):
+        dataset = self.datasets[dataset_id]
+        dataset.deleted = True
+        dataset.created = time.time()
+        dataset.states = dataset.states[-1:]
+
+    def add_job(self, history_id, tool_id, states=JOB_STATES):
+        job = _Item(states, self.step)
+        job.tool_id = tool_id
+        job.history_id = history_id
+        job.outputs = {}
+        self.jobs[job.id] = job
+        return job.id
+
+    def run_tool(self, history_id, tool_id):
+        """a job of the tool and its output dataset, which share their states"""
+        states = self.tool_states.get(tool_id, JOB_STATES)
+        job_id = self.add_job(history_id, tool_id, states)
+        dataset_id = self.add_dataset(history_id, f"{tool_id.rsplit('/', 1)[-1]}_output.tabular",
+                                      states=states, content=f"output of {job_id}\n".encode())
+        # Both advance from the same instant
+        self.datasets[dataset_id].created = self.jobs[job_id].created
+        self.jobs[job_id].outputs["output"] = dataset_id
+        return job_id
+
+    # ------------------------------------------------------------------------
+    # API
+
+    def _job(self, job):
+        return {"id": job.id, "tool_id": job.tool_id, "history_id": job.history_id,
+                "state": job.state, "create_time": _isoformat(job.created),
+                "update_time": _isoformat(job.update_time)}
+
+    def _dataset(self, dataset):
+        return {"id": dataset.id, "hid": dataset.hid, "name": dataset.name,
+                "extension": dataset.extension, "file_ext": dataset.extension,
+                "state": dataset.state,
+                "history_id": dataset.history_id, "history_content_type": "dataset",
+                "deleted": dataset.deleted, "purged": False, "visible": True,
+                "file_size": len(dataset.content), "hashes": dataset.hashes,
+                "download_url": f"/api/datasets/{dataset.id}/display",
+                "update_time": _isoformat(dataset.update_time)}
+
+    def _history(self, history_id):
+        history = self.histories[history_id]
+        update_time = max([history["created"]] + [
+            self.datasets[dataset_id].update_time for dataset_id in history["datasets"]])
+        return {"id": history_id, "name": history["name"],
+                "update_time": _isoformat(update_time)}
+
+    def _upload(self, method, upload_id, headers, body):
+        upload = self.uploads.get(upload_id)
+        if upload is None:
+            return 404, None, {}
+        if method == "PATCH":
+            if int(headers["Upload-Offset"]) != len(upload["data"]):
+                return 409, None, {}
+            upload["data"] += body
+        return (200 if method == "HEAD" else 204), None, {
+            "Upload-Offset": str(len(upload["data"])), "Upload-Length": str(upload["length"])}
+
+    def _fetch(self, payload):
+        outputs = []
+        for target in payload["targets"]:
+            for index, element in enumerate(target["elements"]):
+                if element["src"] == "url":
+                    content = element["url"].encode()
+                else:
+                    upload_id = payload[f"files_{index}|file_data"]["session_id"]
+                    content = self.uploads.pop(upload_id)["data"]
+                dataset_id = self.add_dataset(payload["history_id"], element["name"],
+                                              element.get("ext"), content=content)
+                for expected in element.get("hashes", []):
+                    if hashlib.sha256(content).hexdigest() != expected["hash_value"]:
+                        return 400, {"err_msg": "Hash mismatch"}
+                    self.datasets[dataset_id].hashes.append(expected)
+                outputs.append(self._dataset(self.datasets[dataset_id]))
+        return 200, {"outputs": outputs, "jobs": []}
+
+    def handle(self, method, path, query, body, headers=None):
+        """
+        return (status, response[, response headers]) of a request, the
+        response being sent as JSON unless it is bytes
+        """
+        parts = path.strip("/").split("/")[1:]
+        params = {name: values[-1] for name, values in parse_qs(query).items()}
+        if parts[:2] == ["upload", "resumable_upload"]:
+            if method == "POST":
+                upload_id = uuid.uuid4().hex
+                self.uploads[upload_id] = {"length": int(headers["Upload-Length"]), "data": b""}
+                return 201, None, {"Location": f"/api/upload/resumable_upload/{upload_id}"}
+            return self._upload(method, parts[2], headers, body)
+        if method == "POST" and parts == ["tools", "fetch"]:
+            return self._fetch(json.loads(body))
+        if method == "POST" and parts == ["tools"]:
+            payload = json.loads(body)
+            if payload["tool_id"] not in self.tools:
+                return 404, {"err_msg": "No such tool"}
+            if payload["history_id"] not in self.histories:
+                return 404, {"err_msg": "No such history"}
+            job = self.jobs[self.run_tool(payload["history_id"], payload["tool_id"])]
+            return 200, {"jobs": [self._job(job)], "outputs": [
+                self._dataset(self.datasets[dataset_id]) for dataset_id in job.outputs.values()]}
+        if method == "POST" and parts == ["histories"]:
+            return 200, self._history(self.add_history(json.loads(body or b"{}").get("name")))
+        if method == "PUT" and len(parts) == 3 and parts[0] == "datasets" and parts[2] == "hash":
+            dataset = self.datasets[parts[1]]
+            dataset.hashes = [{"hash_function": "SHA-256",
+                               "hash_value": hashlib.sha256(dataset.content).hexdigest()}]
+            return 200, {}
+        if method in ("GET", "POST") and len(parts) == 3 and parts[0] == "tools" and parts[2] == "build":
+            if parts[1] not in self.tools:
+                return 404, {"err_msg": "No such tool"}
+            return 200, {"id": parts[1], "inputs": self.tools[parts[1]]}
+        if method == "GET" and parts == ["jobs"]:
+            return 200, [self._job(job) for job in self.jobs.values()
+                         if params.get("history_id", job.history_id) == job.history_id
+                         and params.get("tool_id", job.tool_id) == job.tool_id]
+        if method == "GET" and len(parts) >= 2 and parts[0] == "jobs":
+            job = self.jobs.get(parts[1])
+            if job is None:
+                return 404, {"err_msg": "No such job"}
+            if parts[2:] == ["outputs"]:
+                return 200, [{"name": name, "dataset": {"id": dataset_id, "src": "hda"}}
+                             for name, dataset_id in job.outputs.items()]
+            return 200, self._job(job)
+        if method == "GET" and len(parts) >= 2 and parts[0] == "datasets":
+            dataset = self.datasets.get(parts[1])
+            if dataset is None:
+                return 404, {"err_msg": "No such dataset"}
+            if parts[2:] == ["display"]:
+                return 200, dataset.content
+            return 200, self._dataset(dataset)
+        if method == "GET" and parts == ["histories"]:
+            return 200, [self._history(history_id) for history_id in self.histories
+                         if params.get("q") != "name"
+                         or self.histories[history_id]["name"] == params.get("qv")]
+        if method == "GET" and len(parts) >= 2 and parts[0] == "histories":
+            if parts[1] not in self.histories:
+                return 404, {"err_msg": "No such history"}
+            if parts[2:] == ["contents"]:
+                contents = [self._dataset(self.datasets[dataset_id])
+                            for dataset_id in self.histories[parts[1]]["datasets"]]
+                if params.get("q") == "update_time-ge":
+                    contents = [hda for hda in contents if hda["update_time"] >= params["qv"]]
+                if params.get("deleted") == "False":
+                    contents = [hda for hda in contents if not hda["deleted"]]
+                return 200, contents
+            return 200, self._history(parts[1])
+        return 404, {"err_msg": f"Not implemented in the fake Galaxy: {method} {path}"}
+
+    # ------------------------------------------------------------------------
+    # Server
+
+    def start(self, host="127.0.0.1", port=0):
+        """start serving in a thread and return the URL of the server"""
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def _respond(self, method):
+                url = urlsplit(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                with fake._lock:
+                    fake.requests.append((method, url.path))
+                    status, response, *headers = fake.handle(
+                        method, url.path, url.query, body, self.headers)
+                if isinstance(response, bytes):
+                    data, content_type = response, "application/octet-stream"
+                else:
+                    data = json.dumps(response).encode() if response is not None else b""
+                    content_type = "application/json"
+                self.send_response(status)
+                for name, value in (headers[0] if headers else {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                if method != "HEAD":
+                    self.wfile.write(data)
+
+            def do_GET(self):
+                self._respond("GET")
+
+            def do_POST(self):
+                self._respond("POST")
+
+            def do_PUT(self):
+                self._respond("PUT")
+
+            def do_DELETE(self):
+                self._respond("DELETE")
+
+            def do_HEAD(self):
+                self._respond("HEAD")
+
+            def do_PATCH(self):
+                self._respond("PATCH")
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return f"http://{host}:{self._server.server_port}"
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def count_requests(self, path_prefix):
+        return sum(path.startswith(path_prefix) for _, path in self.requests)
@@ -0,0 +1,364 @@
+"""
+Run one Galaxy tool over many datasets of the MDverse catalog.
+
+Each catalog dataset gets its own history, named "MDverse <dataset_id>",
+which is reused when it already exists. The files of the dataset accepted by
+the tool are fetched by Galaxy from their URL, the tool is run on them and
+the outputs of its jobs are downloaded to <output_dir>/<dataset_id>/.
+
+- At most max_concurrency datasets are processed at once, and the requests
+  which create something in Galaxy (histories, uploads, jobs) are limited to
+  submit_rate per second.
+- All the jobs and histories are watched by one GalaxyMonitor, so the
+  polling cost does not grow with the number of datasets.
+- Outputs are downloaded download_workers at a time.
+- The progress of every dataset is appended to a checkpoint journal after
+  each step. A run interrupted and started again with the same checkpoint
+  skips the datasets done and waits for the jobs already submitted instead
+  of submitting them again.
+
+The files of the datasets are read from the files table of the catalog,
+given with --files or found through the catalog package of the web
+application:
+
+    PYTHONPATH=../streamlit python galaxy_batch.py --url https://usegalaxy.eu \\
+        --key KEY --tool-id gmx_rmsd --output-dir results 10.5281/zenodo.1234 ...
+
+It can be tried locally against fake_galaxy.FakeGalaxy.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+import traceback
+
+import pyarrow.dataset as ds
+from bioblend.galaxy import GalaxyInstance
+
+from galaxy_index import InputResolver
+from galaxy_monitor import GalaxyMonitor
+from galaxy_upload import UploadManager, get_extension
+
+try:
+    # Catalog cache of the web application, found through PYTHONPATH
+    from catalog import cache
+except ImportError:
+    cache = None
+
+MAX_CONCURRENCY = 8
+SUBMIT_RATE = 2.0
+DOWNLOAD_WORKERS = 4
+HISTORY_PREFIX = "MDverse "
+DEFAULT_CHECKPOINT = "galaxy_batch.jsonl"
+
+# Steps of a dataset, in order
+STAGED = "staged"
+SUBMITTING = "submitting"
+SUBMITTED = "submitted"
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+# ----------------------------------------------------------------------------
+# Rate limiting
+
+class RateLimiter:
+    """token bucket: rate acquisitions per second, burst of them at once"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self.tokens = 1
+                self._updated = time.monotonic()
+            self.tokens -= 1
+
+
+# ----------------------------------------------------------------------------
+# Checkpoint
+
+class Checkpoint:
+    """
+    progress of every dataset, in a JSON lines journal: each change is
+    appended as one line, and the journal is compacted to one line per
+    dataset when it is opened and by compact()
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        try:
+            with open(path) as f:
+                for line in f:
+                    try:
+                        change = json.loads(line)
+                    except ValueError:
+                        # Last line cut by a crash
+                        break
+                    self.get(change.pop("dataset_id")).update(change)
+        except FileNotFoundError:
+            pass
+        self._journal = None
+        self.compact()
+
+    def get(self, dataset_id):
+        return self.entries.setdefault(dataset_id, {})
+
+    def update(self, dataset_id, **values):
+        self.get(dataset_id).update(values)
+        self._journal.write(json.dumps({"dataset_id": dataset_id, **values}) + "\n")
+        self._journal.flush()
+
+    def compact(self):
+        """rewrite the journal with one line per dataset"""
+        if self._journal is not None:
+            self._journal.close()
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".galaxy_batch.")
+        with os.fdopen(fd, "w") as f:
+            for dataset_id, entry in self.entries.items():
+                if entry:
+                    f.write(json.dumps({"dataset_id": dataset_id, **entry}) + "\n")
+        os.replace(tmp_path, self.path)
+        self._journal = open(self.path, "a")
+
+    def summary(self):
+        counts = {}
+        for entry in self.entries.values():
+            counts[entry.get("status")] = counts.get(entry.get("status"), 0) + 1
+        return counts
+
+
+# ----------------------------------------------------------------------------
+# Batch runner
+
+class BatchRunner:
+
+    def __init__(self, gi, tool_id, output_dir, checkpoint_path=DEFAULT_CHECKPOINT,
+                 max_concurrency=MAX_CONCURRENCY, submit_rate=SUBMIT_RATE,
+                 download_workers=DOWNLOAD_WORKERS, monitor=None, retry_failed=False):
+        self.gi = gi
+        self.tool_id = tool_id
+        self.output_dir = output_dir
+        self.checkpoint = Checkpoint(checkpoint_path)
+        self.max_concurrency = max_concurrency
+        self.submit_rate = submit_rate
+        self.download_workers = download_workers
+        self.retry_failed = retry_failed
+        self.resolver = InputResolver(gi, gi.tools)
+        self.monitor = monitor or GalaxyMonitor(gi)
+        self.uploads = UploadManager(gi)
+        self.histories = {}
+
+    async def _call(self, function, *args, **kwargs):
+        """call a blocking function, after a token for the requests creating something"""
+        await self._limiter.acquire()
+        return await asyncio.to_thread(function, *args, **kwargs)
+
+    # ------------------------------------------------------------------------
+    # Steps of a dataset
+
+    async def _history(self, dataset_id):
+        entry = self.checkpoint.get(dataset_id)
+        history_id = entry.get("history_id") or self.histories.get(HISTORY_PREFIX + dataset_id)
+        if history_id is None:
+            history = await self._call(self.gi.histories.create_history, name=HISTORY_PREFIX + dataset_id)
+            history_id = history["id"]
+        self.checkpoint.update(dataset_id, history_id=history_id)
+        return history_id
+
+    async def _stage(self, dataset_id, history_id, files):
+        """fetch the files accepted by the tool into the history"""
+        tool_build = await asyncio.to_thread(self.resolver.tool_builds.get, self.tool_id, history_id)
+        accepted = {extension for input in tool_build["inputs"]
+                    if input["model_class"] == "DataToolParameter"
+                    for extension in input["extensions"]}
+        files = [(name, url) for name, url in files
+                 if "data" in accepted or get_extension(name).lower() in accepted]
+        if not files:
+            return False
+        await self._call(self.uploads.upload_urls, history_id, files)
+        contents = await self.monitor.wait_history(history_id)
+        names = {name for name, _ in files}
+        failed = [hda["name"] for hda in contents if hda["name"] in names and hda["state"] != "ok"]
+        if failed:
+            raise RuntimeError(f"Inputs not fetched: {', '.join(failed)}")
+        self.checkpoint.update(dataset_id, status=STAGED)
+        return True
+
+    async def _tool_jobs(self, history_id):
+        jobs = await asyncio.to_thread(self.gi.jobs.get_jobs, history_id=history_id,
+                                       tool_id=[self.tool_id])
+        return [job["id"] for job in jobs]
+
+    async def _submit(self, dataset_id, history_id):
+        entry = self.checkpoint.get(dataset_id)
+        if entry.get("status") == SUBMITTING:
+            # Interrupted while submitting: the jobs may exist already
+            job_ids = [job_id for job_id in await self._tool_jobs(history_id)
+                       if job_id not in entry["previous_job_ids"]]
+            if job_ids:
+                self.checkpoint.update(dataset_id, status=SUBMITTED, job_ids=job_ids)
+                return
+        tool_inputs = await asyncio.to_thread(self.resolver.prepare_inputs, self.tool_id, history_id)
+        # The jobs of earlier runs in a reused history are not taken for the
+        # jobs of this one
+        self.checkpoint.update(dataset_id, status=SUBMITTING,
+                               previous_job_ids=await self._tool_jobs(history_id))
+        run = await self._call(self.gi.tools.run_tool, history_id=history_id,
+                               tool_id=self.tool_id, tool_inputs=tool_inputs)
+        self.checkpoint.update(dataset_id, status=SUBMITTED,
+                               job_ids=[job["id"] for job in run["jobs"]])
+
+    async def _download(self, dataset_id, job_ids):
+        directory = os.path.join(self.output_dir, dataset_id.replace("/", "_"))
+        os.makedirs(directory, exist_ok=True)
+        outputs = []
+        for job_id in job_ids:
+            for output in await asyncio.to_thread(self.gi.jobs.get_outputs, job_id):
+                outputs.append((output["name"], output["dataset"]["id"]))
+
+        async def download(name, hda_id):
+            async with self._downloads:
+                dataset = await asyncio.to_thread(self.gi.datasets.show_dataset, hda_id)
+                path = os.path.join(directory, f"{name}.{dataset['file_ext']}")
+                # A partial file is never taken for a downloaded output
+                await asyncio.to_thread(self.gi.datasets.download_dataset, hda_id,
+                                        file_path=path + ".part", use_default_filename=False)
+                os.replace(path + ".part", path)
+                return path
+
+        return await asyncio.gather(*(download(name, hda_id) for name, hda_id in outputs))
+
+    async def _process(self, dataset_id, files):
+        entry = self.checkpoint.get(dataset_id)
+        async with self._slots:
+            try:
+                history_id = await self._history(dataset_id)
+                if entry.get("status") not in (STAGED, SUBMITTING, SUBMITTED):
+                    if not await self._stage(dataset_id, history_id, files):
+                        print(f"{dataset_id}: no file accepted by {self.tool_id}")
+                        self.checkpoint.update(dataset_id, status=SKIPPED)
+                        return
+                if entry.get("status") != SUBMITTED:
+                    await self._submit(dataset_id, history_id)
+            except Exception as error:
+                traceback.print_exc()
+                self.checkpoint.update(dataset_id, status=FAILED, error=str(error))
+                return
+
+        # Waiting for the jobs does not hold a slot
+        try:
+            jobs = await self.monitor.wait_jobs(entry["job_ids"])
+            failed = [job_id for job_id, job in jobs.items() if job["state"] != "ok"]
+            if failed:
+                raise RuntimeError(f"Jobs not ok: {', '.join(failed)}")
+            outputs = await self._download(dataset_id, entry["job_ids"])
+        except Exception as error:
+            traceback.print_exc()
+            self.checkpoint.update(dataset_id, status=FAILED, error=str(error))
+            return
+        self.checkpoint.update(dataset_id, status=DONE, outputs=outputs)
+        print(f"{dataset_id}: {len(outputs)} output(s) downloaded")
+
+    async def run_async(self, datasets):
+        """run the tool on datasets given as {dataset_id: [(file_name, file_url)]}"""
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self._downloads = asyncio.Semaphore(self.download_workers)
+        self._limiter = RateLimiter(self.submit_rate)
+
+        skipped = {DONE, SKIPPED} | (set() if self.retry_failed else {FAILED})
+        todo = {dataset_id: files for dataset_id, files in datasets.items()
+                if self.checkpoint.get(dataset_id).get("status") not in skipped}
+        for dataset_id in todo:
+            if self.checkpoint.get(dataset_id).get("status") == FAILED:
+                self.checkpoint.get(dataset_id).pop("status")
+        print(f"{len(datasets) - len(todo)} dataset(s) already processed, {len(todo)} to run")
+
+        # The histories of the datasets are looked up with one request
+        if todo:
+            histories = await asyncio.to_thread(self.gi.histories.get_histories)
+            self.histories = {history["name"]: history["id"] for history in histories
+                              if history["name"].startswith(HISTORY_PREFIX)}
+        await asyncio.gather(*(self._process(dataset_id, files) for dataset_id, files in todo.items()))
+        self.checkpoint.compact()
+        return {dataset_id: self.checkpoint.get(dataset_id) for dataset_id in datasets}
+
+    def run(self, datasets):
+        return asyncio.run(self.run_async(datasets))
+
+
+# ----------------------------------------------------------------------------
+# Catalog
+
+def catalog_files(dataset_ids, files_path=None):
+    """
+    files of catalog datasets, as {dataset_id: [(file_name, file_url)]},
+    read from files_path (files.parquet of the catalog), by default from the
+    catalog cache of the web application
+    """
+    if files_path is None:
+        if cache is None:
+            raise RuntimeError("catalog package not found: give the files table of the "
+                               "catalog, or add ../streamlit to PYTHONPATH")
+        files_path = cache.fetch_catalog()["files"]
+    table = ds.dataset(files_path, format="parquet").to_table(
+        columns=["dataset_id", "file_name", "file_url"],
+        filter=ds.field("dataset_id").isin(list(dataset_ids)))
+    datasets = {dataset_id: [] for dataset_id in dataset_ids}
+    for dataset_id, file_name, file_url in zip(*(column.to_pylist() for column in table.columns)):
+        datasets[dataset_id].append((file_name, file_url))
+    return datasets
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a Galaxy tool over MDverse datasets.")
+    parser.add_argument("dataset_ids", nargs="*", help="dataset_id of the catalog datasets")
+    parser.add_argument("--datasets", help="file with one dataset_id per line")
+    parser.add_argument("--files", help="files.parquet of the catalog (default: the catalog "
+                        "cache of the web application)")
+    parser.add_argument("--url", required=True, help="URL of the Galaxy server")
+    parser.add_argument("--key", default=os.environ.get("GALAXY_API_KEY"),
+                        help="Galaxy API key (default: $GALAXY_API_KEY)")
+    parser.add_argument("--tool-id", required=True)
+    parser.add_argument("--output-dir", default="outputs")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT)
+    parser.add_argument("--max-concurrency", type=int, default=MAX_CONCURRENCY)
+    parser.add_argument("--submit-rate", type=float, default=SUBMIT_RATE,
+                        help="requests creating histories, datasets or jobs per second")
+    parser.add_argument("--download-workers", type=int, default=DOWNLOAD_WORKERS)
+    parser.add_argument("--retry-failed", action="store_true")
+    args = parser.parse_args()
+
+    dataset_ids = list(args.dataset_ids)
+    if args.datasets:
+        with open(args.datasets) as f:
+            dataset_ids += [line.strip() for line in f if line.strip()]
+    if not dataset_ids:
+        parser.error("no dataset given")
+
+    gi = GalaxyInstance(url=args.url, key=args.key)
+    runner = BatchRunner(gi, args.tool_id, args.output_dir, args.checkpoint,
+                         max_concurrency=args.max_concurrency, submit_rate=args.submit_rate,
+                         download_workers=args.download_workers, retry_failed=args.retry_failed)
+    runner.run(catalog_files(list(dict.fromkeys(dataset_ids)), args.files))
+    print(runner.checkpoint.summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Cached lookups for preparing the inputs of many Galaxy tool runs.
+
+- HistoryIndex keeps the datasets of a history indexed by extension and by
+  name. It is refreshed incrementally: one request tells whether the
+  history changed since the last refresh, and only the datasets updated
+  since then are listed. A refresh younger than max_age seconds is reused.
+- ToolBuildCache keeps the build (description of the inputs) of each tool,
+  fetched once per tool_id.
+- InputResolver uses both to fill the data inputs of a tool with datasets
+  of a history, so preparing hundreds of runs costs a few requests.
+"""
+
+import threading
+import time
+
+from bioblend.galaxy.tools.inputs import inputs
+
+CONTENTS_KEYS = "id,hid,name,extension,state,deleted,purged,visible,update_time,history_content_type"
+MAX_AGE = 5
+
+
+class HistoryIndex:
+
+    def __init__(self, gi, history_id):
+        self.gi = gi
+        self.history_id = history_id
+        self.update_time = None
+        self.datasets = {}
+        self.by_extension = {}
+        self.by_name = {}
+        self._last_update = None
+        self._refreshed = None
+        self._lock = threading.Lock()
+
+    def refresh(self, max_age=0):
+        """update the index with the datasets changed since the last refresh"""
+        with self._lock:
+            if self._refreshed is not None and time.monotonic() - self._refreshed < max_age:
+                return False
+            history = self.gi.histories.show_history(self.history_id)
+            if history["update_time"] == self.update_time:
+                self._refreshed = time.monotonic()
+                return False
+            params = {"v": "dev", "keys": CONTENTS_KEYS}
+            if self._last_update is not None:
+                # Datasets updated in the same instant as the last one seen
+                # are listed again rather than missed
+                params.update(q="update_time-ge", qv=self._last_update)
+            response = self.gi.make_get_request(
+                f"{self.gi.url}/histories/{self.history_id}/contents", params=params)
+            response.raise_for_status()
+            for hda in response.json():
+                if hda.get("history_content_type", "dataset") != "dataset":
+                    continue
+                if hda.get("deleted") or hda.get("purged"):
+                    self.datasets.pop(hda["id"], None)
+                else:
+                    self.datasets[hda["id"]] = hda
+                if self._last_update is None or hda["update_time"] > self._last_update:
+                    self._last_update = hda["update_time"]
+            self.update_time = history["update_time"]
+            self._refreshed = time.monotonic()
+
+            # Datasets in history order, as listed by show_history
+            self.by_extension = {}
+            self.by_name = {}
+            for hda in sorted(self.datasets.values(), key=lambda hda: hda["hid"]):
+                self.by_extension.setdefault(hda["extension"], []).append(hda)
+                self.by_name.setdefault(hda["name"], []).append(hda)
+            return True
+
+    def find(self, extensions, name=None):
+        """first dataset of the history with one of the extensions (and the name)"""
+        if name is not None:
+            candidates = [hda for hda in self.by_name.get(name, []) if hda["extension"] in extensions]
+        else:
+            candidates = [hda for extension in extensions for hda in self.by_extension.get(extension, [])]
+        return min(candidates, key=lambda hda: hda["hid"]) if candidates else None
+
+
+class ToolBuildCache:
+
+    def __init__(self, tool_client):
+        self.tool_client = tool_client
+        self.builds = {}
+        self._lock = threading.Lock()
+
+    def get(self, tool_id, history_id):
+        """
+        build of a tool; the inputs it describes do not depend on the history
+        the first build was made for
+        """
+        with self._lock:
+            if tool_id not in self.builds:
+                self.builds[tool_id] = self.tool_client.build(tool_id=tool_id, history_id=history_id)
+            return self.builds[tool_id]
+
+
+class InputResolver:
+
+    def __init__(self, gi, tool_client, max_age=MAX_AGE):
+        self.gi = gi
+        self.max_age = max_age
+        self.tool_builds = ToolBuildCache(tool_client)
+        self.histories = {}
+        self._lock = threading.Lock()
+
+    def history_index(self, history_id, refresh=True):
+        with self._lock:
+            if history_id not in self.histories:
+                self.histories[history_id] = HistoryIndex(self.gi, history_id)
+            index = self.histories[history_id]
+        if refresh:
+            index.refresh(self.max_age)
+        return index
+
+    def prepare_inputs(self, tool_id, history_id, refresh=True):
+        """
+        inputs of a tool run, each data input being set to the first dataset
+        of the history with an accepted extension
+        """
+        tool_build = self.tool_builds.get(tool_id, history_id)
+        index = self.history_index(history_id, refresh)
+
+        tool_inputs = inputs()
+        for input in tool_build["inputs"]:
+            if (input['model_class'] == 'DataToolParameter'):
+                hda = index.find(input["extensions"])
+                if hda is not None:
+                    tool_inputs.set_dataset_param(name=input['name'], value={'values': [{'id': hda['id'], 'src': 'hda'}]})
+        return tool_inputs
@@ -0,0 +1,237 @@
+"""
+Monitoring of many Galaxy jobs and histories at once.
+
+Each poll cycle lists the jobs with one request (get_jobs) and the histories
+with another (get_histories); the contents of a history are only fetched when
+its update_time changed, and listeners are only called for the jobs and
+histories that changed. A watched history missing from the list is shown
+on its own; one that does not exist is no longer pending, and wait_history
+raises HistoryNotFound. The delay between cycles starts at min_interval,
+is multiplied by factor after every cycle without change (up to
+max_interval) and reset by a change; a random jitter spreads the requests of
+concurrent monitors.
+
+Use it synchronously:
+
+    monitor = GalaxyMonitor(gi)
+    monitor.watch_job(job_id)
+    monitor.add_listener(print)
+    monitor.wait()
+
+or from asyncio:
+
+    job = await monitor.wait_job(job_id)
+"""
+
+import asyncio
+import logging
+import random
+import time
+
+import requests
+from bioblend import ConnectionError as GalaxyConnectionError
+
+PENDING_JOB_STATES = ("new", "upload", "waiting", "queued", "running")
+PENDING_DATASET_STATES = ("new", "upload", "queued", "running", "setting_metadata")
+# Jobs listed per cycle, most recently updated first; the jobs not listed
+# are shown one by one.
+JOB_LIMIT = 500
+ONE_DAY = 24 * 3600
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryNotFound(Exception):
+    """A watched history does not exist (or was purged) on the server."""
+
+
+class GalaxyMonitor:
+
+    def __init__(self, gi, min_interval=0.5, max_interval=30.0, factor=2.0,
+                 jitter=0.2, pending_job_states=PENDING_JOB_STATES,
+                 pending_dataset_states=PENDING_DATASET_STATES):
+        self.gi = gi
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.factor = factor
+        self.jitter = jitter
+        self.pending_job_states = set(pending_job_states)
+        self.pending_dataset_states = set(pending_dataset_states)
+        self.interval = min_interval
+        # Last known job of each watched job id, None before the first poll
+        self.jobs = {}
+        # Last known update_time and contents of each watched history
+        self.histories = {}
+        self._listeners = []
+        self._since = None
+        self._runner = None
+        self._running = False
+        self._changed = None
+
+    # ------------------------------------------------------------------------
+    # Watched jobs and histories
+
+    def watch_job(self, job_id):
+        self.jobs.setdefault(job_id, None)
+        # Jobs are listed by update date, from one day before the first
+        # watched job to absorb clock differences with the server.
+        if self._since is None:
+            self._since = time.strftime("%Y-%m-%d", time.gmtime(time.time() - ONE_DAY))
+
+    def watch_history(self, history_id):
+        self.histories.setdefault(history_id, None)
+
+    def add_listener(self, callback):
+        """
+        callback(kind, id, value) is called on every change, kind being "job"
+        (value: the job) or "history" (value: the history contents)
+        """
+        self._listeners.append(callback)
+
+    def job_pending(self, job_id):
+        job = self.jobs[job_id]
+        return job is None or job["state"] in self.pending_job_states
+
+    def history_pending(self, history_id):
+        history = self.histories[history_id]
+        return history is None or any(
+            hda["state"] in self.pending_dataset_states for hda in history["contents"])
+
+    def pending(self):
+        return (any(self.job_pending(job_id) for job_id in self.jobs)
+                or any(self.history_pending(history_id) for history_id in self.histories))
+
+    # ------------------------------------------------------------------------
+    # Polling
+
+    def poll_once(self):
+        """Run one poll cycle and return the changes as (kind, id, value)."""
+        changes = []
+        pending_jobs = [job_id for job_id in self.jobs if self.job_pending(job_id)]
+        if pending_jobs:
+            listed = {job["id"]: job for job in self.gi.jobs.get_jobs(
+                date_range_min=self._since, limit=JOB_LIMIT)}
+            for job_id in pending_jobs:
+                job = listed.get(job_id) or self.gi.jobs.show_job(job_id)
+                previous = self.jobs[job_id]
+                if (previous is None or previous["state"] != job["state"]
+                        or previous.get("update_time") != job.get("update_time")):
+                    self.jobs[job_id] = job
+                    changes.append(("job", job_id, job))
+
+        pending_histories = [history_id for history_id in self.histories
+                             if self.history_pending(history_id)]
+        if pending_histories:
+            summaries = {history["id"]: history for history in self.gi.histories.get_histories()}
+            for history_id in pending_histories:
+                # Histories missing from the list (e.g. shared by another
+                # user) are shown one by one
+                summary = summaries.get(history_id) or self._show_history(history_id)
+                if summary is None:
+                    self.histories[history_id] = {"update_time": None, "contents": [],
+                                                  "error": "not found"}
+                    changes.append(("history", history_id, []))
+                    continue
+                previous = self.histories[history_id]
+                if previous is not None and previous["update_time"] == summary["update_time"]:
+                    continue
+                contents = self.gi.histories.show_history(
+                    history_id=history_id, contents=True, deleted=False)
+                self.histories[history_id] = {"update_time": summary["update_time"],
+                                              "contents": contents}
+                changes.append(("history", history_id, contents))
+
+        for kind, identifier, value in changes:
+            for callback in self._listeners:
+                callback(kind, identifier, value)
+        return changes
+
+    def _show_history(self, history_id):
+        """summary of a history, None if it does not exist or was purged"""
+        try:
+            summary = self.gi.histories.show_history(history_id)
+        except GalaxyConnectionError as error:
+            if getattr(error, "status_code", None) in (400, 404):
+                return None
+            raise
+        return None if summary.get("purged") else summary
+
+    def next_delay(self, changed):
+        """delay before the next cycle, with exponential backoff and jitter"""
+        if changed:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.factor, self.max_interval)
+        return self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _poll_safely(self):
+        try:
+            return self.poll_once()
+        except (GalaxyConnectionError, requests.RequestException) as error:
+            # Unreachable server: retried after a longer delay
+            logger.warning("Galaxy poll failed: %s", error)
+            return []
+
+    def wait(self):
+        """Poll until no watched job or history is pending."""
+        while self.pending():
+            changes = self._poll_safely()
+            if self.pending():
+                time.sleep(self.next_delay(bool(changes)))
+
+    # ------------------------------------------------------------------------
+    # Async API
+
+    async def run(self):
+        """Poll until no watched job or history is pending, without blocking the loop."""
+        if self._changed is None:
+            self._changed = asyncio.Condition()
+        self._running = True
+        try:
+            while self.pending():
+                changes = await asyncio.to_thread(self._poll_safely)
+                async with self._changed:
+                    self._changed.notify_all()
+                if self.pending():
+                    await asyncio.sleep(self.next_delay(bool(changes)))
+        finally:
+            self._running = False
+            async with self._changed:
+                self._changed.notify_all()
+
+    def _ensure_runner(self):
+        loop = asyncio.get_running_loop()
+        if self._runner is None or self._runner.done() or self._runner.get_loop() is not loop:
+            self._changed = asyncio.Condition()
+            self._running = True
+            self._runner = loop.create_task(self.run())
+
+    async def _wait_for(self, finished):
+        self._ensure_runner()
+        async with self._changed:
+            await self._changed.wait_for(lambda: finished() or not self._running)
+        if not finished():
+            # The runner stopped early: raise its error
+            await self._runner
+
+    async def wait_jobs(self, job_ids):
+        """wait for jobs to finish and return them by id"""
+        for job_id in job_ids:
+            self.watch_job(job_id)
+        await self._wait_for(lambda: not any(self.job_pending(job_id) for job_id in job_ids))
+        return {job_id: self.jobs[job_id] for job_id in job_ids}
+
+    async def wait_job(self, job_id):
+        return (await self.wait_jobs([job_id]))[job_id]
+
+    async def wait_history(self, history_id):
+        """
+        wait for the datasets of a history to be ready and return its
+        contents; raise HistoryNotFound if the history does not exist
+        """
+        self.watch_history(history_id)
+        await self._wait_for(lambda: not self.history_pending(history_id))
+        history = self.histories[history_id]
+        if history.get("error"):
+            raise HistoryNotFound(f"History {history_id} {history['error']}")
+        return history["contents"]
@@ -0,0 +1,279 @@
+"""
+Bulk, deduplicated and resumable uploads of datasets to a Galaxy history.
+
+- Files already in the history are recognised by their SHA-256, not their
+  name: the hashes of the history datasets are listed with one request and
+  matched against the local hashes with a set.
+- Files are sent in chunks through the resumable (tus) upload endpoint of
+  Galaxy, then turned into datasets by the fetch API, which also records
+  their hash. The upload URL of each file is kept in a state file, so an
+  interrupted upload restarts from the last chunk received by Galaxy.
+- Several files are uploaded concurrently by a bounded thread pool.
+- Remote files can also be fetched by Galaxy from their URL, in one
+  request for all of them.
+
+Local hashes are remembered for a given path, size and modification time,
+so multi-GB trajectories are hashed once.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+CHUNK_SIZE = 10 * 1024 * 1024
+HASH_CHUNK_SIZE = 1024 * 1024
+HASH_FUNCTION = "SHA-256"
+MAX_WORKERS = 4
+MAX_RETRIES = 5
+TIMEOUT = 60
+TUS_VERSION = "1.0.0"
+DEFAULT_STATE_FILE = os.path.join(os.path.expanduser("~"), ".cache", "mdverse", "galaxy_uploads.json")
+
+
+def file_hash(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def get_extension(path):
+    return os.path.basename(path).split(".")[-1]
+
+
+class UploadState:
+    """
+    hashes of local files, upload URLs in progress and datasets asked to
+    compute their hash, saved in a JSON file
+    """
+
+    def __init__(self, path=DEFAULT_STATE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        self.hashes = data.get("hashes", {})
+        self.uploads = data.get("uploads", {})
+        self.hash_requests = data.get("hash_requests", {})
+
+    def save(self):
+        with self._lock:
+            self._write()
+
+    def _write(self):
+        # called with _lock held, so the dicts do not change while serialized
+        data = json.dumps({"hashes": self.hashes, "uploads": self.uploads,
+                           "hash_requests": self.hash_requests})
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".galaxy_uploads.")
+        with os.fdopen(fd, "w") as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+    def get(self, table, key):
+        """value of key in one of the dicts of the state, None if missing"""
+        with self._lock:
+            return getattr(self, table).get(key)
+
+    def set(self, table, key, value, save=True):
+        """set (or remove, if value is None) key in one of the dicts of the state"""
+        with self._lock:
+            if value is None:
+                getattr(self, table).pop(key, None)
+            else:
+                getattr(self, table)[key] = value
+            if save:
+                self._write()
+
+    def file_hash(self, path):
+        stat = os.stat(path)
+        signature = f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+        sha256 = self.get("hashes", signature)
+        if sha256 is None:
+            # Hashed outside the lock, files are hashed in parallel
+            sha256 = file_hash(path)
+            self.set("hashes", signature, sha256)
+        return sha256
+
+
+class UploadManager:
+
+    def __init__(self, gi, max_workers=MAX_WORKERS, chunk_size=CHUNK_SIZE,
+                 state_file=DEFAULT_STATE_FILE):
+        self.gi = gi
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.state = UploadState(state_file)
+        self.session = requests.Session()
+        self.session.headers["x-api-key"] = gi.key
+
+    # ------------------------------------------------------------------------
+    # History contents
+
+    def history_hashes(self, history_id):
+        """
+        dataset id of each SHA-256 of the history, with one request; datasets
+        without a hash are asked once to compute it, for the next uploads
+        """
+        response = self.gi.make_get_request(
+            f"{self.gi.url}/histories/{history_id}/contents",
+            params={"v": "dev", "keys": "id,name,state,deleted,hashes"})
+        response.raise_for_status()
+        hashes = {}
+        requested = False
+        for hda in response.json():
+            if hda.get("deleted") or hda.get("state") in ("error", "discarded"):
+                continue
+            values = [h["hash_value"] for h in hda.get("hashes") or []
+                      if h["hash_function"] == HASH_FUNCTION]
+            key = f"{self.gi.url}:{hda['id']}"
+            if not values and self.state.get("hash_requests", key) is None:
+                self.gi.make_put_request(f"{self.gi.url}/datasets/{hda['id']}/hash",
+                                         payload={"hash_function": HASH_FUNCTION})
+                self.state.set("hash_requests", key, time.time(), save=False)
+                requested = True
+            for value in values:
+                hashes[value] = hda["id"]
+        if requested:
+            self.state.save()
+        return hashes
+
+    # ------------------------------------------------------------------------
+    # Resumable upload
+
+    def _tus_upload(self, path, sha256):
+        """send a file in chunks and return its upload session id"""
+        size = os.path.getsize(path)
+        key = f"{self.gi.url}:{sha256}"
+        location = self.state.get("uploads", key)
+        offset = None
+        if location is not None:
+            response = self.session.head(location, headers={"Tus-Resumable": TUS_VERSION},
+                                         timeout=TIMEOUT)
+            if response.status_code == 200:
+                offset = int(response.headers["Upload-Offset"])
+        if offset is None:
+            metadata = "filename " + base64.b64encode(os.path.basename(path).encode()).decode()
+            response = self.session.post(
+                f"{self.gi.url}/upload/resumable_upload/",
+                headers={"Tus-Resumable": TUS_VERSION, "Upload-Length": str(size),
+                         "Upload-Metadata": metadata},
+                timeout=TIMEOUT)
+            response.raise_for_status()
+            location = requests.compat.urljoin(f"{self.gi.url}/upload/resumable_upload/",
+                                               response.headers["Location"])
+            self.state.set("uploads", key, location)
+            offset = 0
+
+        with open(path, "rb") as f:
+            retries = 0
+            while offset < size:
+                f.seek(offset)
+                chunk = f.read(self.chunk_size)
+                try:
+                    response = self.session.patch(
+                        location, data=chunk, timeout=TIMEOUT,
+                        headers={"Tus-Resumable": TUS_VERSION, "Upload-Offset": str(offset),
+                                 "Content-Type": "application/offset+octet-stream"})
+                    response.raise_for_status()
+                    offset = int(response.headers["Upload-Offset"])
+                    retries = 0
+                except (requests.ConnectionError, requests.Timeout) as error:
+                    retries += 1
+                    if retries > MAX_RETRIES:
+                        raise
+                    print(f"Upload of {path} interrupted ({error}), resuming")
+                    time.sleep(min(2 ** retries, 30))
+                    response = self.session.head(location, timeout=TIMEOUT,
+                                                 headers={"Tus-Resumable": TUS_VERSION})
+                    if response.ok:
+                        offset = int(response.headers["Upload-Offset"])
+        return location.rstrip("/").rsplit("/", 1)[-1]
+
+    def upload_file(self, history_id, path, sha256=None, file_type=None):
+        """upload one file and return the id of its dataset"""
+        sha256 = sha256 or self.state.file_hash(path)
+        session_id = self._tus_upload(path, sha256)
+        name = os.path.basename(path)
+        payload = {
+            "history_id": history_id,
+            "targets": [{
+                "destination": {"type": "hdas"},
+                "elements": [{
+                    "src": "files",
+                    "name": name,
+                    "ext": file_type or get_extension(path),
+                    "hashes": [{"hash_function": HASH_FUNCTION, "hash_value": sha256}],
+                }],
+            }],
+            "files_0|file_data": {"session_id": session_id, "name": name},
+        }
+        response = self.gi.make_post_request(f"{self.gi.url}/tools/fetch", payload=payload)
+        self.state.set("uploads", f"{self.gi.url}:{sha256}", None)
+        return response["outputs"][0]["id"]
+
+    # ------------------------------------------------------------------------
+    # Bulk upload
+
+    def history_names(self, history_id):
+        """names of the datasets of a history, with one request"""
+        response = self.gi.make_get_request(
+            f"{self.gi.url}/histories/{history_id}/contents",
+            params={"v": "dev", "keys": "id,name,deleted,state"})
+        response.raise_for_status()
+        return {hda["name"] for hda in response.json()
+                if not hda.get("deleted") and hda.get("state") not in ("error", "discarded")}
+
+    def upload_urls(self, history_id, files):
+        """
+        let Galaxy download remote files, given as (name, url) pairs, in one
+        fetch request; the content of a remote file is not known before it
+        is downloaded, so the files of the history are matched by name
+        """
+        present = self.history_names(history_id)
+        elements = [{"src": "url", "url": url, "name": name, "ext": get_extension(name).lower()}
+                    for name, url in files if name not in present]
+        print(f"{len(files) - len(elements)} file(s) already in the history, {len(elements)} to fetch")
+        if not elements:
+            return []
+        payload = {"history_id": history_id,
+                   "targets": [{"destination": {"type": "hdas"}, "elements": elements}]}
+        response = self.gi.make_post_request(f"{self.gi.url}/tools/fetch", payload=payload)
+        return [output["id"] for output in response["outputs"]]
+
+    def upload(self, history_id, paths):
+        """
+        upload the files missing from a history, max_workers at a time, and
+        return the dataset id of every path
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            hashes = dict(zip(paths, executor.map(self.state.file_hash, paths)))
+        present = self.history_hashes(history_id)
+        datasets = {path: present[sha256] for path, sha256 in hashes.items() if sha256 in present}
+
+        # Identical files given twice are uploaded once
+        to_upload = {}
+        for path, sha256 in hashes.items():
+            if sha256 not in present:
+                to_upload.setdefault(sha256, path)
+        print(f"{len(datasets)} file(s) already in the history, {len(to_upload)} to upload")
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {sha256: executor.submit(self.upload_file, history_id, path, sha256)
+                       for sha256, path in to_upload.items()}
+            uploaded = {sha256: future.result() for sha256, future in futures.items()}
+        for path, sha256 in hashes.items():
+            datasets.setdefault(path, uploaded.get(sha256))
+        return datasets
@@ -0,0 +1,96 @@
+"""BatchRunner against fake_galaxy.FakeGalaxy, with a real bioblend client."""
+
+import os
+
+import pytest
+
+pytest.importorskip("bioblend")
+
+from bioblend.galaxy import GalaxyInstance
+
+import galaxy_batch
+from fake_galaxy import FakeGalaxy
+from galaxy_monitor import GalaxyMonitor
+
+TOOL_ID = "gmx_rmsd"
+DATASETS = {
+    "ds0": [("a.xtc", "http://example.org/a.xtc"), ("a.pdb", "http://example.org/a.pdb"),
+            ("readme.txt", "http://example.org/readme.txt")],
+    "ds1": [("b.xtc", "http://example.org/b.xtc"), ("b.pdb", "http://example.org/b.pdb")],
+    "none": [("notes.txt", "http://example.org/notes.txt")],
+}
+
+
+class Crash(BaseException):
+    """the process dying, which no step of a dataset catches"""
+
+
+@pytest.fixture
+def galaxy():
+    server = FakeGalaxy(step=0.02)
+    url = server.start()
+    server.add_tool(TOOL_ID, {"traj": ["xtc", "trr"], "struct": ["pdb", "gro"]})
+    yield server, GalaxyInstance(url=url, key="fake")
+    server.stop()
+
+
+def make_runner(gi, tmp_path):
+    monitor = GalaxyMonitor(gi, min_interval=0.02, max_interval=0.1)
+    return galaxy_batch.BatchRunner(gi, TOOL_ID, str(tmp_path / "outputs"),
+                                    str(tmp_path / "checkpoint.jsonl"),
+                                    submit_rate=100, monitor=monitor)
+
+
+def test_batch_downloads_outputs_and_skips_done(galaxy, tmp_path):
+    server, gi = galaxy
+    results = make_runner(gi, tmp_path).run(DATASETS)
+
+    assert results["ds0"]["status"] == galaxy_batch.DONE
+    assert results["ds1"]["status"] == galaxy_batch.DONE
+    assert results["none"]["status"] == galaxy_batch.SKIPPED
+    assert os.listdir(tmp_path / "outputs" / "ds0") == ["output.tabular"]
+    assert len(server.jobs) == 2
+
+    n_requests = len(server.requests)
+    make_runner(gi, tmp_path).run(DATASETS)
+    assert len(server.requests) == n_requests
+
+
+def test_resume_after_crash_while_submitting(galaxy, tmp_path):
+    server, gi = galaxy
+    run_tool = gi.tools.run_tool
+
+    def run_tool_then_crash(*args, **kwargs):
+        run_tool(*args, **kwargs)
+        raise Crash()
+
+    gi.tools.run_tool = run_tool_then_crash
+    with pytest.raises(Crash):
+        make_runner(gi, tmp_path).run({"ds0": DATASETS["ds0"]})
+    gi.tools.run_tool = run_tool
+
+    checkpoint = galaxy_batch.Checkpoint(str(tmp_path / "checkpoint.jsonl"))
+    assert checkpoint.get("ds0")["status"] == galaxy_batch.SUBMITTING
+    assert len(server.jobs) == 1
+
+    results = make_runner(gi, tmp_path).run({"ds0": DATASETS["ds0"]})
+    # The job submitted before the crash is adopted, not submitted again
+    assert results["ds0"]["status"] == galaxy_batch.DONE
+    assert results["ds0"]["job_ids"] == list(server.jobs)
+    assert len(server.jobs) == 1
+
+
+def test_checkpoint_journal_is_replayed_and_compacted(tmp_path):
+    path = str(tmp_path / "checkpoint.jsonl")
+    checkpoint = galaxy_batch.Checkpoint(path)
+    for step in range(5):
+        checkpoint.update("ds0", status=galaxy_batch.STAGED, step=step)
+    checkpoint.update("ds1", status=galaxy_batch.FAILED)
+    with open(path, "a") as f:
+        f.write('{"dataset_id": "ds1", "sta')
+
+    checkpoint = galaxy_batch.Checkpoint(path)
+    assert checkpoint.get("ds0") == {"status": galaxy_batch.STAGED, "step": 4}
+    assert checkpoint.get("ds1") == {"status": galaxy_batch.FAILED}
+    with open(path) as f:
+        assert len(f.readlines()) == 2
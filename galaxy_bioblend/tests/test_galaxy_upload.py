@@ -0,0 +1,78 @@
+"""UploadState under concurrent updates, and UploadManager against fake_galaxy.FakeGalaxy."""
+
+import json
+import threading
+
+import pytest
+
+pytest.importorskip("bioblend")
+
+from bioblend.galaxy import GalaxyInstance
+
+from fake_galaxy import FakeGalaxy
+from galaxy_upload import UploadManager, UploadState
+
+
+def test_state_saved_while_updated_from_threads(tmp_path):
+    state = UploadState(str(tmp_path / "state.json"))
+    errors = []
+
+    def update(worker):
+        try:
+            for i in range(200):
+                state.set("uploads", f"{worker}:{i}", f"http://galaxy/upload/{i}", save=False)
+                state.set("hashes", f"{worker}:{i}", "0" * 64, save=i % 20 == 0)
+                state.set("uploads", f"{worker}:{i}", None, save=False)
+        except Exception as error:
+            errors.append(error)
+
+    def save():
+        try:
+            for _ in range(200):
+                state.save()
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=update, args=(worker,)) for worker in range(4)]
+    threads.append(threading.Thread(target=save))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    state.save()
+
+    assert errors == []
+    with open(tmp_path / "state.json") as f:
+        data = json.load(f)
+    assert len(data["hashes"]) == 4 * 200
+    assert data["uploads"] == {}
+
+
+def test_parallel_upload_is_deduplicated_and_resumable(tmp_path):
+    server = FakeGalaxy(step=0.02)
+    gi = GalaxyInstance(url=server.start(), key="fake")
+    try:
+        history_id = server.add_history("uploads")
+        paths = []
+        for i in range(6):
+            path = tmp_path / f"file{i}.txt"
+            # Two copies of each content
+            path.write_text(f"content {i // 2}\n")
+            paths.append(str(path))
+        state_file = str(tmp_path / "state.json")
+
+        datasets = UploadManager(gi, max_workers=4, state_file=state_file).upload(history_id, paths)
+
+        assert len(set(datasets.values())) == 3
+        assert datasets[paths[0]] == datasets[paths[1]]
+        with open(state_file) as f:
+            data = json.load(f)
+        assert len(data["hashes"]) == 6
+        assert data["uploads"] == {}
+
+        n_datasets = len(server.datasets)
+        again = UploadManager(gi, max_workers=4, state_file=state_file).upload(history_id, paths)
+        assert again == datasets
+        assert len(server.datasets) == n_datasets
+    finally:
+        server.stop()
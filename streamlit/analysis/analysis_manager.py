@@ -1,15 +1,22 @@
-from pathlib import Path
 import streamlit as st
-from analysis.structural import rmsd
+from analysis import fetcher, scheduler
+from analysis.structural import dynamics, rmsd
+from analysis.tools import registry, run_tool
+from catalog.capabilities import Capability, file_extensions
 
-def get_ext(path_str: str):
-    return Path(path_str).suffix
+# Analyses offered for the datasets whose files satisfy their requirements.
+CAPABILITIES = [
+    Capability("RMSD", "Structural", rmsd.REQUIRED_FILES),
+] + [
+    Capability(name, "Structural", dynamics.REQUIRED_FILES) for name in dynamics.ANALYSES
+]
 
-def init_analysis_tools():
+def init_analysis_tools(data):
 
     st.session_state["available_analyses_by_type"] = {
         "Structural" : [],
-        "Composition" : []
+        "Composition" : [],
+        "Galaxy tools" : []
     }
 
     analysis_type_option = st.selectbox(
@@ -19,32 +26,148 @@ def init_analysis_tools():
 
     st.session_state["analysis_type"] = analysis_type_option
 
-    check_files()
+    check_files(data)
 
     call_tool()
 
-def check_files():
+def check_files(data):
 
-    extension_file_df = st.session_state["files"]["File name"].apply(get_ext)
-    extension_counts = extension_file_df.value_counts()
+    codes = data["index"].search(st.session_state["querydatasetid"])
+    for capability in data["capabilities"].analyses_for(codes):
+        st.session_state["available_analyses_by_type"][capability.analysis_type].append(capability.name)
 
-    one_pdb = extension_counts.get('.pdb', 0) == 1
-    one_trr = extension_counts.get('.trr', 0) == 1
+    # All the structural analyses read the same structure and trajectory.
+    if st.session_state["available_analyses_by_type"]["Structural"]:
+        prefetch_inputs(rmsd.select_inputs(st.session_state["files"]))
 
-    if (one_pdb and one_trr):
-        st.session_state["available_analyses_by_type"]["Structural"].append("RMSD")
+    formats = file_extensions(st.session_state["files"]["File name"]).unique()
+    st.session_state["available_analyses_by_type"]["Galaxy tools"] = [
+        tool.id for tool in registry.get_registry().tools_for_formats(formats)
+    ]
 
     analysis_type_option = st.session_state["analysis_type"]
 
     st.session_state["analysis_option"] = st.selectbox(
         "Available analyses:",
-        st.session_state["available_analyses_by_type"][analysis_type_option]
+        st.session_state["available_analyses_by_type"][analysis_type_option],
+        format_func=get_analysis_label
     )
 
     # analysis_count = len(st.session_state["available_analyses_by_type"][analysis_type_option])
 
+def prefetch_inputs(files):
+    """Start downloading the inputs of an available analysis in the background."""
+    prefetched = st.session_state.setdefault("prefetched_urls", set())
+    to_fetch = files[~files["URL"].isin(prefetched)]
+    if to_fetch.empty:
+        return
+    fetcher.get_fetcher().prefetch(to_fetch)
+    prefetched.update(to_fetch["URL"])
+
+def get_analysis_label(analysis):
+    """Name of a Galaxy tool from its id; native analyses are shown as is."""
+    tool = registry.get_registry().get(analysis)
+    return tool.name if tool is not None else analysis
+
+def select_tool_inputs(tool, files):
+    """Return, for each data parameter of a tool, the files it accepts."""
+    formats = file_extensions(files["File name"])
+    inputs = {}
+    for param in tool.inputs:
+        if param.is_data:
+            accepted = files[formats.isin(param.formats)]
+            inputs[param.name] = accepted if param.type == "data_collection" else accepted.iloc[:1]
+    return inputs
+
+class ToolSubmission:
+    """A Galaxy tool waiting for its inputs, then queued on the local scheduler.
+
+    ``job_id`` is set once the tool is queued, ``error`` if the download of
+    the inputs or the submission failed.
+    """
+
+    def __init__(self, tool, values, inputs):
+        self.tool = tool
+        self.values = dict(values)
+        self.inputs = inputs
+        self.job_id = None
+        self.error = None
+
+    def submit(self, fetch_job):
+        """Queue the tool once its inputs are downloaded (see FetchJob.add_done_callback)."""
+        try:
+            paths = fetch_job.result()
+            values = dict(self.values)
+            for param in self.tool.inputs:
+                if param.is_data:
+                    data = [registry.DataValue(paths[url]) for url in self.inputs[param.name]["URL"]]
+                    values[param.name] = data if param.type == "data_collection" else data[0]
+            self.job_id = run_tool.submit_tool(self.tool, values)
+        except Exception as error:
+            self.error = str(error)
+
+def submit_tool(tool, values):
+    """Download the inputs of a Galaxy tool in the background, then queue it
+    on the local scheduler, and remember its submission."""
+    inputs = select_tool_inputs(tool, st.session_state["files"])
+    fetch_job = fetcher.get_fetcher().fetch(
+        st.session_state["files"].loc[
+            sorted({index for files in inputs.values() for index in files.index})
+        ]
+    )
+    submission = ToolSubmission(tool, values, inputs)
+    st.session_state.setdefault("tool_submissions", []).append(submission)
+    # The callback returns at once, the tool is queued by a download thread.
+    fetch_job.add_done_callback(submission.submit)
+    return submission
+
+def get_tool_jobs_status():
+    """Return the label and status of the tools submitted by this session."""
+    submissions = st.session_state.get("tool_submissions", [])
+    queued = [submission.job_id for submission in submissions if submission.job_id is not None]
+    statuses = scheduler.get_scheduler().statuses(queued) if queued else {}
+    jobs = []
+    for submission in submissions:
+        if submission.error is not None:
+            jobs.append((submission.tool.name, f"failed ({submission.error})"))
+        elif submission.job_id is None:
+            jobs.append((submission.tool.name, "downloading inputs"))
+        else:
+            jobs.append((f"Job {submission.job_id}", statuses.get(submission.job_id)))
+    return jobs
+
+def init_galaxy_tool(tool):
+    """Form of the parameters of a Galaxy tool, and the jobs of the session."""
+    st.caption(tool.description)
+    values = {}
+    for param in tool.inputs:
+        key = f"{tool.id}_{param.name}"
+        if param.is_data:
+            continue
+        if param.type == "integer":
+            values[param.name] = st.number_input(
+                param.label, value=param.default or 0, step=1,
+                min_value=int(param.min) if param.min is not None else None, key=key
+            )
+        elif param.type == "float":
+            values[param.name] = st.number_input(param.label, value=param.default or 0.0, key=key)
+        elif param.type == "boolean":
+            values[param.name] = st.checkbox(param.label, value=bool(param.default), key=key)
+        else:
+            values[param.name] = st.text_input(param.label, value=param.default or "", key=key)
+    st.button("Submit", type="primary", on_click=submit_tool, args=(tool, values))
+
+    for label, status in get_tool_jobs_status():
+        st.write(f"{label}: {status}")
+
 def call_tool():
     match st.session_state["analysis_option"]:
         case "RMSD":
             rmsd.init_rmsd()
+        case analysis if analysis in dynamics.ANALYSES:
+            dynamics.init_dynamics(analysis)
+        case None:
+            pass
+        case tool_id:
+            init_galaxy_tool(registry.get_registry().get(tool_id))
         
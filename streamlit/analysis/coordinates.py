@@ -0,0 +1,77 @@
+"""Coordinates of atom selections shared by the structural analyses.
+
+The trajectories of a dataset are decoded once per atom selection and frame
+slice into a float32 array on disk (see
+``analysis.tools.mdanalysis.coordinate_cache``), which every later analysis
+of the same selection memory-maps instead of reading the trajectory again.
+Entries are keyed by the content of the input files, so they are invalidated
+when the files change, and evicted least recently used first under a byte
+budget. Configuration is read from the environment:
+
+- ``MDVERSE_COORDINATES_DIR``: cache directory (defaults to the
+  ``coordinates`` directory of the catalog cache).
+- ``MDVERSE_COORDINATES_MAX_BYTES``: byte budget of the cache (defaults to
+  10 GB).
+
+Files from the download cache are keyed by the content hash their name
+already holds, so they are not hashed again.
+"""
+
+import os
+from pathlib import Path
+
+from analysis import download
+from analysis.tools.mdanalysis.coordinate_cache import CoordinateCache, SelectionReader
+from catalog import cache
+
+DEFAULT_MAX_BYTES = 10 * 1024**3
+
+
+def get_coordinates_dir() -> Path:
+    """Return the coordinate cache directory configured for this process."""
+    coordinates_dir = os.environ.get("MDVERSE_COORDINATES_DIR")
+    if coordinates_dir:
+        return Path(coordinates_dir).expanduser()
+    return cache.get_cache_dir() / "coordinates"
+
+
+def get_max_bytes() -> int:
+    """Return the byte budget of the coordinate cache."""
+    return int(os.environ.get("MDVERSE_COORDINATES_MAX_BYTES", DEFAULT_MAX_BYTES))
+
+
+_coordinate_cache = None
+
+
+def get_coordinate_cache() -> CoordinateCache:
+    """Return the coordinate cache of this process."""
+    global _coordinate_cache
+    if _coordinate_cache is None:
+        _coordinate_cache = CoordinateCache(str(get_coordinates_dir()), get_max_bytes())
+    return _coordinate_cache
+
+
+def open_selection(topology: Path, trajectory: Path, selection: str) -> SelectionReader:
+    """Open the coordinates of an atom selection over a whole trajectory.
+
+    Parameters
+    ----------
+    topology: Path
+        Structure file.
+    trajectory: Path
+        Trajectory file.
+    selection: str
+        Atoms to read, in the MDAnalysis selection language.
+
+    Returns
+    -------
+    SelectionReader
+        Reader of the coordinates by chunks of frames, from the cache if
+        they are there. Closing it stores the coordinates once every frame
+        was read.
+    """
+    file_cache = download.FileCache()
+    file_hashes = (file_cache.content_hash(topology), file_cache.content_hash(trajectory))
+    return SelectionReader(
+        get_coordinate_cache(), str(topology), str(trajectory), selection, file_hashes=file_hashes
+    )
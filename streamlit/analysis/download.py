@@ -0,0 +1,252 @@
+"""Streaming, resumable and cached downloads of the catalog files.
+
+Files are streamed to disk in chunks and interrupted transfers are resumed
+with HTTP ``Range`` requests. Completed files are stored by content hash in a
+local cache shared by all the sessions and processes, with least recently
+used eviction under a byte budget. Configuration is read from the
+environment:
+
+- ``MDVERSE_DOWNLOAD_DIR``: cache directory (defaults to the ``downloads``
+  directory of the catalog cache).
+- ``MDVERSE_DOWNLOAD_MAX_BYTES``: byte budget of the cache (defaults to 20 GB).
+"""
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import time
+from email.message import Message
+from pathlib import Path
+
+import requests
+
+from catalog import cache
+
+CHUNK_SIZE = 1024 * 1024
+DEFAULT_MAX_BYTES = 20 * 1024**3
+MAX_RETRIES = 5
+TIMEOUT = 30
+
+logger = logging.getLogger(__name__)
+
+
+def get_download_dir() -> Path:
+    """Return the download cache directory configured for this process."""
+    download_dir = os.environ.get("MDVERSE_DOWNLOAD_DIR")
+    if download_dir:
+        return Path(download_dir).expanduser()
+    return cache.get_cache_dir() / "downloads"
+
+
+def get_max_bytes() -> int:
+    """Return the byte budget of the download cache."""
+    return int(os.environ.get("MDVERSE_DOWNLOAD_MAX_BYTES", DEFAULT_MAX_BYTES))
+
+
+def _hash_file(path: Path) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class FileCache:
+    """Content-addressed cache of downloaded files.
+
+    Layout of the cache directory:
+
+    - ``objects/<sha256><suffix>``: the files, named after their content,
+      with the suffix of their file name;
+    - ``urls/<sha1 of url>.json``: which object a URL resolved to;
+    - ``partial/<sha1 of url>.part``: transfers in progress.
+
+    Parameters
+    ----------
+    root: Path
+        Cache directory, defaults to ``get_download_dir()``.
+    max_bytes: int
+        Byte budget, defaults to ``get_max_bytes()``.
+    """
+
+    def __init__(self, root: Path | None = None, max_bytes: int | None = None):
+        self.root = Path(root or get_download_dir())
+        self.max_bytes = get_max_bytes() if max_bytes is None else max_bytes
+        for name in ("objects", "urls", "partial"):
+            (self.root / name).mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def _url_key(url: str) -> str:
+        return hashlib.sha1(url.encode()).hexdigest()
+
+    def lock(self, url: str):
+        """Return an open lock file; ``flock`` it to own the URL's transfer."""
+        return open(self.root / "partial" / f"{self._url_key(url)}.lock", "w")
+
+    def partial_path(self, url: str) -> Path:
+        """Return the path of the in-progress transfer of a URL."""
+        return self.root / "partial" / f"{self._url_key(url)}.part"
+
+    def get(
+        self, url: str, expected_size: int | None = None, file_name: str | None = None
+    ) -> Path | None:
+        """Return the cached file of a URL, or None on a miss.
+
+        Objects whose suffix is not the one of ``file_name``, when given, are
+        misses: they were cached with the suffix of a URL not ending with the
+        file name.
+        """
+        try:
+            with open(self.root / "urls" / f"{self._url_key(url)}.json") as ref_file:
+                ref = json.load(ref_file)
+        except (OSError, ValueError):
+            return None
+        path = self.root / "objects" / ref["object"]
+        if not path.is_file():
+            return None
+        if expected_size is not None and path.stat().st_size != expected_size:
+            return None
+        if file_name is not None and path.suffix != Path(file_name).suffix:
+            return None
+        # The modification time records the last use for the LRU eviction.
+        os.utime(path)
+        return path
+
+    def put(self, url: str, path: Path, file_name: str | None = None) -> Path:
+        """Move a completed download into the cache and return its new path.
+
+        The suffix of the object is the one of ``file_name``, or of the URL
+        path when it is not given.
+        """
+        object_name = _hash_file(path) + Path(file_name or url.split("?")[0]).suffix
+        object_path = self.root / "objects" / object_name
+        os.replace(path, object_path)
+        ref_path = self.root / "urls" / f"{self._url_key(url)}.json"
+        tmp_path = ref_path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps({"url": url, "object": object_name}))
+        os.replace(tmp_path, ref_path)
+        self.evict(keep=object_path)
+        return object_path
+
+    def content_hash(self, path: Path) -> str | None:
+        """Return the sha256 of a cached file (or of a link to it), None if not cached."""
+        path = Path(path).resolve()
+        if path.parent != (self.root / "objects").resolve():
+            return None
+        return path.name[:64]
+
+    def evict(self, keep: Path | None = None) -> None:
+        """Remove the least recently used objects until the budget is met."""
+        objects = []
+        for path in (self.root / "objects").iterdir():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            objects.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in objects)
+        for _, size, path in sorted(objects, key=lambda item: item[0]):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            path.unlink(missing_ok=True)
+            total -= size
+
+
+def _attachment_name(response: requests.Response) -> str | None:
+    """Return the file name of the Content-Disposition header, if any."""
+    header = response.headers.get("Content-Disposition")
+    if not header:
+        return None
+    message = Message()
+    message["Content-Disposition"] = header
+    return message.get_filename()
+
+
+def _stream_to(response: requests.Response, part_path: Path, mode: str, progress) -> None:
+    with open(part_path, mode) as part_file:
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+            part_file.write(chunk)
+            if progress is not None:
+                progress(len(chunk))
+
+
+def download_file(
+    url: str,
+    expected_size: int | None = None,
+    file_cache: FileCache | None = None,
+    session: requests.Session | None = None,
+    progress=None,
+    file_name: str | None = None,
+) -> Path:
+    """Download a file to the local cache, resuming interrupted transfers.
+
+    Parameters
+    ----------
+    url: str
+        URL of the file.
+    expected_size: int
+        Size from the catalog; the download fails if it does not match.
+    file_cache: FileCache
+        Cache to use, defaults to a cache configured from the environment.
+    session: requests.Session
+        Session used for the requests, defaults to bare ``requests`` calls.
+    progress: callable
+        Called with the number of bytes received after each chunk.
+    file_name: str
+        Name of the file from the catalog. URLs such as Zenodo's
+        ``/files/<name>/content`` do not end with it.
+
+    Returns
+    -------
+    Path
+        Path of the cached file. Its suffix is the one of ``file_name``, else
+        of the Content-Disposition file name, else of the URL.
+    """
+    file_cache = file_cache or FileCache()
+    http = session or requests
+    path = file_cache.get(url, expected_size, file_name)
+    if path is not None:
+        return path
+
+    with file_cache.lock(url) as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        # Another process may have completed the download while we waited.
+        path = file_cache.get(url, expected_size, file_name)
+        if path is not None:
+            return path
+
+        part_path = file_cache.partial_path(url)
+        for attempt in range(MAX_RETRIES):
+            offset = part_path.stat().st_size if part_path.exists() else 0
+            if part_path.exists() and expected_size is not None and offset >= expected_size:
+                break
+            headers = {"Range": f"bytes={offset}-"} if offset else {}
+            try:
+                with http.get(url, headers=headers, stream=True, timeout=TIMEOUT) as response:
+                    if response.status_code == 416:
+                        break
+                    response.raise_for_status()
+                    # A 200 answer to a range request restarts from scratch.
+                    mode = "ab" if response.status_code == 206 else "wb"
+                    file_name = file_name or _attachment_name(response)
+                    if progress is not None and attempt == 0 and mode == "ab":
+                        progress(offset)
+                    _stream_to(response, part_path, mode, progress)
+                # A connection closed early may end the stream without error.
+                if expected_size is None or part_path.stat().st_size >= expected_size:
+                    break
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as error:
+                logger.warning("Download of %s interrupted (%s), resuming", url, error)
+                time.sleep(min(2**attempt, 30))
+        else:
+            raise IOError(f"Download failed for {url} after {MAX_RETRIES} attempts")
+
+        size = part_path.stat().st_size
+        if expected_size is not None and size != expected_size:
+            part_path.unlink()
+            raise IOError(f"Downloaded {size} bytes for {url}, expected {expected_size}")
+        return file_cache.put(url, part_path, file_name)
@@ -0,0 +1,200 @@
+"""Background execution of analyses launched from the web application.
+
+An analysis is a function running in a worker thread. It receives an
+``AnalysisContext`` giving it an isolated working directory, a way to publish
+partial results and a cancellation flag, so the Streamlit script never
+blocks and can render the results as they arrive. Runs given a cache key
+are served from, and stored into, the shared result cache.
+
+Working directories are grouped by session in the ``sessions`` directory of
+the catalog cache. When a run starts, the directories of the sessions
+inactive for longer than ``MDVERSE_SESSIONS_MAX_AGE`` seconds (defaults to
+one day) are removed.
+"""
+
+import os
+import shutil
+import threading
+import time
+import traceback
+import uuid
+from pathlib import Path
+
+import pandas as pd
+
+from analysis import results
+from catalog import cache
+
+
+DEFAULT_SESSIONS_MAX_AGE = 24 * 3600
+
+
+class AnalysisCancelled(Exception):
+    """Raised inside an analysis when the user cancelled it."""
+
+
+def get_sessions_dir() -> Path:
+    """Return the directory of the session working directories."""
+    return cache.get_cache_dir() / "sessions"
+
+
+def get_session_dir(session_id: str) -> Path:
+    """Return the working directory of a Streamlit session."""
+    return get_sessions_dir() / session_id
+
+
+def get_sessions_max_age() -> int:
+    """Return the inactivity (s) after which a session directory is removed."""
+    return int(os.environ.get("MDVERSE_SESSIONS_MAX_AGE", DEFAULT_SESSIONS_MAX_AGE))
+
+
+def _last_activity(session_dir: Path) -> float:
+    # Creating a run updates the session directory, writing its files the
+    # run directory.
+    return max(
+        [session_dir.stat().st_mtime]
+        + [run_dir.stat().st_mtime for run_dir in session_dir.iterdir()]
+    )
+
+
+def cleanup_sessions(max_age: int | None = None, keep: str | None = None) -> None:
+    """Remove the working directories of the inactive sessions.
+
+    Parameters
+    ----------
+    max_age: int
+        Inactivity in seconds, defaults to ``get_sessions_max_age()``.
+    keep: str
+        Session never removed, typically the one starting a run.
+    """
+    max_age = get_sessions_max_age() if max_age is None else max_age
+    sessions_dir = get_sessions_dir()
+    if not sessions_dir.is_dir():
+        return
+    oldest = time.time() - max_age
+    for session_dir in sessions_dir.iterdir():
+        if session_dir.name == keep:
+            continue
+        try:
+            inactive = _last_activity(session_dir) < oldest
+        except OSError:
+            # Removed by another process meanwhile.
+            continue
+        if inactive:
+            shutil.rmtree(session_dir, ignore_errors=True)
+
+
+class AnalysisContext:
+    """What an analysis function can use while it runs.
+
+    Parameters
+    ----------
+    run: AnalysisRun
+        The run executing the analysis.
+    """
+
+    def __init__(self, run: "AnalysisRun"):
+        self._run = run
+        self.workdir = run.workdir
+
+    def emit(self, chunk: pd.DataFrame) -> None:
+        """Publish a chunk of results."""
+        self._run._add_chunk(chunk)
+
+    def set_message(self, message: str) -> None:
+        """Describe what the analysis is currently doing."""
+        self._run.message = message
+
+    @property
+    def cancelled(self) -> bool:
+        return self._run._cancel_event.is_set()
+
+    def check_cancelled(self) -> None:
+        """Stop the analysis if the user cancelled it."""
+        if self.cancelled:
+            raise AnalysisCancelled()
+
+
+class AnalysisRun:
+    """An analysis running in a background thread.
+
+    Parameters
+    ----------
+    function: callable
+        Analysis to run, called with an AnalysisContext followed by ``args``.
+        The table it returns is the one cached; when it returns None, the
+        chunks it published are cached in the order they came.
+    session_id: str
+        Session launching the analysis, whose working directory is used.
+    args:
+        Arguments of the analysis.
+    cache_key: str
+        Key of the run in the result cache (see ``results.result_key``);
+        the run is not cached when None.
+    """
+
+    def __init__(self, function, session_id: str, *args, cache_key: str | None = None):
+        self.run_id = uuid.uuid4().hex
+        cleanup_sessions(keep=session_id)
+        self.workdir = get_session_dir(session_id) / self.run_id
+        self.workdir.mkdir(parents=True)
+        self.status = "running"
+        self.message = "Starting..."
+        self.error = None
+        self.chunks = []
+        self._lock = threading.Lock()
+        self._cancel_event = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, args=(function, args, cache_key), daemon=True,
+            name=f"analysis-{self.run_id}",
+        )
+        self._thread.start()
+
+    def _run(self, function, args, cache_key) -> None:
+        try:
+            if cache_key is not None:
+                cached = results.get_result_cache().get(cache_key)
+                if cached is not None:
+                    self.message = "Results served from the cache."
+                    self._add_chunk(cached)
+                    self.status = "done"
+                    return
+            table = function(AnalysisContext(self), *args)
+            if cache_key is not None:
+                if table is None:
+                    table = self.results()
+                results.get_result_cache().put(cache_key, table)
+            self.status = "done"
+        except AnalysisCancelled:
+            self.status = "cancelled"
+        except Exception as error:
+            traceback.print_exc()
+            self.error = error
+            self.status = "failed"
+
+    def _add_chunk(self, chunk: pd.DataFrame) -> None:
+        with self._lock:
+            self.chunks.append(chunk)
+
+    def is_running(self) -> bool:
+        return self.status == "running"
+
+    def cancel(self) -> None:
+        """Ask the analysis to stop at its next check."""
+        self._cancel_event.set()
+
+    def get_chunks(self, start: int = 0) -> list:
+        """Return the chunks published since the ``start``-th one."""
+        with self._lock:
+            return self.chunks[start:]
+
+    def results(self) -> pd.DataFrame:
+        """Return all the results published so far."""
+        chunks = self.get_chunks()
+        return pd.concat(chunks) if chunks else pd.DataFrame()
+
+    def cleanup(self) -> None:
+        """Cancel the analysis and remove its working directory."""
+        self.cancel()
+        self._thread.join(timeout=5)
+        shutil.rmtree(self.workdir, ignore_errors=True)
@@ -0,0 +1,190 @@
+"""Concurrent downloads of the input files of the analyses.
+
+All the downloads of a process go through one pooled ``requests.Session``
+(keep-alive connections are reused) and a thread pool, with a limit on the
+number of simultaneous transfers per host. A file requested again while its
+download is in progress is not downloaded twice, which lets the application
+prefetch the inputs of a dataset as soon as it is selected.
+"""
+
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+from analysis import download
+
+MAX_WORKERS = 8
+MAX_PER_HOST = 4
+
+
+class FetchJob:
+    """Downloads of a group of files, with aggregate progress.
+
+    Parameters
+    ----------
+    sizes: dict
+        Expected size of each file (None if unknown), keyed by URL.
+    """
+
+    def __init__(self, sizes: dict):
+        self.sizes = sizes
+        self.futures = {}
+        self._received = {url: 0 for url in sizes}
+        self._lock = threading.Lock()
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(size or 0 for size in self.sizes.values())
+
+    def add_progress(self, url: str, n_bytes: int) -> None:
+        with self._lock:
+            self._received[url] += n_bytes
+
+    @property
+    def received_bytes(self) -> int:
+        """Bytes available locally, files found in the cache included."""
+        with self._lock:
+            return sum(
+                (self.sizes[url] or 0) if self.futures[url].done() else received
+                for url, received in self._received.items()
+            )
+
+    @property
+    def fraction(self) -> float:
+        """Fraction of the bytes available locally, between 0 and 1."""
+        if self.done():
+            return 1.0
+        if not self.total_bytes:
+            return 0.0
+        return min(1.0, self.received_bytes / self.total_bytes)
+
+    def done(self) -> bool:
+        return all(future.done() for future in self.futures.values())
+
+    def result(self, timeout: float | None = None) -> dict:
+        """Wait for the downloads and return the local paths keyed by URL."""
+        return {url: future.result(timeout) for url, future in self.futures.items()}
+
+    def add_done_callback(self, callback) -> None:
+        """Call ``callback(job)`` once every download ended, in a download thread.
+
+        The callback is called right away if they already ended.
+        """
+        remaining = [len(set(self.futures.values()))]
+        if not remaining[0]:
+            callback(self)
+            return
+
+        def on_done(_):
+            with self._lock:
+                remaining[0] -= 1
+                last = not remaining[0]
+            if last:
+                callback(self)
+
+        for future in set(self.futures.values()):
+            future.add_done_callback(on_done)
+
+
+class Fetcher:
+    """Thread pool downloading files through a shared pooled session.
+
+    Parameters
+    ----------
+    max_workers: int
+        Maximum number of simultaneous downloads.
+    max_per_host: int
+        Maximum number of simultaneous downloads from a single host.
+    """
+
+    def __init__(self, max_workers: int = MAX_WORKERS, max_per_host: int = MAX_PER_HOST):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.max_per_host = max_per_host
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fetcher")
+        self._host_limits = {}
+        self._in_flight = {}
+        self._listeners = {}
+        self._lock = threading.Lock()
+
+    def _host_limit(self, url: str) -> threading.Semaphore:
+        host = urlsplit(url).netloc
+        with self._lock:
+            return self._host_limits.setdefault(host, threading.BoundedSemaphore(self.max_per_host))
+
+    def _notify(self, url: str, n_bytes: int) -> None:
+        with self._lock:
+            listeners = list(self._listeners.get(url, ()))
+        for job in listeners:
+            job.add_progress(url, n_bytes)
+
+    def _download(self, url: str, size: int | None, file_name: str | None) -> Path:
+        try:
+            with self._host_limit(url):
+                return download.download_file(
+                    url,
+                    expected_size=size,
+                    session=self.session,
+                    progress=lambda n_bytes: self._notify(url, n_bytes),
+                    file_name=file_name,
+                )
+        finally:
+            with self._lock:
+                self._in_flight.pop(url, None)
+                self._listeners.pop(url, None)
+
+    def _submit(self, url: str, size: int | None, file_name: str | None, job: FetchJob) -> Future:
+        with self._lock:
+            self._listeners.setdefault(url, []).append(job)
+            future = self._in_flight.get(url)
+            if future is None:
+                future = self._executor.submit(self._download, url, size, file_name)
+                self._in_flight[url] = future
+        return future
+
+    def fetch(self, files: pd.DataFrame) -> FetchJob:
+        """Start downloading files in parallel.
+
+        Parameters
+        ----------
+        files: pd.DataFrame
+            Files to download, with the "URL", "File size" and "File name"
+            columns returned by find_files_by_dataset_id.
+
+        Returns
+        -------
+        FetchJob
+            Handle to follow the downloads and get the local paths.
+        """
+        sizes = pd.to_numeric(files["File size"], errors="coerce")
+        job = FetchJob({
+            url: None if pd.isna(size) else int(size)
+            for url, size in zip(files["URL"].astype(str), sizes)
+        })
+        names = dict(zip(files["URL"].astype(str), files["File name"].astype(str)))
+        for url, size in job.sizes.items():
+            job.futures[url] = self._submit(url, size, names[url], job)
+        return job
+
+    # Prefetching is the same operation, the caller just does not wait.
+    prefetch = fetch
+
+
+_default_fetcher = None
+_default_fetcher_lock = threading.Lock()
+
+
+def get_fetcher() -> Fetcher:
+    """Return the fetcher shared by all the sessions of the process."""
+    global _default_fetcher
+    with _default_fetcher_lock:
+        if _default_fetcher is None:
+            _default_fetcher = Fetcher()
+        return _default_fetcher
@@ -0,0 +1,199 @@
+"""Cache of analysis results shared by all the sessions and processes.
+
+Results are stored by key, the hash of the analysis name, the dataset, the
+URLs and sizes of the input files and the parameters, so a popular dataset is
+analysed once for everybody. Entries are parquet files evicted least recently
+used first under a byte budget. Hits, misses and evictions are counted in a
+file shared by all the processes, see ``python -m analysis.results``.
+Configuration is read from the environment:
+
+- ``MDVERSE_RESULTS_DIR``: cache directory (defaults to the ``results``
+  directory of the catalog cache).
+- ``MDVERSE_RESULTS_MAX_BYTES``: byte budget of the cache (defaults to 2 GB).
+"""
+
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+
+from catalog import cache
+
+DEFAULT_MAX_BYTES = 2 * 1024**3
+COUNTERS = ("hits", "misses", "stores", "evictions")
+
+
+def get_results_dir() -> Path:
+    """Return the result cache directory configured for this process."""
+    results_dir = os.environ.get("MDVERSE_RESULTS_DIR")
+    if results_dir:
+        return Path(results_dir).expanduser()
+    return cache.get_cache_dir() / "results"
+
+
+def get_max_bytes() -> int:
+    """Return the byte budget of the result cache."""
+    return int(os.environ.get("MDVERSE_RESULTS_MAX_BYTES", DEFAULT_MAX_BYTES))
+
+
+def result_key(analysis: str, dataset_id: str, files: pd.DataFrame, parameters: dict) -> str:
+    """Return the cache key of an analysis.
+
+    Parameters
+    ----------
+    analysis: str
+        Name of the analysis.
+    dataset_id: str
+        Dataset analysed.
+    files: pd.DataFrame
+        Input files, with the "URL" and "File size" columns (missing sizes
+        are <NA>).
+    parameters: dict
+        Parameters of the analysis, JSON serializable.
+
+    Returns
+    -------
+    str
+        Hexadecimal sha256 of the inputs.
+    """
+    inputs = {
+        "analysis": analysis,
+        "dataset_id": str(dataset_id),
+        "files": sorted(
+            (url, None if pd.isna(size) else int(size))
+            for url, size in zip(files["URL"], files["File size"])
+        ),
+        "parameters": parameters,
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+class ResultCache:
+    """On-disk cache of analysis results.
+
+    Layout of the cache directory:
+
+    - ``entries/<key>.parquet``: the results of an analysis;
+    - ``metrics.json``: counters of hits, misses, stores and evictions.
+
+    Parameters
+    ----------
+    root: Path
+        Cache directory, defaults to ``get_results_dir()``.
+    max_bytes: int
+        Byte budget, defaults to ``get_max_bytes()``.
+    """
+
+    def __init__(self, root: Path | None = None, max_bytes: int | None = None):
+        self.root = Path(root or get_results_dir())
+        self.max_bytes = get_max_bytes() if max_bytes is None else max_bytes
+        (self.root / "entries").mkdir(parents=True, exist_ok=True)
+
+    def path(self, key: str) -> Path:
+        return self.root / "entries" / f"{key}.parquet"
+
+    def get(self, key: str) -> pd.DataFrame | None:
+        """Return the cached results of a key, or None on a miss."""
+        path = self.path(key)
+        try:
+            results = pd.read_parquet(path)
+            # The modification time records the last use for the LRU eviction.
+            os.utime(path)
+        except (OSError, ValueError):
+            self._count("misses")
+            return None
+        self._count("hits")
+        return results
+
+    def put(self, key: str, results: pd.DataFrame) -> None:
+        """Store the results of a key and evict old entries over budget."""
+        path = self.path(key)
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+        os.close(fd)
+        try:
+            results.to_parquet(tmp_name)
+            os.replace(tmp_name, path)
+        except BaseException:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+        self._count("stores")
+        self.evict(keep=path)
+
+    def evict(self, keep: Path | None = None) -> None:
+        """Remove the least recently used entries until the budget is met."""
+        entries = []
+        for path in (self.root / "entries").glob("*.parquet"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for _, size, path in sorted(entries, key=lambda entry: entry[0]):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            path.unlink(missing_ok=True)
+            total -= size
+            evicted += 1
+        if evicted:
+            self._count("evictions", evicted)
+
+    def _count(self, counter: str, increment: int = 1) -> None:
+        with open(self.root / "metrics.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            counters = self._read_counters()
+            counters[counter] += increment
+            tmp_path = self.root / f"metrics.{os.getpid()}.tmp"
+            tmp_path.write_text(json.dumps(counters))
+            os.replace(tmp_path, self.root / "metrics.json")
+
+    def _read_counters(self) -> dict:
+        try:
+            counters = json.loads((self.root / "metrics.json").read_text())
+        except (OSError, ValueError):
+            counters = {}
+        return {counter: counters.get(counter, 0) for counter in COUNTERS}
+
+    def metrics(self) -> dict:
+        """Return the counters, the hit rate and the current size of the cache."""
+        metrics = self._read_counters()
+        lookups = metrics["hits"] + metrics["misses"]
+        metrics["hit_rate"] = metrics["hits"] / lookups if lookups else 0.0
+        sizes = [path.stat().st_size for path in (self.root / "entries").glob("*.parquet")]
+        metrics["entries"] = len(sizes)
+        metrics["bytes"] = sum(sizes)
+        metrics["max_bytes"] = self.max_bytes
+        return metrics
+
+
+_result_cache = None
+
+
+def get_result_cache() -> ResultCache:
+    """Return the result cache of this process."""
+    global _result_cache
+    if _result_cache is None:
+        _result_cache = ResultCache()
+    return _result_cache
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the metrics of the analysis result cache.")
+    parser.add_argument("--dir", help="Cache directory (defaults to the configured one).")
+    args = parser.parse_args()
+
+    metrics = ResultCache(args.dir).metrics()
+    for name, value in metrics.items():
+        print(f"{name:>10}: {value:.2%}" if name == "hit_rate" else f"{name:>10}: {value}")
+
+
+if __name__ == "__main__":
+    main()
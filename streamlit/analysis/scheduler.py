@@ -0,0 +1,383 @@
+"""Local queue of the tool commands launched from the web application.
+
+Jobs are rows of a SQLite database shared by all the Streamlit processes of a
+node. A dispatcher thread in each process claims queued jobs while fewer than
+``max_workers`` jobs run on the node, starts them in their own process group
+with CPU time and memory limits, and records how they ended. Status queries
+are single indexed reads, cheap enough to be polled on every rerun.
+Configuration is read from the environment:
+
+- ``MDVERSE_JOBS_DIR``: directory of the database and of the job working
+  directories (defaults to the ``jobs`` directory of the catalog cache).
+- ``MDVERSE_JOBS_MAX_WORKERS``: jobs running at once (defaults to half the CPUs).
+- ``MDVERSE_JOBS_CPU_SECONDS``: CPU time limit of a job (defaults to 1 hour).
+- ``MDVERSE_JOBS_MEMORY_BYTES``: address space limit of a job (defaults to 4 GB).
+"""
+
+import json
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+from catalog import cache
+
+DEFAULT_CPU_SECONDS = 3600
+DEFAULT_MEMORY_BYTES = 4 * 1024**3
+POLL_INTERVAL = 0.5
+FINISHED = ("done", "failed", "cancelled")
+
+# Applies the limits given as first arguments, then replaces itself with the
+# command. Setting them in the child with preexec_fn is not safe in a process
+# running threads.
+LIMITS_SHIM = """\
+import os, resource, sys
+cpu_seconds, memory_bytes = int(sys.argv[1]), int(sys.argv[2])
+resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds))
+resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+try:
+    os.execvp(sys.argv[3], sys.argv[3:])
+except OSError as error:
+    sys.exit(f"{sys.argv[3]}: {error}")
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    command TEXT NOT NULL,
+    env TEXT NOT NULL,
+    outputs TEXT NOT NULL,
+    cpu_seconds INTEGER NOT NULL,
+    memory_bytes INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    owner INTEGER,
+    pid INTEGER,
+    returncode INTEGER,
+    error TEXT,
+    submitted REAL NOT NULL,
+    started REAL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+"""
+
+
+def get_jobs_dir() -> Path:
+    """Return the jobs directory configured for this process."""
+    jobs_dir = os.environ.get("MDVERSE_JOBS_DIR")
+    if jobs_dir:
+        return Path(jobs_dir).expanduser()
+    return cache.get_cache_dir() / "jobs"
+
+
+def get_max_workers() -> int:
+    """Return the number of jobs allowed to run at once on the node."""
+    default = max(1, (os.cpu_count() or 2) // 2)
+    return int(os.environ.get("MDVERSE_JOBS_MAX_WORKERS", default))
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _limited_argv(command: str | list, cpu_seconds: int, memory_bytes: int) -> list:
+    """Return the argument list running a command under the limits."""
+    if isinstance(command, str):
+        command = ["/bin/sh", "-c", command]
+    return [sys.executable, "-c", LIMITS_SHIM, str(cpu_seconds), str(memory_bytes), *command]
+
+
+class JobScheduler:
+    """Bounded pool of tool commands persisted in SQLite.
+
+    Parameters
+    ----------
+    root: Path
+        Jobs directory, defaults to ``get_jobs_dir()``.
+    max_workers: int
+        Jobs running at once on the node, defaults to ``get_max_workers()``.
+    """
+
+    def __init__(self, root: Path | None = None, max_workers: int | None = None):
+        self.root = Path(root or get_jobs_dir())
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.db_path = self.root / "jobs.db"
+        self.max_workers = max_workers or get_max_workers()
+        self._processes = {}
+        self._local = threading.local()
+        self._dispatcher = None
+        self._stop_event = threading.Event()
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # SQLite connections cannot be shared between threads.
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            self._local.connection = connection
+        return connection
+
+    def submit(
+        self,
+        command: str | list,
+        outputs: dict | None = None,
+        env: dict | None = None,
+        cpu_seconds: int | None = None,
+        memory_bytes: int | None = None,
+        dispatch: bool = True,
+    ) -> int:
+        """Queue a command and return the id of its job.
+
+        Parameters
+        ----------
+        command: str or list
+            Shell command line, or argument list run without a shell.
+        outputs: dict
+            Output names and paths, relative to the job working directory.
+        env: dict
+            Variables added to the environment of the command.
+        cpu_seconds: int
+            CPU time limit, defaults to ``MDVERSE_JOBS_CPU_SECONDS``.
+        memory_bytes: int
+            Address space limit, defaults to ``MDVERSE_JOBS_MEMORY_BYTES``.
+        dispatch: bool
+            Start the dispatcher of this process. Otherwise the job is run
+            by the dispatcher of another process sharing the jobs directory.
+
+        Returns
+        -------
+        int
+            Job id.
+        """
+        if cpu_seconds is None:
+            cpu_seconds = int(os.environ.get("MDVERSE_JOBS_CPU_SECONDS", DEFAULT_CPU_SECONDS))
+        if memory_bytes is None:
+            memory_bytes = int(os.environ.get("MDVERSE_JOBS_MEMORY_BYTES", DEFAULT_MEMORY_BYTES))
+        cursor = self._connect().execute(
+            "INSERT INTO jobs (command, env, outputs, cpu_seconds, memory_bytes, status, submitted) "
+            "VALUES (?, ?, ?, ?, ?, 'queued', ?)",
+            (json.dumps(command), json.dumps(env or {}), json.dumps(outputs or {}),
+             cpu_seconds, memory_bytes, time.time()),
+        )
+        job_id = cursor.lastrowid
+        if dispatch:
+            self.start()
+        return job_id
+
+    def workdir(self, job_id: int) -> Path:
+        """Return the working directory of a job."""
+        return self.root / "work" / str(job_id)
+
+    def status(self, job_id: int) -> dict | None:
+        """Return the state of a job, or None if it does not exist."""
+        row = self._connect().execute(
+            "SELECT id, status, returncode, error, submitted, started, finished "
+            "FROM jobs WHERE id = ?", (job_id,),
+        ).fetchone()
+        return dict(row) if row is not None else None
+
+    def statuses(self, job_ids: list) -> dict:
+        """Return the status of several jobs in one query, by job id."""
+        placeholders = ",".join("?" * len(job_ids))
+        rows = self._connect().execute(
+            f"SELECT id, status FROM jobs WHERE id IN ({placeholders})", list(job_ids)
+        ).fetchall()
+        return {row["id"]: row["status"] for row in rows}
+
+    def result(self, job_id: int) -> dict | None:
+        """Return the outcome of a finished job, or None while it is pending.
+
+        Returns
+        -------
+        dict
+            Status, return code, error, captured stdout and stderr and the
+            absolute paths of the outputs.
+        """
+        row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or row["status"] not in FINISHED:
+            return None
+        workdir = self.workdir(job_id)
+        logs = {}
+        for name in ("stdout", "stderr"):
+            log_path = workdir / f"{name}.log"
+            logs[name] = log_path.read_text(errors="replace") if log_path.exists() else ""
+        return {
+            "status": row["status"],
+            "returncode": row["returncode"],
+            "error": row["error"],
+            **logs,
+            "outputs": {
+                name: str(workdir / path) for name, path in json.loads(row["outputs"]).items()
+            },
+        }
+
+    def cancel(self, job_id: int) -> None:
+        """Cancel a queued job or terminate a running one."""
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        row = connection.execute("SELECT status, pid FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or row["status"] in FINISHED:
+            connection.execute("COMMIT")
+            return
+        connection.execute(
+            "UPDATE jobs SET status = 'cancelled', finished = ? WHERE id = ?",
+            (time.time(), job_id),
+        )
+        connection.execute("COMMIT")
+        if row["pid"] is not None:
+            try:
+                os.killpg(row["pid"], signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def start(self) -> None:
+        """Start the dispatcher thread of this process if it is not running."""
+        if self._dispatcher is None or not self._dispatcher.is_alive():
+            self._stop_event.clear()
+            self._dispatcher = threading.Thread(target=self._dispatch, daemon=True, name="job-dispatcher")
+            self._dispatcher.start()
+
+    def stop(self) -> None:
+        """Stop the dispatcher; running jobs are left to finish."""
+        self._stop_event.set()
+        if self._dispatcher is not None:
+            self._dispatcher.join()
+
+    def drain(self) -> None:
+        """Stop claiming jobs and wait for the ones this process launched.
+
+        Called before the process exits, the jobs it started would otherwise
+        be reported lost by the other dispatchers.
+        """
+        self.stop()
+        for process in list(self._processes.values()):
+            process.wait()
+        self._reap()
+
+    def _dispatch(self) -> None:
+        while not self._stop_event.is_set():
+            self._reap()
+            self._recover_lost()
+            while self._claim_and_launch():
+                pass
+            self._stop_event.wait(POLL_INTERVAL)
+
+    def _claim_and_launch(self) -> bool:
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        running = connection.execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'running'"
+        ).fetchone()[0]
+        row = None
+        if running < self.max_workers:
+            row = connection.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1"
+            ).fetchone()
+        if row is None:
+            connection.execute("COMMIT")
+            return False
+        connection.execute(
+            "UPDATE jobs SET status = 'running', owner = ?, started = ? WHERE id = ?",
+            (os.getpid(), time.time(), row["id"]),
+        )
+        connection.execute("COMMIT")
+
+        try:
+            process = self._launch(row)
+        except Exception as error:
+            connection.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, finished = ? WHERE id = ?",
+                (str(error), time.time(), row["id"]),
+            )
+            return True
+        self._processes[row["id"]] = process
+        updated = connection.execute(
+            "UPDATE jobs SET pid = ? WHERE id = ? AND status = 'running'", (process.pid, row["id"])
+        ).rowcount
+        if not updated:
+            # Cancelled between the claim and the launch.
+            os.killpg(process.pid, signal.SIGTERM)
+        return True
+
+    def _launch(self, row: sqlite3.Row) -> subprocess.Popen:
+        command = json.loads(row["command"])
+        workdir = self.workdir(row["id"])
+        workdir.mkdir(parents=True, exist_ok=True)
+        with open(workdir / "stdout.log", "wb") as stdout, open(workdir / "stderr.log", "wb") as stderr:
+            return subprocess.Popen(
+                _limited_argv(command, row["cpu_seconds"], row["memory_bytes"]),
+                cwd=workdir,
+                env={**os.environ, **json.loads(row["env"])},
+                stdout=stdout,
+                stderr=stderr,
+                # A process group lets cancel terminate the whole command line.
+                start_new_session=True,
+            )
+
+    def _reap(self) -> None:
+        connection = self._connect()
+        for job_id, process in list(self._processes.items()):
+            returncode = process.poll()
+            if returncode is None:
+                continue
+            del self._processes[job_id]
+            if returncode == 0:
+                status, error = "done", None
+            elif returncode == -signal.SIGXCPU:
+                status, error = "failed", "CPU time limit exceeded"
+            else:
+                status, error = "failed", f"Exited with code {returncode}"
+            # A cancelled job keeps its status.
+            connection.execute(
+                "UPDATE jobs SET status = ?, returncode = ?, error = ?, finished = ? "
+                "WHERE id = ? AND status = 'running'",
+                (status, returncode, error, time.time(), job_id),
+            )
+
+    def _recover_lost(self) -> None:
+        """Fail the jobs whose dispatcher process died while they ran."""
+        connection = self._connect()
+        rows = connection.execute(
+            "SELECT id, owner, pid FROM jobs WHERE status = 'running' AND owner != ?", (os.getpid(),)
+        ).fetchall()
+        for row in rows:
+            if _process_alive(row["owner"]):
+                continue
+            updated = connection.execute(
+                "UPDATE jobs SET status = 'failed', error = 'Worker process lost', "
+                "finished = ? WHERE id = ? AND status = 'running'",
+                (time.time(), row["id"]),
+            ).rowcount
+            # Nobody can record how the command ends, nor count it against
+            # max_workers, so it is not left running.
+            if updated and row["pid"] is not None:
+                try:
+                    os.killpg(row["pid"], signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> JobScheduler:
+    """Return the job scheduler of this process."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = JobScheduler()
+        return _scheduler
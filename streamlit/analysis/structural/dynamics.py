@@ -0,0 +1,169 @@
+"""RMSF, radius of gyration and 2D RMSD of a trajectory, in a single pass.
+
+The coordinates of the selection are streamed by chunks of frames (from the
+shared coordinate cache when they are there) and every chunk is given to
+the accumulator of each requested analysis, so N analyses cost one decode
+of the trajectory instead of N. The accumulators only use vectorized NumPy
+operations over a whole chunk.
+
+Results are published in long format, one row per value, with the columns
+``analysis``, ``x``, ``y`` and ``value`` (see ``ANALYSES`` for what x and y
+are), so the analyses of a run share one table and one result cache entry.
+"""
+
+import time
+import uuid
+
+import matplotlib.pyplot as plt
+import MDAnalysis as mda
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from analysis import coordinates, engine, results
+from analysis.structural import kernels, rmsd
+
+# Same inputs as the RMSD: a structure and a trajectory.
+REQUIRED_FILES = rmsd.REQUIRED_FILES
+# Name of each analysis, and the meaning of its x, y and value columns.
+ANALYSES = {
+    "RMSF": ("Atom index", None, "RMSF (Å)"),
+    "Radius of gyration": ("Time (ps)", None, "Radius of gyration (Å)"),
+    "2D RMSD": ("Time (ps)", "Time (ps)", "RMSD (Å)"),
+}
+# Number of frames read and given to the accumulators at once.
+CHUNK_SIZE = 100
+
+def init_dynamics(analysis):
+    st.session_state.setdefault("dynamics_selection", "all")
+    st.text_input("Atom selection:", key="dynamics_selection")
+    analyses = st.multiselect(
+        "Analyses computed in the same pass:", list(ANALYSES), default=[analysis],
+        key=f"dynamics_analyses_{analysis}",
+    )
+    st.button("Run", type="primary", on_click=run_dynamics, args=(analyses,),
+              disabled=not analyses)
+
+    run = st.session_state.get("dynamics_run")
+    if run is not None:
+        display_run(run)
+
+def run_dynamics(analyses):
+    """Start the selected analyses of the selected dataset in the background."""
+    previous_run = st.session_state.get("dynamics_run")
+    if previous_run is not None:
+        previous_run.cleanup()
+
+    files = rmsd.select_inputs(st.session_state["files"])
+    selection = st.session_state["dynamics_selection"]
+    analyses = sorted(analyses)
+    cache_key = results.result_key(
+        "dynamics", st.session_state["querydatasetid"], files,
+        {"selection": selection, "analyses": analyses, "reference_frame": 0,
+         "superposition": True, "matrix_max_frames": kernels.MATRIX_MAX_FRAMES},
+    )
+    session_id = st.session_state.setdefault("session_id", uuid.uuid4().hex)
+    st.session_state["dynamics_run"] = engine.AnalysisRun(
+        compute_dynamics, session_id, files, selection, analyses, cache_key=cache_key
+    )
+
+def get_analysis(table, analysis):
+    """Return the values of a per-atom or per-frame analysis, indexed by x."""
+    x_label, _, value_label = ANALYSES[analysis]
+    rows = table.loc[table["analysis"] == analysis, ["x", "value"]]
+    return rows.rename(columns={"x": x_label, "value": value_label}).set_index(x_label)
+
+def display_run(run):
+    """Show the radius of gyration as it is computed, then all the results."""
+    status = st.empty()
+    if run.is_running():
+        st.button("Cancel", on_click=run.cancel)
+
+    # Only the radius of gyration is published during the pass.
+    placeholder = st.empty()
+    chart = None
+    n_chunks = 0
+
+    # Clicking Cancel reruns the script, which interrupts this loop.
+    while True:
+        running = run.is_running()
+        new_chunks = run.get_chunks(n_chunks)
+        if new_chunks:
+            n_chunks += len(new_chunks)
+            gyration = get_analysis(pd.concat(new_chunks), "Radius of gyration")
+            if len(gyration) and chart is None:
+                chart = placeholder.line_chart(gyration)
+            elif len(gyration):
+                chart.add_rows(gyration)
+        if not running:
+            break
+        status.info(run.message)
+        time.sleep(0.25)
+
+    if run.status == "cancelled":
+        status.warning("Analyses cancelled.")
+        return
+    if run.status == "failed":
+        status.error(f"Analyses failed: {run.error}")
+        return
+    status.success("Analyses computed.")
+
+    table = run.results()
+    if (table["analysis"] == "RMSF").any():
+        st.subheader("RMSF")
+        st.line_chart(get_analysis(table, "RMSF"))
+    if (table["analysis"] == "2D RMSD").any():
+        st.subheader("2D RMSD")
+        st.pyplot(plot_matrix(table[table["analysis"] == "2D RMSD"]))
+
+def plot_matrix(rows):
+    """Heat map of the 2D RMSD rows of a result table."""
+    matrix = rows.pivot(index="y", columns="x", values="value")
+    times = matrix.columns.to_numpy()
+    figure, axes = plt.subplots()
+    image = axes.imshow(
+        matrix.to_numpy(), origin="lower", cmap="viridis",
+        extent=(times[0], times[-1], times[0], times[-1]),
+    )
+    axes.set_xlabel("Time (ps)")
+    axes.set_ylabel("Time (ps)")
+    figure.colorbar(image, ax=axes, label="RMSD (Å)")
+    return figure
+
+def compute_dynamics(context, files, selection, analyses):
+    """Selected analyses of the selected atoms, in one pass over the trajectory.
+
+    Runs in the background: the radius of gyration is published chunk by
+    chunk, the RMSF and the 2D RMSD once the pass is over, and the analysis
+    stops between chunks when it is cancelled.
+    """
+    pdb_file_path, trr_file_path = rmsd.fetch_inputs(context, files)
+
+    context.set_message("Reading the trajectory...")
+    # Closing the reader caches the coordinates if the run read every frame.
+    with coordinates.open_selection(pdb_file_path, trr_file_path, selection) as reader:
+        n_frames = reader.n_frames
+        reference = reader.read([0])[0][0]
+        accumulators = []
+        if "RMSF" in analyses:
+            accumulators.append(kernels.RMSFAccumulator(reference, reader.atom_indices))
+        if "Radius of gyration" in analyses:
+            masses = mda.Universe(str(pdb_file_path)).atoms[reader.atom_indices].masses
+            accumulators.append(kernels.GyrationAccumulator(masses))
+        if "2D RMSD" in analyses:
+            accumulators.append(kernels.RMSDMatrixAccumulator(n_frames, reader.n_atoms))
+
+        for start in range(0, n_frames, CHUNK_SIZE):
+            context.check_cancelled()
+            context.set_message(f"Computing {', '.join(analyses)}... frame {start}/{n_frames}")
+            positions = np.arange(start, min(start + CHUNK_SIZE, n_frames))
+            chunk_coordinates, times = reader.read(positions)
+            for accumulator in accumulators:
+                chunk = accumulator.update(chunk_coordinates, times, positions)
+                if chunk is not None:
+                    context.emit(chunk)
+
+    for accumulator in accumulators:
+        chunk = accumulator.result()
+        if chunk is not None:
+            context.emit(chunk)
@@ -0,0 +1,158 @@
+"""Computations of the structural analyses that do not depend on Streamlit.
+
+``rmsd`` and ``dynamics`` run these on the chunks of coordinates they read
+from a ``SelectionReader``; keeping them apart from the pages lets them be
+reused and tested without the app.
+"""
+
+import numpy as np
+import pandas as pd
+
+from analysis.tools.mdanalysis import rmsd_kernels
+
+# In preview mode, the first RMSD pass reads at most PREVIEW_FRAMES frames
+# evenly spread over the trajectory (one chunk, drawn at once), and each next
+# pass a REFINE_FACTOR times finer stride, down to every frame.
+PREVIEW_FRAMES = 100
+REFINE_FACTOR = 10
+# The 2D RMSD is computed on at most MATRIX_MAX_FRAMES frames evenly spread
+# over the trajectory, which are kept in memory during the pass.
+MATRIX_MAX_FRAMES = 500
+
+def rmsd_chunk(reference, coordinates, times):
+    """RMSD of each frame of a chunk to the reference, after superposition."""
+    references = np.broadcast_to(reference, (1,) + coordinates.shape)
+    values = rmsd_kernels.rmsd_tile(references, coordinates[None], superposition=True)[0, 0]
+    return pd.DataFrame({"RMSD (Å)": values}, index=pd.Index(times, name="Time (ps)"))
+
+def preview_strides(n_frames):
+    """Return the frame strides of the preview passes, from coarse to 1."""
+    strides = []
+    stride = -(-n_frames // PREVIEW_FRAMES)
+    while stride > 1:
+        strides.append(stride)
+        stride //= REFINE_FACTOR
+    return strides + [1]
+
+def frame_passes(n_frames, preview=False):
+    """Yield the stride and the frame indices of each pass over a trajectory.
+
+    Every frame belongs to a single pass: a pass only reads the frames of
+    its stride that the coarser passes did not read.
+    """
+    computed = np.zeros(n_frames, dtype=bool)
+    for stride in (preview_strides(n_frames) if preview else [1]):
+        frames = np.flatnonzero(~computed[::stride]) * stride
+        computed[frames] = True
+        yield stride, frames
+
+
+def long_rows(analysis, x, value, y=None):
+    """Rows of the result table for values of an analysis."""
+    return pd.DataFrame({
+        "analysis": analysis,
+        "x": np.asarray(x, dtype=np.float64),
+        "y": np.nan if y is None else np.asarray(y, dtype=np.float64),
+        "value": np.asarray(value, dtype=np.float64),
+    })
+
+def superpose(reference, coordinates):
+    """Superpose every frame of a chunk onto a reference (Kabsch).
+
+    Parameters
+    ----------
+    reference: np.ndarray
+        Centered reference positions, of shape (atoms, 3).
+    coordinates: np.ndarray
+        Positions, of shape (frames, atoms, 3).
+
+    Returns
+    -------
+    np.ndarray
+        Centered positions rotated onto the reference, in float64.
+    """
+    centered = coordinates - coordinates.mean(axis=1, keepdims=True, dtype=np.float64)
+    covariance = np.einsum("fai,aj->fij", centered, reference)
+    u, _, vt = np.linalg.svd(covariance)
+    # Reflections are turned into proper rotations.
+    u[:, :, -1] *= np.sign(np.linalg.det(u @ vt))[:, None]
+    return centered @ (u @ vt)
+
+def radius_of_gyration(coordinates, masses):
+    """Return the mass-weighted radius of gyration of every frame of a chunk."""
+    weights = masses / masses.sum()
+    center = np.einsum("fai,a->fi", coordinates, weights, dtype=np.float64)
+    squared = ((coordinates - center[:, None]) ** 2).sum(axis=-1)
+    return np.sqrt(squared @ weights)
+
+class RMSFAccumulator:
+    """RMSF of each atom after superposition onto the reference frame.
+
+    The deviations from the reference are summed rather than the positions,
+    so the one-pass variance does not lose precision.
+    """
+
+    def __init__(self, reference, atom_indices):
+        self.reference = reference - reference.mean(axis=0, dtype=np.float64)
+        self.atom_indices = atom_indices
+        self.n_frames = 0
+        self.sum = np.zeros(self.reference.shape)
+        self.sum_squares = np.zeros(len(self.reference))
+
+    def update(self, coordinates, times, positions):
+        deviations = superpose(self.reference, coordinates) - self.reference
+        self.n_frames += len(deviations)
+        self.sum += deviations.sum(axis=0)
+        self.sum_squares += (deviations ** 2).sum(axis=(0, 2))
+
+    def result(self):
+        mean = self.sum / self.n_frames
+        variance = self.sum_squares / self.n_frames - (mean ** 2).sum(axis=1)
+        return long_rows("RMSF", self.atom_indices, np.sqrt(np.maximum(variance, 0)))
+
+class GyrationAccumulator:
+    """Radius of gyration of every frame, published chunk by chunk."""
+
+    def __init__(self, masses):
+        self.masses = np.asarray(masses, dtype=np.float64)
+
+    def update(self, coordinates, times, positions):
+        return long_rows("Radius of gyration", times, radius_of_gyration(coordinates, self.masses))
+
+    def result(self):
+        return None
+
+class RMSDMatrixAccumulator:
+    """RMSD between every pair of sampled frames, after superposition.
+
+    Each chunk is compared with the sampled frames seen so far, including
+    its own, so the matrix is complete at the end of the pass.
+    """
+
+    def __init__(self, n_frames, n_atoms, max_frames=MATRIX_MAX_FRAMES):
+        self.stride = max(-(-n_frames // max_frames), 1)
+        n_sampled = len(range(0, n_frames, self.stride))
+        self.frames = np.empty((n_sampled, n_atoms, 3), dtype=np.float32)
+        self.times = np.empty(n_sampled)
+        self.matrix = np.zeros((n_sampled, n_sampled))
+        self.n_sampled = 0
+
+    def update(self, coordinates, times, positions):
+        sampled = positions % self.stride == 0
+        if not sampled.any():
+            return
+        start, stop = self.n_sampled, self.n_sampled + sampled.sum()
+        self.frames[start:stop] = coordinates[sampled]
+        self.times[start:stop] = times[sampled]
+        # Frames are one-frame trajectories for the batched RMSD kernel.
+        values = rmsd_kernels.rmsd_tile(
+            self.frames[start:stop, None], self.frames[:stop, None], superposition=True
+        )[:, :, 0]
+        self.matrix[start:stop, :stop] = values
+        self.matrix[:stop, start:stop] = values.T
+        self.n_sampled = stop
+
+    def result(self):
+        np.fill_diagonal(self.matrix, 0)
+        x, y = np.meshgrid(self.times, self.times)
+        return long_rows("2D RMSD", x.ravel(), self.matrix.ravel(), y.ravel())
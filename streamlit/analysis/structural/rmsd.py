@@ -1,30 +1,164 @@
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
 import streamlit as st
-import MDAnalysis as mda
-import requests
+
+from analysis import coordinates, engine, fetcher, results
+from analysis.structural import kernels
+
+# Number of files (min, max) of each extension the RMSD needs.
+REQUIRED_FILES = {"pdb": (1, 1), "trr": (1, 1)}
+INPUT_EXTENSIONS = [f".{extension}" for extension in REQUIRED_FILES]
+# Number of frames read and sent to the chart at once.
+CHUNK_SIZE = 100
+# Minimum delay (s) between two redraws of the whole chart.
+REDRAW_INTERVAL = 1.0
 
 def init_rmsd():
+    st.session_state.setdefault("rmsd_selection", "all")
+    st.session_state.setdefault("rmsd_preview", True)
+    st.text_input("Atom selection:", key="rmsd_selection")
+    st.checkbox(
+        "Quick preview", key="rmsd_preview",
+        help="Show the RMSD of a subset of the frames within seconds, then refine it to every frame.",
+    )
     st.button("Run", type="primary", on_click=run_rmsd)
 
-def run_rmsd():
+    run = st.session_state.get("rmsd_run")
+    if run is not None:
+        display_run(run)
 
-    files = st.session_state["files"]
+def select_inputs(files):
+    """Return the rows of the files needed by the RMSD: one per input extension."""
+    return pd.concat([
+        files[files["File name"].str.lower().str.endswith(file_extension)].iloc[:1]
+        for file_extension in INPUT_EXTENSIONS
+    ])
 
-    pdb_file_content = download_file_content(files, ".pdb")
-    trr_file_content = download_file_content(files, ".trr")
+def run_rmsd():
+    """Start the RMSD of the selected dataset in the background."""
+    previous_run = st.session_state.get("rmsd_run")
+    if previous_run is not None:
+        previous_run.cleanup()
+
+    files = select_inputs(st.session_state["files"])
+    selection = st.session_state["rmsd_selection"]
+    cache_key = results.result_key(
+        "rmsd", st.session_state["querydatasetid"], files,
+        {"selection": selection, "reference_frame": 0, "superposition": True},
+    )
+    session_id = st.session_state.setdefault("session_id", uuid.uuid4().hex)
+    st.session_state["rmsd_run"] = engine.AnalysisRun(
+        compute_rmsd, session_id, files, selection, st.session_state["rmsd_preview"],
+        cache_key=cache_key,
+    )
 
-    # with open('tmp.pdb', 'wb') as file:
-    #         file.write(pdb_file_content)
-    # with open('tmp.trr', 'wb') as file:
-    #         file.write(trr_file_content)
+def display_run(run):
+    """Show the results of a run in a chart updated until it completes."""
+    status = st.empty()
+    if run.is_running():
+        st.button("Cancel", on_click=run.cancel)
 
-    u = mda.Universe("tmp.pdb", "tmp.trr")
+    chunks = run.get_chunks()
+    placeholder = st.empty()
+    shown = pd.concat(chunks).sort_index() if chunks else pd.DataFrame({"RMSD (Å)": []})
+    chart = placeholder.line_chart(shown)
+    n_chunks = len(chunks)
+    last_time = shown.index.max() if len(shown) else -np.inf
+    redraw = False
+    redrawn = time.monotonic()
 
-def download_file_content(df, file_extension):
-    file_url = df[df["File name"].str.endswith(file_extension)]["URL"].iloc[0]
-    response = requests.get(file_url)
+    # Clicking Cancel reruns the script, which interrupts this loop.
+    while True:
+        running = run.is_running()
+        new_chunks = run.get_chunks(n_chunks)
+        if new_chunks:
+            new_rows = pd.concat(new_chunks)
+            n_chunks += len(new_chunks)
+            if not redraw and new_rows.index.min() > last_time:
+                chart.add_rows(new_rows)
+            else:
+                # Preview refinements fall between the frames shown: the
+                # chart is drawn again in time order, at most every
+                # REDRAW_INTERVAL seconds.
+                redraw = True
+            last_time = max(last_time, new_rows.index.max())
+        if redraw and (not running or time.monotonic() - redrawn > REDRAW_INTERVAL):
+            chart = placeholder.line_chart(pd.concat(run.get_chunks()[:n_chunks]).sort_index())
+            redraw = False
+            redrawn = time.monotonic()
+        if not running:
+            break
+        status.info(run.message)
+        time.sleep(0.25)
 
-    if response.status_code == 200:
-        return response.content
+    if run.status == "done":
+        status.success("RMSD computed.")
+    elif run.status == "cancelled":
+        status.warning("RMSD cancelled.")
     else:
-        print(f"Download failed for {file_url} with status {response.status_code}")
-        return None
\ No newline at end of file
+        status.error(f"RMSD failed: {run.error}")
+
+def fetch_inputs(context, files):
+    """Download the structure and trajectory of select_inputs into the run directory.
+
+    Returns the paths of the structure and of the trajectory.
+    """
+    context.set_message("Downloading input files...")
+    job = fetcher.get_fetcher().fetch(files)
+    while not job.done():
+        context.check_cancelled()
+        context.set_message(f"Downloading input files... {job.fraction:.0%}")
+        time.sleep(0.2)
+    paths = job.result()
+
+    # Inputs are linked into the run directory so that the files MDAnalysis
+    # writes next to them (e.g. trajectory offsets) are private to the run.
+    pdb_file_path, trr_file_path = (
+        context.workdir / f"input{paths[url].suffix}" for url in files["URL"]
+    )
+    pdb_file_path.symlink_to(paths[files["URL"].iloc[0]])
+    trr_file_path.symlink_to(paths[files["URL"].iloc[1]])
+    return pdb_file_path, trr_file_path
+
+def compute_rmsd(context, files, selection, preview=False):
+    """RMSD over time of the selected atoms to the first frame.
+
+    Runs in the background: results are published to the context chunk by
+    chunk and the analysis stops between chunks when it is cancelled. In
+    preview mode, the frames are read by passes of decreasing stride (see
+    ``kernels.frame_passes``), so a coarse RMSD over the whole trajectory comes
+    first; the chunks are then not in time order. The table returned, and
+    cached, is in time order either way, so it does not depend on the mode.
+    The coordinates of the selection come from the shared coordinate cache
+    when another analysis already read them.
+    """
+    pdb_file_path, trr_file_path = fetch_inputs(context, files)
+
+    context.set_message("Reading the trajectory...")
+    # Closing the reader caches the coordinates if the run read every frame.
+    with coordinates.open_selection(pdb_file_path, trr_file_path, selection) as reader:
+        reference = reader.read([0])[0][0]
+        n_frames = reader.n_frames
+        results = []
+        n_computed = 0
+        for stride, pass_frames in kernels.frame_passes(n_frames, preview):
+            for start in range(0, len(pass_frames), CHUNK_SIZE):
+                context.check_cancelled()
+                if stride > 1:
+                    context.set_message(
+                        f"Previewing RMSD every {stride} frames... {n_computed}/{n_frames} frames"
+                    )
+                else:
+                    context.set_message(f"Computing RMSD... {n_computed}/{n_frames} frames")
+                frames = pass_frames[start:start + CHUNK_SIZE]
+                chunk = kernels.rmsd_chunk(reference, *reader.read(frames))
+                results.append(chunk)
+                context.emit(chunk)
+                n_computed += len(frames)
+
+    table = pd.concat(results).sort_index()
+    table.to_csv(context.workdir / "rmsd.csv")
+    return table
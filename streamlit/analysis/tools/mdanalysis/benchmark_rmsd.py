@@ -0,0 +1,74 @@
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from extract_rmsd import parallel_pairwise_rmsd
+from rmsd_kernels import pairwise_rmsd
+
+
+def make_ensemble(path, no_t, frames, atoms, seed=0):
+    """write a random ensemble of shape (no_t, frames, atoms, 3) to a .npy"""
+    rng = np.random.default_rng(seed)
+    coordinates = np.lib.format.open_memmap(
+        path, mode='w+', dtype=np.float32, shape=(no_t, frames, atoms, 3))
+    reference = rng.normal(scale=10, size=(atoms, 3))
+    for traj in range(no_t):
+        coordinates[traj] = reference + rng.normal(size=(frames, atoms, 3))
+    coordinates.flush()
+    return coordinates
+
+
+def benchmark_scaling(coordinates, max_workers, superposition=False):
+    """
+    time the pairwise RMSD matrix with 1 to max_workers processes and check
+    that every parallel run gives the serial result
+    """
+    start = time.perf_counter()
+    reference = pairwise_rmsd(coordinates, superposition)
+    serial = time.perf_counter() - start
+    print("workers  time (s)  speedup  identical")
+    print("{:7d}  {:8.2f}  {:7.2f}  {}".format(1, serial, 1, True))
+
+    for workers in range(2, max_workers + 1):
+        start = time.perf_counter()
+        data = parallel_pairwise_rmsd(coordinates, superposition, workers)
+        elapsed = time.perf_counter() - start
+        print("{:7d}  {:8.2f}  {:7.2f}  {}".format(
+            workers, elapsed, serial / elapsed,
+            bool(np.array_equal(data, reference))))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Scaling benchmark of the parallel RMSD matrix.")
+    parser.add_argument('--coordinates',
+                        help="Coordinates .npy written by extract_rmsd "
+                        "--memmap (a random ensemble is used by default)")
+    parser.add_argument('--trajs', type=int, default=64,
+                        help="Number of trajectories of the random ensemble")
+    parser.add_argument('--frames', type=int, default=100,
+                        help="Number of frames of the random ensemble")
+    parser.add_argument('--atoms', type=int, default=500,
+                        help="Number of atoms of the random ensemble")
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count(),
+                        help="Largest number of processes to time")
+    parser.add_argument('--superposition', action='store_true',
+                        help="Superimpose the structures")
+    args = parser.parse_args()
+
+    if args.coordinates:
+        benchmark_scaling(np.load(args.coordinates, mmap_mode='r'),
+                          args.max_workers, args.superposition)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        coordinates = make_ensemble(os.path.join(directory, 'coords.npy'),
+                                    args.trajs, args.frames, args.atoms)
+        benchmark_scaling(coordinates, args.max_workers, args.superposition)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,410 @@
+"""
+On-disk caches of trajectory coordinates and of incremental RMSD runs.
+
+- CoordinateCache keeps the coordinates of an atom selection read from a
+  trajectory as a float32 .npy of shape (frames, atoms, 3), keyed by the
+  content hashes of the structure and trajectory files and by the group,
+  start, end and step. Next to it, an index gives the atom indices of the
+  selection and the number and time of every frame. Entries are memory-mapped
+  by every analysis reading them, so a trajectory is decoded once per
+  selection.
+- SelectionReader reads the coordinates of a selection by chunks of frames,
+  in any order: from the cache when they are there, else from the
+  trajectory while filling the cache.
+- PairStore keeps the RMSDs over time of every pair of trajectories already
+  computed, keyed by the coordinate keys of the two trajectories.
+
+A selection read again after its files changed gets a new key, and the
+entry of the old files is removed. Files whose content hash is already known
+(e.g. named after it by a download cache) are not hashed again.
+
+Layout of the cache directory:
+
+    hashes.json                          content hash of files already seen
+    selections.json                      last key of each selection of files
+    selections.lock                      lock of the two files above
+    coordinates/<key>.npy                coordinates of one trajectory
+    coordinates/<key>.index.npz          atom indices, frames and times
+    pairs/<superposition>/<ka[:2]>/<ka>-<kb>.npy
+                                         RMSDs of the pair (ka < kb)
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+
+import MDAnalysis as m
+import numpy as np
+
+CHUNK_SIZE = 1024 * 1024
+FRAME_CHUNK_SIZE = 100
+
+
+def _replace_atomic(path, write):
+    """write a file through a temporary sibling renamed in place"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                    prefix='.' + os.path.basename(path))
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _save_npy(path, array):
+    def write(tmp_path):
+        with open(tmp_path, 'wb') as f:
+            np.save(f, array)
+    _replace_atomic(path, write)
+
+
+def _save_json(path, data):
+    def write(tmp_path):
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+    _replace_atomic(path, write)
+
+
+def _load_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def open_selection(str_file, traj_file, str_format, traj_format, group,
+                   start, end, step):
+    """the atoms of group and the frames to iterate over for one trajectory"""
+    u = m.Universe(str_file, traj_file,
+                   format=traj_format, topology_format=str_format)
+    return u.select_atoms(group), u.trajectory[start:end:step]
+
+
+class CoordinateCache:
+    """
+    coordinates of trajectories keyed by their inputs; the least recently
+    used entries are removed beyond max_bytes, if given
+    """
+
+    def __init__(self, root, max_bytes=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(root, 'coordinates'), exist_ok=True)
+        self._hashes_path = os.path.join(root, 'hashes.json')
+        self._hashes = _load_json(self._hashes_path)
+        self._selections_path = os.path.join(root, 'selections.json')
+
+    def _lock(self):
+        """open lock file of hashes.json and selections.json; flock it"""
+        return open(os.path.join(self.root, 'selections.lock'), 'w')
+
+    def file_hash(self, path):
+        """
+        sha256 of a file; remembered for a given path, size and
+        modification time so large trajectories are hashed only once
+        """
+        stat = os.stat(path)
+        signature = '{}:{}:{}'.format(os.path.realpath(path), stat.st_size,
+                                      stat.st_mtime_ns)
+        if signature not in self._hashes:
+            self._hashes = _load_json(self._hashes_path)
+        if signature not in self._hashes:
+            sha256 = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    sha256.update(chunk)
+            with self._lock() as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                # Other processes may have added hashes since they were read
+                self._hashes = _load_json(self._hashes_path)
+                self._hashes[signature] = sha256.hexdigest()
+                _save_json(self._hashes_path, self._hashes)
+        return self._hashes[signature]
+
+    def key(self, str_file, traj_file, str_format, traj_format, group,
+            start, end, step, file_hashes=(None, None)):
+        """
+        key of the coordinates read from a trajectory, the arguments being
+        those of open_selection; file_hashes are the content hashes of the
+        structure and trajectory files when they are already known. An entry
+        written before the files changed is removed
+        """
+        hashes = [known or self.file_hash(path)
+                  for path, known in zip((str_file, traj_file), file_hashes)]
+        inputs = hashes + [str_format, traj_format, group, start, end, step]
+        key = hashlib.sha256(json.dumps(inputs).encode()).hexdigest()
+
+        selection = json.dumps([os.path.realpath(str_file),
+                                os.path.realpath(traj_file)] + inputs[2:])
+        with self._lock() as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            selections = _load_json(self._selections_path)
+            previous = selections.get(selection)
+            if previous != key:
+                # An entry newer than the files was stored by another
+                # session that read them after they changed; it stays
+                if previous is not None and self._older_than(
+                        previous, (str_file, traj_file)):
+                    self.remove(previous)
+                selections[selection] = key
+                _save_json(self._selections_path, selections)
+        return key
+
+    def _older_than(self, key, paths):
+        try:
+            mtime = os.stat(self.path(key)).st_mtime
+        except OSError:
+            return True
+        return mtime < max(os.stat(path).st_mtime for path in paths)
+
+    def path(self, key):
+        return os.path.join(self.root, 'coordinates', key + '.npy')
+
+    def index_path(self, key):
+        return os.path.join(self.root, 'coordinates', key + '.index.npz')
+
+    def load(self, key):
+        """memory-mapped coordinates of a key, or None if not cached"""
+        try:
+            coordinates = np.load(self.path(key), mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        # The modification time orders the entries for eviction
+        os.utime(self.path(key))
+        return coordinates
+
+    def load_index(self, key):
+        """
+        dict of the atom_indices of the selection and of the frames and
+        times of a key, or None if not cached
+        """
+        try:
+            with np.load(self.index_path(key)) as index:
+                return {name: index[name] for name in index.files}
+        except (OSError, ValueError):
+            return None
+
+    def _save_index(self, key, atom_indices, frames, times):
+        def write(tmp_path):
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, atom_indices=atom_indices, frames=frames,
+                         times=times)
+        # Written before the coordinates, so a cached key has an index
+        _replace_atomic(self.index_path(key), write)
+
+    def store(self, key, atoms, frames):
+        """read the positions of atoms at every frame into the cache"""
+        frame_indices = np.empty(len(frames), dtype=np.int64)
+        times = np.empty(len(frames))
+
+        def write(tmp_path):
+            coordinates = np.lib.format.open_memmap(
+                tmp_path, mode='w+', dtype=np.float32,
+                shape=(len(frames), atoms.n_atoms, 3))
+            for frame, ts in enumerate(frames):
+                coordinates[frame] = atoms.positions
+                frame_indices[frame] = ts.frame
+                times[frame] = ts.time
+            coordinates.flush()
+            del coordinates
+            self._save_index(key, atoms.indices, frame_indices, times)
+        _replace_atomic(self.path(key), write)
+        self.evict()
+        return self.load(key)
+
+    def remove(self, key):
+        for path in (self.path(key), self.index_path(key)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def evict(self, max_bytes=None):
+        """remove the least recently used entries beyond max_bytes"""
+        max_bytes = max_bytes if max_bytes is not None else self.max_bytes
+        if max_bytes is None:
+            return
+        directory = os.path.join(self.root, 'coordinates')
+        entries = []
+        for name in os.listdir(directory):
+            if name.endswith('.npy') and not name.startswith('.'):
+                try:
+                    stat = os.stat(os.path.join(directory, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name[:-4]))
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in sorted(entries):
+            if total <= max_bytes:
+                break
+            self.remove(key)
+            total -= size
+
+
+class SelectionReader:
+    """
+    coordinates of an atom selection of a trajectory, read by chunks of
+    frames (positions in start:end:step, in any order) from the cache, or
+    from the trajectory when not cached; the frames read from the trajectory
+    fill a new entry, stored by close() once all of them were read
+
+        with SelectionReader(cache, pdb, xtc, 'name CA') as reader:
+            coordinates, times = reader.read(np.arange(0, reader.n_frames, 10))
+    """
+
+    def __init__(self, cache, str_file, traj_file, group, start=None,
+                 end=None, step=None, str_format=None, traj_format=None,
+                 file_hashes=(None, None)):
+        self.cache = cache
+        self.key = cache.key(str_file, traj_file, str_format, traj_format,
+                             group, start, end, step, file_hashes)
+        self.coordinates = cache.load(self.key)
+        self.index = cache.load_index(self.key)
+        self._tmp_path = None
+        if self.coordinates is None or self.index is None:
+            self.coordinates = None
+            self.atoms, self.frames = open_selection(
+                str_file, traj_file, str_format, traj_format, group,
+                start, end, step)
+            self.n_frames, self.n_atoms = len(self.frames), self.atoms.n_atoms
+            trajectory = self.atoms.universe.trajectory
+            self._frame_numbers = np.arange(trajectory.n_frames)[start:end:step]
+            fd, self._tmp_path = tempfile.mkstemp(
+                dir=os.path.dirname(cache.path(self.key)),
+                prefix='.' + self.key)
+            os.close(fd)
+            self._partial = np.lib.format.open_memmap(
+                self._tmp_path, mode='w+', dtype=np.float32,
+                shape=(self.n_frames, self.n_atoms, 3))
+            self._frame_indices = np.empty(self.n_frames, dtype=np.int64)
+            self._times = np.empty(self.n_frames)
+            self._read = np.zeros(self.n_frames, dtype=bool)
+            self.atom_indices = self.atoms.indices
+        else:
+            self.n_frames, self.n_atoms = self.coordinates.shape[:2]
+            self.atom_indices = self.index['atom_indices']
+
+    @property
+    def cached(self):
+        return self.coordinates is not None
+
+    def read(self, positions):
+        """coordinates (float32) and times of the frames at positions"""
+        positions = np.asarray(positions, dtype=np.int64)
+        if self.cached:
+            return (np.asarray(self.coordinates[positions]),
+                    self.index['times'][positions])
+        unread = positions[~self._read[positions]]
+        if len(unread):
+            trajectory = self.atoms.universe.trajectory
+            for position, ts in zip(unread,
+                                    trajectory[self._frame_numbers[unread]]):
+                self._partial[position] = self.atoms.positions
+                self._frame_indices[position] = ts.frame
+                self._times[position] = ts.time
+            self._read[unread] = True
+        return np.asarray(self._partial[positions]), self._times[positions]
+
+    def close(self):
+        """store the entry if every frame was read, else drop it"""
+        if self._tmp_path is None:
+            return
+        complete = bool(self._read.all())
+        if complete:
+            self._partial.flush()
+            self.cache._save_index(self.key, self.atoms.indices,
+                                   self._frame_indices, self._times)
+        del self._partial
+        if complete:
+            os.replace(self._tmp_path, self.cache.path(self.key))
+            self.cache.evict()
+        else:
+            os.remove(self._tmp_path)
+        self._tmp_path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def extract_coordinates(cache, str_file, traj_file, group, start=None,
+                        end=None, step=None, str_format=None,
+                        traj_format=None, chunk_size=FRAME_CHUNK_SIZE):
+    """
+    key, memory-mapped coordinates and index of an atom selection, read
+    from the trajectory chunk by chunk if it is not cached yet
+    """
+    with SelectionReader(cache, str_file, traj_file, group, start, end, step,
+                         str_format, traj_format) as reader:
+        if not reader.cached:
+            for first in range(0, reader.n_frames, chunk_size):
+                reader.read(np.arange(first, min(first + chunk_size,
+                                                 reader.n_frames)))
+    return reader.key, cache.load(reader.key), cache.load_index(reader.key)
+
+
+class EnsembleView:
+    """
+    read-only (no_t, frames, atoms, 3) view over per-trajectory arrays,
+    enough for the kernels of rmsd_kernels: slicing the first axis stacks
+    only the requested trajectories
+    """
+
+    def __init__(self, arrays):
+        self.arrays = list(arrays)
+        shapes = {array.shape for array in self.arrays}
+        if len(shapes) != 1:
+            raise ValueError('Trajectories have different numbers of frames '
+                             'or selected atoms: {}'.format(sorted(shapes)))
+        self.shape = (len(self.arrays),) + shapes.pop()
+
+    def __len__(self):
+        return len(self.arrays)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return np.stack(self.arrays[index])
+        return self.arrays[index]
+
+
+class PairStore:
+    """RMSDs over time of the pairs of trajectories already computed"""
+
+    def __init__(self, root, superposition=False):
+        self.root = os.path.join(
+            root, 'pairs', 'superposition' if superposition else 'plain')
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, key_a, key_b):
+        key_a, key_b = sorted((key_a, key_b))
+        return os.path.join(self.root, key_a[:2],
+                            '{}-{}.npy'.format(key_a, key_b))
+
+    def has(self, key_a, key_b):
+        return os.path.exists(self.path(key_a, key_b))
+
+    def has_tile(self, keys_i, keys_j):
+        """whether all the pairs of a tile are stored"""
+        return all(self.has(key_i, key_j) for key_i in keys_i
+                   for key_j in keys_j if key_i != key_j)
+
+    def get(self, key_a, key_b):
+        return np.load(self.path(key_a, key_b))
+
+    def put_tile(self, keys_i, keys_j, values):
+        """store the pairs of a tile of values of shape (ni, nj, frames)"""
+        written = set()
+        for i, key_i in enumerate(keys_i):
+            for j, key_j in enumerate(keys_j):
+                path = self.path(key_i, key_j)
+                if key_i == key_j or path in written:
+                    continue
+                written.add(path)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                _save_npy(path, values[i, j].astype(np.float32))
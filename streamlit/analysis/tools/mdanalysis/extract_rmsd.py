@@ -1,21 +1,312 @@
 import argparse
-import json
+import os
+import resource
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-import MDAnalysis as m
 from MDAnalysis.analysis import rms
 
 import numpy as np
 
+from coordinate_cache import (CoordinateCache, EnsembleView, PairStore,
+                              open_selection)
+from rmsd_kernels import (BLOCK_SIZE, compute_tile, get_tile, iter_tiles,
+                          pairwise_rmsd, rmsd_tile)
+from rmsd_output import FORMATS, guess_format, open_writer
+
+
+def get_peak_memory():
+    """Return the peak resident memory of the process in MB."""
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
+
+
+def read_coordinates(atoms, frames):
+    """float32 positions of atoms at every frame, of shape (frames, atoms, 3)"""
+    coordinates = np.empty((len(frames), atoms.n_atoms, 3), dtype=np.float32)
+    for frame, _ in enumerate(frames):
+        coordinates[frame] = atoms.positions
+    return coordinates
+
+
+def write_trajectory(coordinates, traj, atoms, frames, traj_file):
+    """write the positions of atoms at every frame into coordinates[traj]"""
+    if (len(frames), atoms.n_atoms) != coordinates.shape[1:3]:
+        raise ValueError(
+            'Trajectory {} has {} frames and {} selected atoms, expected '
+            '{} and {}.'.format(traj_file, len(frames), atoms.n_atoms,
+                                *coordinates.shape[1:3]))
+    for frame, _ in enumerate(frames):
+        coordinates[traj, frame] = atoms.positions
+    coordinates.flush()
+
+
+def _load_trajectory(memmap_path, traj, *trajectory_args):
+    # process pool worker: the coordinates go through the memory map
+    coordinates = np.load(memmap_path, mmap_mode='r+')
+    atoms, frames = open_selection(*trajectory_args)
+    write_trajectory(coordinates, traj, atoms, frames, trajectory_args[1])
+
+
+def stream_coordinates(str_file_list, traj_file_list, str_format, traj_format,
+                       group, start, end, step, memmap_path=None, workers=1):
+    """
+    read the selected atoms of every trajectory frame by frame, without
+    loading the trajectories in memory.
+
+    The coordinates are written into a float32 array of shape
+    (no_t, frames, atoms, 3) memory-mapped to memmap_path (a temporary file
+    of the temporary directory, see tempfile, if not given; it is removed
+    if reading fails), so only one frame per trajectory
+    needs to fit in memory. With several workers, trajectories are read in
+    parallel processes writing into the same memory map.
+    """
+    no_t = len(traj_file_list)
+    trajectory_args = [
+        (str_file_list[traj], traj_file_list[traj], str_format, traj_format,
+         group, start, end, step)
+        for traj in range(no_t)
+    ]
+
+    atoms, frames = open_selection(*trajectory_args[0])
+    temporary = memmap_path is None
+    if temporary:
+        # The directory of the inputs may be read-only
+        fd, memmap_path = tempfile.mkstemp(suffix='.npy')
+        os.close(fd)
+    try:
+        coordinates = np.lib.format.open_memmap(
+            memmap_path, mode='w+', dtype=np.float32,
+            shape=(no_t, len(frames), atoms.n_atoms, 3))
+
+        if workers > 1:
+            with ProcessPoolExecutor(workers) as executor:
+                futures = [
+                    executor.submit(_load_trajectory, memmap_path, traj,
+                                    *trajectory_args[traj])
+                    for traj in range(no_t)
+                ]
+                for future in futures:
+                    future.result()
+        else:
+            write_trajectory(coordinates, 0, atoms, frames, traj_file_list[0])
+            for traj in range(1, no_t):
+                atoms, frames = open_selection(*trajectory_args[traj])
+                write_trajectory(coordinates, traj, atoms, frames,
+                                 traj_file_list[traj])
+    except BaseException:
+        if temporary:
+            os.remove(memmap_path)
+        raise
+
+    return coordinates
+
+
+def _compute_tile(coordinates_path, data_path, tile, superposition):
+    # process pool worker: inputs and outputs go through memory maps
+    coordinates = np.load(coordinates_path, mmap_mode='r')
+    data = np.load(data_path, mmap_mode='r+')
+    compute_tile(coordinates, data, tile, superposition)
+    data.flush()
+
+
+def parallel_pairwise_rmsd(coordinates, superposition=False, workers=1,
+                           block_size=BLOCK_SIZE, on_tile=None):
+    """
+    pairwise_rmsd with the tiles of the upper triangle spread over a process
+    pool; coordinates are shared with the workers through their .npy memory
+    map (see stream_coordinates), or through a temporary copy when they are
+    in memory. The result is identical to pairwise_rmsd, on_tile is called
+    as tiles complete, in any order.
+    """
+    no_t, frames = coordinates.shape[:2]
+    temporary_paths = []
+    try:
+        coordinates_path = getattr(coordinates, 'filename', None)
+        if coordinates_path is None:
+            fd, coordinates_path = tempfile.mkstemp(suffix='.npy')
+            temporary_paths.append(coordinates_path)
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, coordinates)
+        fd, data_path = tempfile.mkstemp(suffix='.npy')
+        os.close(fd)
+        temporary_paths.append(data_path)
+        shared_data = np.lib.format.open_memmap(
+            data_path, mode='w+', dtype=np.float64, shape=(no_t, no_t, frames))
+        with ProcessPoolExecutor(workers) as executor:
+            futures = {
+                executor.submit(_compute_tile, coordinates_path, data_path,
+                                tile, superposition): tile
+                for tile in iter_tiles(no_t, block_size)
+            }
+            for future in as_completed(futures):
+                future.result()
+                if on_tile is not None:
+                    tile = futures[future]
+                    on_tile(tile, get_tile(shared_data, tile))
+        data = np.array(shared_data)
+        del shared_data
+    finally:
+        for path in temporary_paths:
+            os.remove(path)
+    data[np.arange(no_t), np.arange(no_t)] = 0
+    return data
+
+
+def _cache_trajectory(cache_dir, key, *trajectory_args):
+    # process pool worker: the coordinates go through the cache files
+    atoms, frames = open_selection(*trajectory_args)
+    CoordinateCache(cache_dir).store(key, atoms, frames)
+
+
+def cached_coordinates(cache, trajectory_args, workers=1):
+    """
+    keys and coordinates (an EnsembleView of memory maps) of the
+    trajectories described by trajectory_args (see open_selection); only
+    the trajectories missing from the cache are read
+    """
+    keys = [cache.key(*args) for args in trajectory_args]
+    missing = {}
+    for key, args in zip(keys, trajectory_args):
+        if cache.load(key) is None:
+            missing.setdefault(key, args)
+    print("{} of {} distinct trajs read from the coordinate cache".format(
+        len(set(keys)) - len(missing), len(set(keys))))
+
+    if workers > 1:
+        with ProcessPoolExecutor(workers) as executor:
+            futures = [executor.submit(_cache_trajectory, cache.root, key, *args)
+                       for key, args in missing.items()]
+            for future in futures:
+                future.result()
+    else:
+        for key, args in missing.items():
+            cache.store(key, *open_selection(*args))
+
+    return keys, EnsembleView(cache.load(key) for key in keys)
+
+
+def iter_incremental_tiles(n_old, no_t, block_size=BLOCK_SIZE):
+    """
+    tiles of the rows and columns of the new trajectories, which are the
+    last no_t - n_old ones: old x new, then the upper triangle of new x new
+    """
+    for start_i in range(0, n_old, block_size):
+        for start_j in range(n_old, no_t, block_size):
+            yield (start_i, min(start_i + block_size, n_old),
+                   start_j, min(start_j + block_size, no_t))
+    for start_i, stop_i, start_j, stop_j in iter_tiles(no_t - n_old,
+                                                       block_size):
+        yield (start_i + n_old, stop_i + n_old,
+               start_j + n_old, stop_j + n_old)
+
+
+def _compute_pairs(paths, keys, tile, superposition, cache_dir):
+    # process pool worker: coordinates and results go through the cache
+    ensemble = EnsembleView(np.load(path, mmap_mode='r') for path in paths)
+    start_i, stop_i, start_j, stop_j = tile
+    values = rmsd_tile(ensemble[start_i:stop_i], ensemble[start_j:stop_j],
+                       superposition)
+    PairStore(cache_dir, superposition).put_tile(
+        keys[start_i:stop_i], keys[start_j:stop_j], values)
+
+
+def incremental_rmsd(cache, keys, superposition=False, workers=1,
+                     block_size=BLOCK_SIZE):
+    """
+    compute the pairs of trajectories missing from the PairStore of the
+    cache, tile by tile; each completed tile is stored, so an interrupted
+    run restarts after the last completed tile
+
+    returns the PairStore
+    """
+    store = PairStore(cache.root, superposition)
+    unique_keys = list(dict.fromkeys(keys))
+    # Every missing pair has its last trajectory in new, so all the pairs of
+    # the other (old) trajectories are known.
+    new = set()
+    for b in range(len(unique_keys)):
+        for a in range(b):
+            if not store.has(unique_keys[a], unique_keys[b]):
+                new.add(unique_keys[b])
+                break
+    order = ([key for key in unique_keys if key not in new]
+             + [key for key in unique_keys if key in new])
+    n_old = len(unique_keys) - len(new)
+    print("Computing the RMSDs of {} new trajs against {} already "
+          "computed".format(len(new), n_old))
+
+    ensemble = EnsembleView(cache.load(key) for key in order)
+    tiles = [
+        (start_i, stop_i, start_j, stop_j)
+        for start_i, stop_i, start_j, stop_j
+        in iter_incremental_tiles(n_old, len(order), block_size)
+        if not store.has_tile(order[start_i:stop_i], order[start_j:stop_j])
+    ]
+    if workers > 1:
+        paths = [cache.path(key) for key in order]
+        with ProcessPoolExecutor(workers) as executor:
+            futures = [executor.submit(_compute_pairs, paths, order, tile,
+                                       superposition, cache.root)
+                       for tile in tiles]
+            for future in futures:
+                future.result()
+    else:
+        for start_i, stop_i, start_j, stop_j in tiles:
+            values = rmsd_tile(ensemble[start_i:stop_i],
+                               ensemble[start_j:stop_j], superposition)
+            store.put_tile(order[start_i:stop_i], order[start_j:stop_j],
+                           values)
+    return store
+
+
+def write_from_store(writer, store, keys, frames, block_size=BLOCK_SIZE):
+    """write the RMSDs of keys, all present in store, tile by tile"""
+    for tile in iter_tiles(len(keys), block_size):
+        start_i, stop_i, start_j, stop_j = tile
+        values = np.zeros((stop_i - start_i, stop_j - start_j, frames))
+        for i in range(start_i, stop_i):
+            for j in range(start_j, stop_j):
+                if keys[i] != keys[j]:
+                    values[i - start_i, j - start_j] = store.get(keys[i],
+                                                                 keys[j])
+        writer.write_tile(tile, values)
+
+
+def loop_rmsd(universe_coordinate_data, superposition=False):
+    """
+    reference implementation of pairwise_rmsd calling rms.rmsd once per
+    (traj1, traj2, frame)
+    """
+    no_t = universe_coordinate_data.shape[0]
+    data = np.zeros((no_t, no_t, universe_coordinate_data.shape[1]))
+
+    for traj1 in range(no_t):
+        print("Calculating differences for traj {}".format(traj1))
+        for traj2 in range(traj1):
+            for frame in range(data.shape[2]):
+                A = universe_coordinate_data[traj1, frame]
+                B = universe_coordinate_data[traj2, frame]
+                r = rms.rmsd(A, B, superposition=superposition)
+                data[traj1, traj2, frame] = r
+                data[traj2, traj1, frame] = r
+    return data
+
 
 def calc_rmsd(str_files, traj_files, str_format, traj_format, filepath_out,
-              group, start, end, step):
+              group, start, end, step, stream=False, memmap_path=None,
+              superposition=False, kernel='batched', workers=1,
+              output_format=None, cache_dir=None):
     """
     the function will cycle through range 0 to no_t and load all files found.
 
     str_files: text file with filepaths for structures, one on each line
     traj_files: text file with filepaths for trajectories, one on each line
     filepath_in: directory where the files are located
-    filepath_out: pickle file where results (3D matrix) should be saved to
+    filepath_out: file where results (3D matrix) should be saved to, see
+        rmsd_output for the formats
 
     group: atoms for which RMSD should be calculated;
         use the MDAnalysis selection language
@@ -24,6 +315,24 @@ def calc_rmsd(str_files, traj_files, str_format, traj_format, filepath_out,
     end: last trajectory frame to calculate RMSD
     step: how frequently frames are sampled between start and end; obviously,
         the larger the step, the quicker the script finishes
+
+    stream: keep the coordinates of the group in a float32 memory-mapped
+        array instead of in memory; in every mode, only the coordinates of
+        the group are read
+    memmap_path: file backing the memory-mapped array in stream mode
+
+    superposition: minimize the RMSD over rotations and translations
+    kernel: 'batched' computes tiles of trajectory pairs at once with NumPy,
+        'loop' calls rms.rmsd once per pair and frame
+    workers: number of processes loading the trajectories and computing the
+        tiles of the RMSD matrix; coordinates are shared through a memory map
+        (memmap_path), the result is identical to a serial run
+    output_format: one of rmsd_output.FORMATS, guessed from the suffix of
+        filepath_out by default
+    cache_dir: directory of the coordinate and result caches; only the
+        trajectories and the pairs of trajectories missing from it are
+        read and computed (the batched kernel is used, memmap_path is
+        ignored)
     """
 
     # open list of files
@@ -36,36 +345,67 @@ def calc_rmsd(str_files, traj_files, str_format, traj_format, filepath_out,
 
     no_t = len(traj_file_list)
 
-    # hard to find array size before loading files
-    universe_coordinate_data = []
-
-    for traj in range(no_t):
-        # We no longer align here, users should do this themselves.
-        u = m.Universe(str_file_list[traj], traj_file_list[traj],
-                       format=traj_format, topology_format=str_format)
-        u.transfer_to_memory()
-        grp = u.select_atoms(group).universe
-        coordinates = grp.trajectory.coordinate_array[start:end:step]
-        universe_coordinate_data.append(coordinates)
-
-    universe_coordinate_data = np.array(universe_coordinate_data)
+    # We no longer align here, users should do this themselves.
+    if cache_dir is not None:
+        cache = CoordinateCache(cache_dir)
+        trajectory_args = [
+            (str_file_list[traj], traj_file_list[traj], str_format,
+             traj_format, group, start, end, step)
+            for traj in range(no_t)
+        ]
+        keys, universe_coordinate_data = cached_coordinates(
+            cache, trajectory_args, workers)
+    elif stream or workers > 1:
+        universe_coordinate_data = stream_coordinates(
+            str_file_list, traj_file_list, str_format, traj_format,
+            group, start, end, step, memmap_path, workers=workers)
+    else:
+        # Only the positions of the group are kept, frame by frame
+        universe_coordinate_data = np.array([
+            read_coordinates(*open_selection(
+                str_file_list[traj], traj_file_list[traj], str_format,
+                traj_format, group, start, end, step))
+            for traj in range(no_t)
+        ])
     print("All trajs loaded by MDAnalysis")
-    data = np.zeros((no_t, no_t, universe_coordinate_data.shape[1]))
 
-    # calculate differences
-    for traj1 in range(no_t):
-        print("Calculating differences for traj {}".format(traj1))
-        for traj2 in range(traj1):
-            for frame in range(data.shape[2]):
-                A = universe_coordinate_data[traj1, frame]
-                B = universe_coordinate_data[traj2, frame]
-                r = rms.rmsd(A, B)
-                data[traj1, traj2, frame] = r
-                data[traj2, traj1, frame] = r
+    metadata = {
+        'group': group,
+        'start': start,
+        'end': end,
+        'step': step,
+        'superposition': superposition,
+        'structures': str_file_list,
+        'trajectories': traj_file_list,
+        'structure_format': str_format,
+        'trajectory_format': traj_format,
+    }
+    try:
+        writer = open_writer(filepath_out,
+                             output_format or guess_format(filepath_out),
+                             no_t, universe_coordinate_data.shape[1], metadata)
 
-    with open(filepath_out, 'w') as f:
-        json.dump(data.tolist(), f, indent=4, sort_keys=True)
+        # calculate differences, results are written as tiles complete
+        if cache_dir is not None:
+            store = incremental_rmsd(cache, keys, superposition, workers)
+            write_from_store(writer, store, keys,
+                             universe_coordinate_data.shape[1])
+        elif kernel == 'loop':
+            data = loop_rmsd(universe_coordinate_data, superposition)
+            writer.write_tile((0, no_t, 0, no_t), data)
+        elif workers > 1:
+            parallel_pairwise_rmsd(universe_coordinate_data, superposition,
+                                   workers, on_tile=writer.write_tile)
+        else:
+            pairwise_rmsd(universe_coordinate_data, superposition,
+                          on_tile=writer.write_tile)
+        writer.close()
+    finally:
+        if (cache_dir is None and (stream or workers > 1)
+                and memmap_path is None):
+            os.remove(universe_coordinate_data.filename)
 
+    print("Peak memory: {:.1f} MB".format(get_peak_memory()))
     print("Done!")
     return
 
@@ -80,7 +420,7 @@ def main():
                         help='Trajectory format.')
     parser.add_argument("--str-format", help='Structure format.')
     parser.add_argument('-o', '--outfile',
-                        help="Path to the output JSON file")
+                        help="Path to the output file")
     parser.add_argument('--group', help="Atoms for which RMSD should be"
                         "calculated in MDAnalysis selection language")
     parser.add_argument('--start', type=int,
@@ -89,10 +429,37 @@ def main():
                         help="Last trajectory frame to calculate RMSD")
     parser.add_argument('--step', type=int,
                         help="Frame sampling frequency for RMSD calculation")
+    parser.add_argument('--stream', action='store_true',
+                        help="Read trajectories frame by frame instead of "
+                        "loading them in memory")
+    parser.add_argument('--memmap',
+                        help="File backing the coordinates in stream mode "
+                        "(a temporary file is used by default)")
+    parser.add_argument('--superposition', action='store_true',
+                        help="Superimpose the structures before computing "
+                        "the RMSD")
+    parser.add_argument('--kernel', choices=['batched', 'loop'],
+                        default='batched',
+                        help="RMSD implementation: batched NumPy tiles or "
+                        "one rms.rmsd call per pair and frame")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Number of processes used to load trajectories "
+                        "and compute the RMSD matrix")
+    parser.add_argument('--output-format', choices=FORMATS,
+                        help="Format of the output file (guessed from its "
+                        "suffix by default, npz if unknown)")
+    parser.add_argument('--cache-dir',
+                        help="Directory caching coordinates and computed "
+                        "pairs: only new trajectories are read and only "
+                        "their rows and columns are computed")
     args = parser.parse_args()
     calc_rmsd(args.strs, args.trajs, args.str_format,
               args.traj_format, args.outfile,
-              args.group, args.start, args.end, args.step)
+              args.group, args.start, args.end, args.step,
+              stream=args.stream, memmap_path=args.memmap,
+              superposition=args.superposition, kernel=args.kernel,
+              workers=args.workers, output_format=args.output_format,
+              cache_dir=args.cache_dir)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,132 @@
+"""
+Batched NumPy kernels for pairwise RMSD between trajectories.
+
+The coordinates of an ensemble are an array of shape (no_t, frames, atoms, 3).
+Instead of calling MDAnalysis.analysis.rms.rmsd once per (traj1, traj2, frame),
+the RMSDs of a whole tile of trajectory pairs are computed at once, from the
+differences of the coordinates as rms.rmsd does, so equal structures give
+exactly 0. With superposition, the optimal rotation of each pair of frames
+comes from the SVD of their 3x3 covariance matrix (Kabsch, with the
+reflection correction, which is what the QCP algorithm of
+rms.rmsd(..., superposition=True) computes).
+"""
+
+import numpy as np
+
+# Number of trajectories per tile side. Results do not depend on how the
+# tiles are scheduled.
+BLOCK_SIZE = 8
+# Bytes of coordinate differences held at once while computing a tile.
+CHUNK_BYTES = 64 * 1024**2
+
+
+def _center(coordinates):
+    return coordinates - coordinates.mean(axis=-2, keepdims=True)
+
+
+def _rotations(coords_i, coords_j):
+    """
+    rotations of shape (ni, nj, frames, 3, 3) such that
+    coords_i[i, f] @ rotations[i, j, f] best fits coords_j[j, f]; both
+    arrays are centered
+    """
+    ni, frames, atoms, _ = coords_i.shape
+    nj = coords_j.shape[0]
+    # covariance[f, i, k, j, l] = sum_n coords_i[i, f, n, k] * coords_j[j, f, n, l]
+    a = coords_i.transpose(1, 0, 3, 2).reshape(frames, ni * 3, atoms)
+    b = coords_j.transpose(1, 2, 0, 3).reshape(frames, atoms, nj * 3)
+    covariance = (a @ b).reshape(frames, ni, 3, nj, 3).transpose(1, 3, 0, 2, 4)
+    u, _, vt = np.linalg.svd(covariance)
+    # Improper rotations are not allowed: flip the last singular vector.
+    u[..., -1] *= np.sign(np.linalg.det(u @ vt))[..., None]
+    return u @ vt
+
+
+def rmsd_tile(coords_i, coords_j, superposition=False):
+    """
+    RMSD between every trajectory of coords_i and every trajectory of
+    coords_j, frame by frame.
+
+    coords_i: array of shape (ni, frames, atoms, 3)
+    coords_j: array of shape (nj, frames, atoms, 3)
+    superposition: minimize the RMSD over rotations and translations
+
+    returns an array of shape (ni, nj, frames)
+    """
+    ni, frames, atoms, _ = coords_i.shape
+    nj = coords_j.shape[0]
+    coords_i = np.asarray(coords_i, dtype=np.float64)
+    coords_j = np.asarray(coords_j, dtype=np.float64)
+    if superposition:
+        coords_i = _center(coords_i)
+        coords_j = _center(coords_j)
+        rotations = _rotations(coords_i, coords_j)
+
+    values = np.empty((ni, nj, frames))
+    step = max(1, CHUNK_BYTES // (nj * atoms * 3 * 8))
+    for i in range(ni):
+        for start in range(0, frames, step):
+            stop = min(start + step, frames)
+            a = coords_i[i, start:stop]
+            if superposition:
+                a = a @ rotations[i, :, start:stop]
+            differences = a - coords_j[:, start:stop]
+            # Summed over each structure at once, like rms.rmsd.
+            squares = (differences ** 2).reshape(nj, stop - start, atoms * 3)
+            values[i, :, start:stop] = np.sqrt(squares.sum(axis=-1) / atoms)
+    return values
+
+
+def iter_tiles(no_t, block_size=BLOCK_SIZE):
+    """
+    yield the (start_i, stop_i, start_j, stop_j) tiles covering the upper
+    triangle (diagonal included) of a no_t x no_t matrix
+    """
+    for start_i in range(0, no_t, block_size):
+        for start_j in range(start_i, no_t, block_size):
+            yield (start_i, min(start_i + block_size, no_t),
+                   start_j, min(start_j + block_size, no_t))
+
+
+def fill_tile(data, tile, values):
+    """write the values of a tile and of its transpose into data"""
+    start_i, stop_i, start_j, stop_j = tile
+    data[start_i:stop_i, start_j:stop_j] = values
+    data[start_j:stop_j, start_i:stop_i] = values.transpose(1, 0, 2)
+
+
+def get_tile(data, tile):
+    """values of a tile of data"""
+    start_i, stop_i, start_j, stop_j = tile
+    return data[start_i:stop_i, start_j:stop_j]
+
+
+def compute_tile(coordinates, data, tile, superposition=False):
+    """compute one tile of pairwise_rmsd and write it into data"""
+    start_i, stop_i, start_j, stop_j = tile
+    values = rmsd_tile(coordinates[start_i:stop_i],
+                       coordinates[start_j:stop_j], superposition)
+    fill_tile(data, tile, values)
+
+
+def pairwise_rmsd(coordinates, superposition=False, block_size=BLOCK_SIZE,
+                  on_tile=None):
+    """
+    RMSD between all pairs of trajectories, frame by frame.
+
+    coordinates: array of shape (no_t, frames, atoms, 3), possibly
+        memory-mapped; only two tiles of trajectories are read at a time
+    superposition: minimize the RMSD over rotations and translations
+    block_size: number of trajectories per tile side
+    on_tile: called with (tile, values) as soon as a tile is computed
+
+    returns an array of shape (no_t, no_t, frames) with a zero diagonal
+    """
+    no_t, frames = coordinates.shape[:2]
+    data = np.zeros((no_t, no_t, frames))
+    for tile in iter_tiles(no_t, block_size):
+        compute_tile(coordinates, data, tile, superposition)
+        if on_tile is not None:
+            on_tile(tile, get_tile(data, tile))
+    data[np.arange(no_t), np.arange(no_t)] = 0
+    return data
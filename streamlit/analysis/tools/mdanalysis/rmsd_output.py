@@ -0,0 +1,350 @@
+"""
+Output backends for the pairwise RMSD tensor of extract_rmsd.
+
+Except for JSON, which keeps the historical dense (no_t, no_t, frames) float64
+layout, results are stored in float32 as the condensed upper triangle: row k
+holds the RMSDs over time of the pair (i, j), i < j, with
+
+    k = i * (2 * no_t - i - 1) // 2 + j - i - 1
+
+together with metadata (group, start/end/step, input files...). For npy,
+npz, zarr and parquet, tiles are written as soon as they are computed and
+the indices of the completed tiles are recorded, so a crashed run keeps the
+work already done. hdf5 and json files are only valid once the run is over.
+
+Formats:
+
+- npy: .npy memory map, metadata in <outfile>.json
+- npz: compressed .npz written on close (tiles are staged in a .npy)
+- hdf5: chunked, compressed HDF5 dataset "rmsd" (requires h5py)
+- zarr: chunked, compressed Zarr array (requires zarr)
+- parquet: long format table (traj1, traj2, frame, rmsd), one row group
+  per tile; tiles are staged as files of <outfile>.tiles, with the metadata
+  in <outfile>.tiles/metadata.json, and merged on close
+- json: dense float64 tensor, written on close
+"""
+
+import abc
+import json
+import os
+import shutil
+
+import numpy as np
+
+FORMATS = ['npy', 'npz', 'hdf5', 'zarr', 'parquet', 'json']
+SUFFIXES = {
+    '.npy': 'npy',
+    '.npz': 'npz',
+    '.h5': 'hdf5',
+    '.hdf5': 'hdf5',
+    '.zarr': 'zarr',
+    '.parquet': 'parquet',
+    '.json': 'json',
+}
+DEFAULT_FORMAT = 'npz'
+
+
+def guess_format(filepath):
+    """output format from the file suffix, npz if it is unknown"""
+    return SUFFIXES.get(os.path.splitext(filepath)[1].lower(), DEFAULT_FORMAT)
+
+
+def n_pairs(no_t):
+    return no_t * (no_t - 1) // 2
+
+
+def pair_index(i, j, no_t):
+    """row of the pair (i, j), i < j, in the condensed upper triangle"""
+    return i * (2 * no_t - i - 1) // 2 + j - i - 1
+
+
+def iter_tile_rows(tile, values, no_t):
+    """
+    yield (first_row, rows) for each run of consecutive pairs i < j of a tile,
+    rows being an array of shape (pairs, frames)
+    """
+    start_i, stop_i, start_j, stop_j = tile
+    for i in range(start_i, stop_i):
+        first_j = max(start_j, i + 1)
+        if first_j >= stop_j:
+            continue
+        yield (pair_index(i, first_j, no_t),
+               values[i - start_i, first_j - start_j:])
+
+
+def condensed_to_dense(condensed, no_t):
+    """symmetric (no_t, no_t, frames) float64 tensor from condensed rows"""
+    data = np.zeros((no_t, no_t, condensed.shape[1]))
+    i, j = np.triu_indices(no_t, k=1)
+    data[i, j] = condensed
+    data[j, i] = condensed
+    return data
+
+
+def write_json_atomic(filepath, data):
+    tmp_path = filepath + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, filepath)
+
+
+class RMSDWriter(abc.ABC):
+    """
+    base class of the writers: subclasses store a tile in write_tile and
+    finalize the file in close
+    """
+
+    def __init__(self, filepath, no_t, frames, metadata):
+        self.filepath = filepath
+        self.no_t = no_t
+        self.frames = frames
+        self.metadata = dict(metadata, no_t=no_t, frames=frames,
+                             layout='condensed upper triangle',
+                             completed_tiles=[])
+
+    @abc.abstractmethod
+    def write_tile(self, tile, values):
+        """store the RMSDs of a tile, of shape (ni, nj, frames)"""
+
+    def close(self):
+        pass
+
+
+class CondensedWriter(RMSDWriter):
+    """
+    base class of the writers of a (pairs, frames) array: subclasses store
+    the rows of a tile in _write_rows and record the completed tiles in
+    _write_metadata
+    """
+
+    def write_tile(self, tile, values):
+        for first_row, rows in iter_tile_rows(tile, values, self.no_t):
+            self._write_rows(first_row, rows.astype(np.float32))
+        self.metadata['completed_tiles'].append(list(tile))
+        self._write_metadata()
+
+    @abc.abstractmethod
+    def _write_rows(self, first_row, rows):
+        """store consecutive rows of the condensed array"""
+
+    def _write_metadata(self):
+        pass
+
+
+class NpyWriter(CondensedWriter):
+
+    def __init__(self, filepath, no_t, frames, metadata):
+        super().__init__(filepath, no_t, frames, metadata)
+        self.array = np.lib.format.open_memmap(
+            filepath, mode='w+', dtype=np.float32,
+            shape=(n_pairs(no_t), frames))
+        self._write_metadata()
+
+    def _write_rows(self, first_row, rows):
+        self.array[first_row:first_row + len(rows)] = rows
+
+    def _write_metadata(self):
+        self.array.flush()
+        write_json_atomic(self.filepath + '.json', self.metadata)
+
+
+class NpzWriter(NpyWriter):
+
+    def __init__(self, filepath, no_t, frames, metadata):
+        self.npz_path = filepath
+        super().__init__(filepath + '.partial.npy', no_t, frames, metadata)
+
+    def close(self):
+        # A file object keeps numpy from appending .npz to the path.
+        with open(self.npz_path, 'wb') as f:
+            np.savez_compressed(f, rmsd=self.array,
+                                metadata=json.dumps(self.metadata))
+        del self.array
+        os.remove(self.filepath)
+        os.remove(self.filepath + '.json')
+
+
+class HDF5Writer(CondensedWriter):
+
+    def __init__(self, filepath, no_t, frames, metadata):
+        try:
+            import h5py
+        except ImportError:
+            raise ImportError('h5py is required for the hdf5 output format')
+        super().__init__(filepath, no_t, frames, metadata)
+        self.file = h5py.File(filepath, 'w')
+        self.dataset = self.file.create_dataset(
+            'rmsd', shape=(n_pairs(no_t), frames), dtype=np.float32,
+            chunks=(max(1, min(n_pairs(no_t), 256)), max(1, min(frames, 1024))),
+            compression='gzip', shuffle=True)
+
+    def _write_rows(self, first_row, rows):
+        self.dataset[first_row:first_row + len(rows)] = rows
+
+    def close(self):
+        # An HDF5 file is not readable after a crash, whatever was flushed,
+        # so the metadata is only written once every tile is there.
+        self.dataset.attrs['metadata'] = json.dumps(self.metadata)
+        self.file.close()
+
+
+class ZarrWriter(CondensedWriter):
+
+    def __init__(self, filepath, no_t, frames, metadata):
+        try:
+            import zarr
+        except ImportError:
+            raise ImportError('zarr is required for the zarr output format')
+        super().__init__(filepath, no_t, frames, metadata)
+        self.array = zarr.open(
+            filepath, mode='w', shape=(n_pairs(no_t), frames),
+            chunks=(max(1, min(n_pairs(no_t), 256)), max(1, min(frames, 1024))),
+            dtype=np.float32)
+        self._write_metadata()
+
+    def _write_rows(self, first_row, rows):
+        self.array[first_row:first_row + len(rows)] = rows
+
+    def _write_metadata(self):
+        self.array.attrs['metadata'] = json.dumps(self.metadata)
+
+
+class ParquetWriter(RMSDWriter):
+
+    def __init__(self, filepath, no_t, frames, metadata):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        super().__init__(filepath, no_t, frames, metadata)
+        self._pa = pa
+        self._pq = pq
+        self.schema = pa.schema(
+            [('traj1', pa.int32()), ('traj2', pa.int32()),
+             ('frame', pa.int32()), ('rmsd', pa.float32())])
+        # A parquet file is only readable once its footer is written, so
+        # each tile is a complete file until close merges them.
+        self.tiles_dir = filepath + '.tiles'
+        shutil.rmtree(self.tiles_dir, ignore_errors=True)
+        os.makedirs(self.tiles_dir)
+        self._write_metadata()
+
+    def _tile_path(self, number):
+        return os.path.join(self.tiles_dir, '{:06d}.parquet'.format(number))
+
+    def _write_metadata(self):
+        write_json_atomic(os.path.join(self.tiles_dir, 'metadata.json'),
+                          self.metadata)
+
+    def write_tile(self, tile, values):
+        start_i, stop_i, start_j, stop_j = tile
+        i, j = np.meshgrid(np.arange(start_i, stop_i),
+                           np.arange(start_j, stop_j), indexing='ij')
+        upper = i < j
+        i, j, rows = i[upper], j[upper], values[upper]
+        frames = np.arange(self.frames, dtype=np.int32)
+        path = self._tile_path(len(self.metadata['completed_tiles']))
+        self._pq.write_table(self._pa.table({
+            'traj1': np.repeat(i, self.frames).astype(np.int32),
+            'traj2': np.repeat(j, self.frames).astype(np.int32),
+            'frame': np.tile(frames, len(rows)),
+            'rmsd': rows.reshape(-1).astype(np.float32),
+        }, schema=self.schema), path + '.tmp', compression='zstd')
+        os.replace(path + '.tmp', path)
+        self.metadata['completed_tiles'].append(list(tile))
+        self._write_metadata()
+
+    def close(self):
+        schema = self.schema.with_metadata(
+            {'rmsd': json.dumps(self.metadata)})
+        with self._pq.ParquetWriter(self.filepath + '.tmp', schema,
+                                    compression='zstd') as writer:
+            for number in range(len(self.metadata['completed_tiles'])):
+                writer.write_table(self._pq.read_table(
+                    self._tile_path(number)).cast(schema))
+        os.replace(self.filepath + '.tmp', self.filepath)
+        shutil.rmtree(self.tiles_dir)
+
+
+class JSONWriter(RMSDWriter):
+
+    def __init__(self, filepath, no_t, frames, metadata):
+        super().__init__(filepath, no_t, frames, metadata)
+        self.data = np.zeros((no_t, no_t, frames))
+
+    def write_tile(self, tile, values):
+        start_i, stop_i, start_j, stop_j = tile
+        self.data[start_i:stop_i, start_j:stop_j] = values
+        self.data[start_j:stop_j, start_i:stop_i] = values.transpose(1, 0, 2)
+        self.metadata['completed_tiles'].append(list(tile))
+
+    def close(self):
+        self.data[np.arange(self.no_t), np.arange(self.no_t)] = 0
+        with open(self.filepath, 'w') as f:
+            json.dump(self.data.tolist(), f, indent=4, sort_keys=True)
+
+
+WRITERS = {
+    'npy': NpyWriter,
+    'npz': NpzWriter,
+    'hdf5': HDF5Writer,
+    'zarr': ZarrWriter,
+    'parquet': ParquetWriter,
+    'json': JSONWriter,
+}
+
+
+def open_writer(filepath, output_format, no_t, frames, metadata):
+    """return the writer of output_format (see FORMATS)"""
+    return WRITERS[output_format](filepath, no_t, frames, metadata)
+
+
+def read_rmsd(filepath, output_format=None):
+    """
+    read a result file back as (data, metadata), data being the dense
+    (no_t, no_t, frames) float64 tensor
+    """
+    output_format = output_format or guess_format(filepath)
+    if output_format == 'json':
+        with open(filepath) as f:
+            return np.array(json.load(f)), {}
+
+    if output_format == 'npy':
+        with open(filepath + '.json') as f:
+            metadata = json.load(f)
+        condensed = np.load(filepath)
+    elif output_format == 'npz':
+        with np.load(filepath) as npz:
+            metadata = json.loads(str(npz['metadata']))
+            condensed = npz['rmsd']
+    elif output_format == 'hdf5':
+        import h5py
+        with h5py.File(filepath, 'r') as f:
+            metadata = json.loads(f['rmsd'].attrs['metadata'])
+            condensed = f['rmsd'][:]
+    elif output_format == 'zarr':
+        import zarr
+        array = zarr.open(filepath, mode='r')
+        metadata = json.loads(array.attrs['metadata'])
+        condensed = array[:]
+    else:
+        import pyarrow.parquet as pq
+        tiles_dir = filepath + '.tiles'
+        if os.path.isdir(tiles_dir):
+            # tiles of an interrupted run
+            with open(os.path.join(tiles_dir, 'metadata.json')) as f:
+                metadata = json.load(f)
+            tables = [pq.read_table(os.path.join(tiles_dir, '{:06d}.parquet'.format(n)))
+                      for n in range(len(metadata['completed_tiles']))]
+        else:
+            table = pq.read_table(filepath)
+            metadata = json.loads(table.schema.metadata[b'rmsd'])
+            tables = [table]
+        no_t, frames = metadata['no_t'], metadata['frames']
+        data = np.zeros((no_t, no_t, frames))
+        for table in tables:
+            i, j, frame, rmsd = (table.column(name).to_numpy()
+                                 for name in ('traj1', 'traj2', 'frame', 'rmsd'))
+            data[i, j, frame] = rmsd
+            data[j, i, frame] = rmsd
+        return data, metadata
+
+    return condensed_to_dense(condensed, metadata['no_t']), metadata
@@ -0,0 +1,376 @@
+"""Registry of the Galaxy tool wrappers shipped with the application.
+
+The tools directory is scanned once and each wrapper is parsed into a
+``ToolSpec`` (inputs, outputs, formats, requirements), kept until the
+modification time of the wrapper or of its macro files changes. Commands are
+rendered by substituting the Cheetah placeholders of the ``<command>`` with
+the parameter values: ``$name``, ``${name}``, ``$name.ext``,
+``$name[0].ext`` and ``"${name[@]}"`` for all the elements of a collection.
+A rendered command made of a single program invocation is run without a
+shell; parameter values are validated so that they are never interpreted by
+a shell either way.
+"""
+
+import copy
+import os
+import re
+import shlex
+import threading
+import time
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+TOOLS_DIR = Path(__file__).parent
+REFRESH_INTERVAL = 5
+DATA_TYPES = ("data", "data_collection")
+
+PLACEHOLDER = re.compile(
+    r"\$(?:\{(?P<braced>[^}]*)\}|(?P<bare>[A-Za-z_]\w*(?:\[[^\]]*\]|\.[A-Za-z_]\w*)*))"
+)
+ACCESSOR = re.compile(r"\[(?P<index>[^\]]*)\]|\.(?P<attribute>[A-Za-z_]\w*)")
+# Characters a shell would interpret inside a quoted word.
+UNSAFE_CHARACTERS = set("'\"`$\\\n\r")
+SHELL_OPERATORS = set(";&|<>()")
+
+
+class ToolParam:
+    """An input parameter of a tool.
+
+    Parameters
+    ----------
+    element: Element
+        The ``<param>`` element.
+    """
+
+    def __init__(self, element: ET.Element):
+        self.name = element.get("name")
+        self.type = element.get("type")
+        self.label = element.get("label", self.name)
+        self.formats = [fmt.strip().lower() for fmt in element.get("format", "").split(",") if fmt.strip()]
+        self.optional = element.get("optional", "false") == "true"
+        self.min = element.get("min")
+        self.max = element.get("max")
+        self.default = self.convert(element.get("value")) if element.get("value") is not None else None
+
+    @property
+    def is_data(self) -> bool:
+        return self.type in DATA_TYPES
+
+    def convert(self, value):
+        """Convert a value given as text to the type of the parameter."""
+        if self.type == "integer":
+            return int(value)
+        if self.type == "float":
+            return float(value)
+        if self.type == "boolean":
+            return str(value).lower() in ("true", "yes", "1")
+        return value
+
+    def __repr__(self):
+        return f"ToolParam({self.name!r}, {self.type!r})"
+
+
+class ToolOutput:
+    """An output dataset of a tool."""
+
+    def __init__(self, element: ET.Element):
+        self.name = element.get("name")
+        self.format = element.get("format")
+        self.label = element.get("label", self.name)
+
+    def __repr__(self):
+        return f"ToolOutput({self.name!r}, {self.format!r})"
+
+
+class DataValue:
+    """A dataset given to a data parameter: its path and Galaxy extension."""
+
+    def __init__(self, path, ext: str | None = None):
+        self.path = str(path)
+        self.ext = (ext or Path(self.path).suffix.lstrip(".")).lower()
+        self.name = Path(self.path).name
+
+    def __str__(self):
+        return self.path
+
+    def __repr__(self):
+        return f"DataValue({self.path!r})"
+
+
+def _load_macros(root: ET.Element, tool_dir: Path) -> tuple:
+    """Return the tokens, the xml macros and the files they were read from."""
+    tokens, xml_macros, files = {}, {}, []
+    macros = root.find("macros")
+    if macros is None:
+        return tokens, xml_macros, files
+    sources = [macros]
+    for imported in macros.findall("import"):
+        macro_path = tool_dir / imported.text.strip()
+        files.append(macro_path)
+        try:
+            sources.append(ET.parse(macro_path).getroot())
+        except (OSError, ET.ParseError):
+            continue
+    for source in sources:
+        for token in source.findall("token"):
+            tokens[token.get("name")] = token.text or ""
+        for macro in source.findall("xml"):
+            xml_macros[macro.get("name")] = macro
+    return tokens, xml_macros, files
+
+
+def _expand(element: ET.Element, xml_macros: dict) -> None:
+    """Replace the ``<expand macro="..."/>`` children by the macro contents."""
+    for index, child in reversed(list(enumerate(element))):
+        if child.tag == "expand" and child.get("macro") in xml_macros:
+            element.remove(child)
+            for offset, macro_child in enumerate(xml_macros[child.get("macro")]):
+                element.insert(index + offset, copy.deepcopy(macro_child))
+    for child in element:
+        _expand(child, xml_macros)
+
+
+def _replace_tokens(text: str | None, tokens: dict) -> str | None:
+    if text is None:
+        return None
+    for name, value in tokens.items():
+        text = text.replace(name, value)
+    return text
+
+
+def _fold_lines(command: str) -> str:
+    """Join the lines continuing the previous one (options and quoted words)."""
+    lines = []
+    for line in (line.strip() for line in command.splitlines()):
+        if not line:
+            continue
+        if lines and (line[0] in "-'\"" or lines[-1].endswith("\\")):
+            lines[-1] = lines[-1].rstrip("\\").rstrip() + " " + line
+        else:
+            lines.append(line)
+    return "\n".join(lines)
+
+
+def _check_value(name: str, value) -> str:
+    text = str(value)
+    if UNSAFE_CHARACTERS & set(text):
+        raise ValueError(f"Unsafe characters in the value of {name}: {text!r}")
+    return text
+
+
+def _resolve(expression: str, values: dict):
+    """Return the text of a placeholder, or None if it is not a parameter."""
+    match = re.match(r"[A-Za-z_]\w*", expression)
+    if match is None or match.group() not in values:
+        return None
+    value = values[match.group()]
+    rest = expression[match.end():]
+    while rest:
+        accessor = ACCESSOR.match(rest)
+        if accessor is None:
+            break
+        if accessor.group("index") == "@":
+            # Each element is checked; the quotes joining them are expected.
+            return '" "'.join(_check_value(match.group(), item) for item in value) + rest[accessor.end():]
+        if accessor.group("index") is not None:
+            value = value[int(accessor.group("index"))]
+        elif hasattr(value, accessor.group("attribute")):
+            value = getattr(value, accessor.group("attribute"))
+        else:
+            break
+        rest = rest[accessor.end():]
+    return _check_value(match.group(), value) + rest
+
+
+class ToolSpec:
+    """A Galaxy tool wrapper.
+
+    Parameters
+    ----------
+    path: Path
+        Path of the tool XML file.
+    root: Element
+        Root ``<tool>`` element, macros expanded.
+    tokens: dict
+        Macro tokens, substituted in the command and the attributes.
+    """
+
+    def __init__(self, path: Path, root: ET.Element, tokens: dict):
+        self.path = path
+        self.directory = path.parent
+        self.id = root.get("id")
+        self.name = root.get("name", self.id)
+        self.version = _replace_tokens(root.get("version"), tokens)
+        self.description = (root.findtext("description") or "").strip()
+        self.command = _replace_tokens(root.findtext("command") or "", tokens).strip()
+        self.inputs = [ToolParam(param) for param in root.findall("./inputs//param")]
+        self.outputs = [ToolOutput(data) for data in root.findall("./outputs/data")]
+        self.requirements = [
+            (requirement.text.strip(), _replace_tokens(requirement.get("version"), tokens))
+            for requirement in root.findall("./requirements/requirement")
+            if requirement.text
+        ]
+
+    @property
+    def input_formats(self) -> set:
+        """Formats accepted by the data inputs."""
+        return {fmt for param in self.inputs if param.is_data for fmt in param.formats}
+
+    def default_values(self) -> dict:
+        """Return the default value of each non-data parameter."""
+        return {param.name: param.default for param in self.inputs if not param.is_data}
+
+    def render(self, values: dict, outputs: dict | None = None) -> str:
+        """Return the command with the placeholders replaced by values.
+
+        Parameters
+        ----------
+        values: dict
+            Parameter values by name; ``DataValue`` (or a list of them for
+            collections) for data parameters.
+        outputs: dict
+            Output paths by name, defaults to ``<name>.<format>``.
+
+        Returns
+        -------
+        str
+            Rendered command, continuation lines joined.
+        """
+        outputs = outputs or {output.name: f"{output.name}.{output.format}" for output in self.outputs}
+        context = {param.name: param.default for param in self.inputs}
+        context.update(values)
+        missing = [param.name for param in self.inputs if not param.optional and context[param.name] is None]
+        if missing:
+            raise ValueError(f"Missing values for {self.id}: {', '.join(missing)}")
+        context.update(outputs)
+        context["__tool_directory__"] = str(self.directory)
+
+        def substitute(match):
+            text = _resolve(match.group("braced") or match.group("bare"), context)
+            return match.group() if text is None else text
+
+        return _fold_lines(PLACEHOLDER.sub(substitute, self.command))
+
+    def argv(self, values: dict, outputs: dict | None = None) -> list:
+        """Return the rendered command as an argument list.
+
+        A single program invocation is run as is; a command using shell
+        syntax (loops, redirections, several statements) is given to bash.
+        """
+        rendered = self.render(values, outputs)
+        lexer = shlex.shlex(rendered, posix=True, punctuation_chars=True)
+        lexer.whitespace_split = True
+        tokens = list(lexer)
+        if "\n" in rendered or any(set(token) <= SHELL_OPERATORS for token in tokens):
+            return ["bash", "-c", rendered]
+        return tokens
+
+    def __repr__(self):
+        return f"ToolSpec({self.id!r})"
+
+
+def parse_tool(path: Path) -> tuple:
+    """Parse a tool wrapper.
+
+    Returns
+    -------
+    tuple
+        The ``ToolSpec`` (None if the file is not a tool) and the paths of
+        the files it depends on.
+    """
+    # Jobs do not run in the current directory: __tool_directory__ must be absolute.
+    path = Path(path).resolve()
+    root = ET.parse(path).getroot()
+    if root.tag != "tool":
+        return None, [path]
+    tokens, xml_macros, macro_files = _load_macros(root, path.parent)
+    _expand(root, xml_macros)
+    return ToolSpec(path, root, tokens), [path] + macro_files
+
+
+def _signature(paths: list) -> tuple:
+    signature = []
+    for path in paths:
+        try:
+            signature.append(path.stat().st_mtime_ns)
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+
+class ToolRegistry:
+    """Parsed tools of a directory, indexed by id and by input format.
+
+    Parameters
+    ----------
+    tools_dir: Path
+        Directory scanned recursively for tool XML files.
+    """
+
+    def __init__(self, tools_dir: Path = TOOLS_DIR):
+        self.tools_dir = Path(tools_dir)
+        self._parsed = {}
+        self._tools = {}
+        self._by_format = {}
+        self._refreshed = 0
+        self._lock = threading.Lock()
+        self.refresh(force=True)
+
+    def refresh(self, force: bool = False) -> None:
+        """Parse the new and modified wrappers, at most every REFRESH_INTERVAL."""
+        with self._lock:
+            if not force and time.monotonic() - self._refreshed < REFRESH_INTERVAL:
+                return
+            parsed = {}
+            for path in sorted(self.tools_dir.rglob("*.xml")):
+                previous = self._parsed.get(path)
+                if previous is not None and _signature(previous[1]) == previous[2]:
+                    parsed[path] = previous
+                    continue
+                try:
+                    spec, dependencies = parse_tool(path)
+                except (OSError, ET.ParseError) as error:
+                    print(f"Skipping tool {path}: {error}")
+                    continue
+                parsed[path] = (spec, dependencies, _signature(dependencies))
+            self._parsed = parsed
+            self._tools = {spec.id: spec for spec, _, _ in parsed.values() if spec is not None}
+            self._by_format = {}
+            for spec in self._tools.values():
+                for fmt in spec.input_formats:
+                    self._by_format.setdefault(fmt, []).append(spec)
+            self._refreshed = time.monotonic()
+
+    def tools(self) -> list:
+        self.refresh()
+        return list(self._tools.values())
+
+    def get(self, tool_id: str) -> ToolSpec | None:
+        self.refresh()
+        return self._tools.get(tool_id)
+
+    def tools_for_format(self, fmt: str) -> list:
+        """Return the tools with a data input accepting a format."""
+        self.refresh()
+        return list(self._by_format.get(fmt.lstrip(".").lower(), []))
+
+    def tools_for_formats(self, formats) -> list:
+        """Return the tools whose data inputs all accept one of the formats."""
+        self.refresh()
+        formats = {fmt.lstrip(".").lower() for fmt in formats}
+        return [
+            spec for spec in self._tools.values()
+            if all(set(param.formats) & formats for param in spec.inputs if param.is_data)
+            and spec.input_formats
+        ]
+
+
+_registry = None
+
+
+def get_registry() -> ToolRegistry:
+    """Return the registry of the tools shipped with the application."""
+    global _registry
+    if _registry is None:
+        _registry = ToolRegistry(Path(os.environ.get("MDVERSE_TOOLS_DIR", TOOLS_DIR)))
+    return _registry
@@ -1,38 +1,87 @@
 import argparse
-import xml.etree.ElementTree as ET
 import os
-import subprocess
+import time
+from pathlib import Path
+
+from analysis import scheduler
+from analysis.tools import registry
 
 def parse_xml_for_command(file_path):
-    tree = ET.parse(file_path)
-    root = tree.getroot()
+    tool, _ = registry.parse_tool(Path(file_path))
+
+    # Commande, paramètres d'entrée et leurs valeurs par défaut
+    inputs = {param.name: param.default for param in tool.inputs}
+
+    # Paramètres de sortie, les chemins sont définis au rendu de la commande
+    outputs = {output.name: None for output in tool.outputs}
 
-    # Extraction de la commande
-    command = root.find('.//command').text.strip()
+    return tool.command, inputs, outputs
 
-    # Extraction des paramètres d'entrée
-    inputs = {param.get('name'): param.get('value', None) for param in root.findall('.//inputs/param')}
+def get_output_paths(tool):
+    """Output paths relative to the working directory of the job."""
+    return {output.name: f"{output.name}.{output.format}" for output in tool.outputs}
 
-    # Extraction des paramètres de sortie
-    outputs = {data.get('name'): None for data in root.findall('.//outputs/data')}  # Les chemins de sortie seront définis plus tard
+def submit_tool(tool, values, job_scheduler=None, dispatch=True):
+    """Render the command of a tool with values, queue it and return the job id."""
+    job_scheduler = job_scheduler or scheduler.get_scheduler()
+    outputs = get_output_paths(tool)
+    return job_scheduler.submit(tool.argv(values, outputs), outputs=outputs,
+                                dispatch=dispatch)
 
-    return command, inputs, outputs
+def parse_values(tool, params):
+    """Parameter values from name=value strings; data parameters take paths."""
+    values = {}
+    types = {param.name: param for param in tool.inputs}
+    for item in params:
+        name, _, value = item.partition('=')
+        param = types.get(name)
+        if param is None:
+            raise ValueError(f"unknown parameter {name}")
+        if param.type == 'data_collection':
+            values.setdefault(name, []).append(registry.DataValue(os.path.abspath(value)))
+        elif param.type == 'data':
+            values[name] = registry.DataValue(os.path.abspath(value))
+        else:
+            values[name] = param.convert(value)
+    return values
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--xml', required=True,
                         help='Galaxy Tool XML Filepath.')
+    parser.add_argument('--param', action='append', default=[],
+                        help='Parameter value as name=value; data parameters '
+                        'take a path, repeated for the elements of a collection.')
+    parser.add_argument('--wait', action='store_true',
+                        help='Run the job and wait for it to finish, then print '
+                        'its output. Otherwise the job is only queued, for the '
+                        'dispatcher of the web application.')
     args = parser.parse_args()
 
-    os.environ['__tool_directory__'] = os.path.dirname(args.xml)
+    tool, _ = registry.parse_tool(Path(args.xml))
+    try:
+        values = parse_values(tool, args.param)
+    except ValueError as error:
+        parser.error(str(error))
 
-    command_template, inputs, outputs = parse_xml_for_command(args.xml)
+    print("Commande :", tool.argv(values, get_output_paths(tool)))
+    print("Inputs :", values)
+    print("Outputs :", get_output_paths(tool))
 
-    print("Commande :", command_template)
-    print("Inputs :", inputs)
-    print("Outputs :", outputs)
+    job_scheduler = scheduler.get_scheduler()
+    # The dispatcher thread dies with this process, so it is only started
+    # when the process waits for the jobs it launches.
+    job_id = submit_tool(tool, values, job_scheduler, dispatch=args.wait)
+    print("Job :", job_id)
 
-    subprocess.Popen(command_template, shell=True)
+    if args.wait:
+        while (result := job_scheduler.result(job_id)) is None:
+            time.sleep(scheduler.POLL_INTERVAL)
+        job_scheduler.drain()
+        print("Status :", result["status"], result["error"] or "")
+        print(result["stdout"], end="")
+        print(result["stderr"], end="")
+        print("Outputs :", result["outputs"])
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
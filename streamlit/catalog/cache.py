@@ -0,0 +1,198 @@
+"""Persistent on-disk cache of the MDverse catalog published on Zenodo.
+
+The parquet files are stored under ``<cache_dir>/zenodo-<record>/`` next to a
+small JSON sidecar holding the ``ETag`` and ``Last-Modified`` headers returned
+by Zenodo. Cached files are revalidated with a conditional request and every
+write goes through a temporary file followed by ``os.replace`` so that several
+Streamlit workers can safely share the same cache directory.
+
+Configuration is read from the environment:
+
+- ``MDVERSE_CACHE_DIR``: cache root (defaults to ``~/.cache/mdverse``).
+- ``MDVERSE_OFFLINE_DIR``: directory holding ``datasets.parquet`` and
+  ``files.parquet``; when set, the network is never used.
+- ``MDVERSE_CACHE_MAX_AGE``: seconds during which a cached file is trusted
+  without revalidation (defaults to one hour).
+"""
+
+import json
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import requests
+
+# ZENODO_RECORD needs to be the record of the last version of the data.
+# It cannot be the identifier provided by the master DOI.
+ZENODO_RECORD = "7856806"
+CATALOG_FILES = ("datasets.parquet", "files.parquet")
+
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "mdverse"
+DEFAULT_MAX_AGE = 3600
+CHUNK_SIZE = 1024 * 1024
+TIMEOUT = 30
+
+logger = logging.getLogger(__name__)
+
+
+def get_record_url(record: str = ZENODO_RECORD) -> str:
+    """Return the base URL of a Zenodo record."""
+    return f"https://zenodo.org/record/{record}"
+
+
+def get_cache_dir() -> Path:
+    """Return the cache root configured for this process."""
+    return Path(os.environ.get("MDVERSE_CACHE_DIR", DEFAULT_CACHE_DIR)).expanduser()
+
+
+def get_offline_dir() -> Path | None:
+    """Return the offline catalog directory, if offline mode is enabled."""
+    offline_dir = os.environ.get("MDVERSE_OFFLINE_DIR")
+    if not offline_dir:
+        return None
+    return Path(offline_dir).expanduser()
+
+
+def get_max_age() -> float:
+    """Return the number of seconds a cached file is trusted as is."""
+    return float(os.environ.get("MDVERSE_CACHE_MAX_AGE", DEFAULT_MAX_AGE))
+
+
+def _write_atomic(path: Path, write) -> None:
+    """Write a file through a temporary sibling and rename it in place.
+
+    Parameters
+    ----------
+    path: Path
+        Final location of the file.
+    write: callable
+        Called with the opened binary temporary file.
+    """
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            write(tmp_file)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.replace(tmp_name, path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+
+def _read_meta(meta_path: Path) -> dict:
+    try:
+        with open(meta_path) as meta_file:
+            return json.load(meta_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_meta(meta_path: Path, meta: dict) -> None:
+    _write_atomic(meta_path, lambda f: f.write(json.dumps(meta).encode()))
+
+
+def fetch_catalog_file(
+    file_name: str,
+    record: str = ZENODO_RECORD,
+    cache_dir: Path | None = None,
+    offline_dir: Path | None = None,
+    max_age: float | None = None,
+) -> Path:
+    """Return a local path to a catalog file, downloading it if needed.
+
+    Parameters
+    ----------
+    file_name: str
+        Name of the file in the Zenodo record (e.g. ``files.parquet``).
+    record: str
+        Zenodo record identifier, i.e. the version of the catalog.
+    cache_dir: Path
+        Cache root, defaults to ``get_cache_dir()``.
+    offline_dir: Path
+        Directory containing the catalog files. When given (or configured
+        through ``MDVERSE_OFFLINE_DIR``) no request is ever made.
+    max_age: float
+        Seconds during which the cached copy is used without revalidation.
+
+    Returns
+    -------
+    Path
+        Path of the local parquet file.
+    """
+    offline_dir = offline_dir or get_offline_dir()
+    if offline_dir is not None:
+        path = Path(offline_dir) / file_name
+        if not path.is_file():
+            raise FileNotFoundError(f"{file_name} not found in offline directory {offline_dir}")
+        return path
+
+    cache_dir = Path(cache_dir or get_cache_dir()) / f"zenodo-{record}"
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    max_age = get_max_age() if max_age is None else max_age
+
+    path = cache_dir / file_name
+    meta_path = cache_dir / f"{file_name}.meta.json"
+    meta = _read_meta(meta_path) if path.is_file() else {}
+
+    if meta and time.time() - meta.get("checked_at", 0) < max_age:
+        return path
+
+    headers = {}
+    if meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+    if meta.get("last_modified"):
+        headers["If-Modified-Since"] = meta["last_modified"]
+
+    url = f"{get_record_url(record)}/files/{file_name}"
+    try:
+        response = requests.get(url, headers=headers, stream=True, timeout=TIMEOUT)
+    except requests.RequestException as error:
+        if meta:
+            logger.warning("Revalidation failed for %s (%s), using cached copy", url, error)
+            return path
+        raise
+
+    with response:
+        if response.status_code == 304 and meta:
+            meta["checked_at"] = time.time()
+            _write_meta(meta_path, meta)
+            return path
+        if response.status_code != 200:
+            if meta:
+                logger.warning(
+                    "Revalidation failed for %s with status %s, using cached copy",
+                    url, response.status_code,
+                )
+                return path
+            response.raise_for_status()
+
+        def write(tmp_file):
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                tmp_file.write(chunk)
+
+        _write_atomic(path, write)
+
+    _write_meta(meta_path, {
+        "url": url,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "checked_at": time.time(),
+    })
+    return path
+
+
+def fetch_catalog(record: str = ZENODO_RECORD, **kwargs) -> dict:
+    """Return local paths of all catalog files keyed by their stem.
+
+    Returns
+    -------
+    dict
+        e.g. ``{"datasets": Path(...), "files": Path(...)}``.
+    """
+    return {
+        Path(file_name).stem: fetch_catalog_file(file_name, record=record, **kwargs)
+        for file_name in CATALOG_FILES
+    }
@@ -0,0 +1,137 @@
+"""Matching of the catalog datasets with the analyses they can feed.
+
+Each analysis declares the file extensions it needs and how many files of
+each it accepts. When the catalog is loaded, the files of every dataset are
+counted per declared extension in one vectorized pass, and the analyses each
+dataset is eligible for are evaluated for the whole catalog at once. Finding
+the analyses of a dataset is then a row lookup, and finding the datasets of
+an analysis a column lookup.
+"""
+
+import numpy as np
+import pandas as pd
+
+from catalog import index
+
+
+class Capability:
+    """An analysis and the input files it requires.
+
+    Parameters
+    ----------
+    name: str
+        Name of the analysis.
+    analysis_type: str
+        Type under which the analysis is listed.
+    requirements: dict
+        ``(min, max)`` number of files per extension (lower case, without
+        the dot); ``max`` is None when unbounded.
+    """
+
+    def __init__(self, name: str, analysis_type: str, requirements: dict):
+        self.name = name
+        self.analysis_type = analysis_type
+        self.requirements = requirements
+
+    def matches(self, counts: np.ndarray, extensions: list) -> np.ndarray:
+        """Evaluate the requirements on rows of counts.
+
+        Parameters
+        ----------
+        counts: np.ndarray
+            Number of files, of shape (datasets, extensions).
+        extensions: list
+            Extension of each column of counts.
+
+        Returns
+        -------
+        np.ndarray
+            Whether each row satisfies all the requirements.
+        """
+        eligible = np.ones(len(counts), dtype=bool)
+        for extension, (minimum, maximum) in self.requirements.items():
+            column = counts[:, extensions.index(extension)]
+            eligible &= column >= minimum
+            if maximum is not None:
+                eligible &= column <= maximum
+        return eligible
+
+    def __repr__(self):
+        return f"Capability({self.name!r})"
+
+
+def file_extensions(file_names: pd.Series) -> pd.Series:
+    """Return the lower-case extension of file names, without the dot.
+
+    Names without an extension give an empty string.
+    """
+    extensions = file_names.astype(str).str.extract(r"\.([^./]+)$", expand=False)
+    return extensions.fillna("").str.lower()
+
+
+class CapabilityIndex:
+    """Eligibility of every dataset of the catalog for every analysis.
+
+    Parameters
+    ----------
+    files: pd.DataFrame
+        The files table, with a ``file_name`` column.
+    catalog_index: index.CatalogIndex
+        Index giving the dataset code of each file.
+    capabilities: list
+        The Capability of each analysis.
+    """
+
+    def __init__(self, files: pd.DataFrame, catalog_index: index.CatalogIndex, capabilities: list):
+        self.capabilities = list(capabilities)
+        self.extensions = sorted({
+            extension for capability in self.capabilities for extension in capability.requirements
+        })
+        n_codes, n_extensions = len(catalog_index), len(self.extensions)
+
+        # Only the distinct names are parsed, the files table being large.
+        name_codes, names = pd.factorize(files["file_name"])
+        extension_codes = pd.Categorical(
+            file_extensions(pd.Series(names)), categories=self.extensions
+        ).codes
+        file_extension_codes = np.where(
+            name_codes >= 0, extension_codes[np.maximum(name_codes, 0)], -1
+        ) if len(names) else np.full(len(files), -1)
+
+        file_codes = catalog_index.file_codes
+        valid = (file_codes >= 0) & (file_extension_codes >= 0)
+        self.counts = np.bincount(
+            file_codes[valid] * n_extensions + file_extension_codes[valid],
+            minlength=n_codes * n_extensions,
+        ).reshape(n_codes, n_extensions).astype(np.int32)
+        self.eligible = np.column_stack([
+            capability.matches(self.counts, self.extensions) for capability in self.capabilities
+        ]) if self.capabilities else np.zeros((n_codes, 0), dtype=bool)
+
+    def analyses_for(self, codes: np.ndarray) -> list:
+        """Return the capabilities the datasets of the given codes satisfy.
+
+        Several codes are evaluated on their summed counts, as if their
+        files belonged to one dataset.
+        """
+        if len(codes) == 1:
+            eligible = self.eligible[codes[0]]
+        else:
+            counts = self.counts[codes].sum(axis=0, keepdims=True)
+            eligible = [
+                capability.matches(counts, self.extensions)[0] for capability in self.capabilities
+            ]
+        return [capability for capability, ok in zip(self.capabilities, eligible) if ok]
+
+    def eligible_datasets(self, name: str) -> np.ndarray:
+        """Return the codes of all the datasets eligible for an analysis."""
+        names = [capability.name for capability in self.capabilities]
+        return np.flatnonzero(self.eligible[:, names.index(name)])
+
+    def summary(self) -> pd.Series:
+        """Return the number of eligible datasets per analysis."""
+        return pd.Series(
+            self.eligible.sum(axis=0),
+            index=[capability.name for capability in self.capabilities],
+            name="datasets",
+        )
@@ -0,0 +1,154 @@
+"""Compact in-memory representation of the catalog tables.
+
+The tables are compacted while they are read from the parquet files, so the
+uncompacted pandas copy is never built. Repeated values (origins, file
+types, dataset IDs of the files table) are read dictionary-encoded and
+become categoricals, free text becomes Arrow-backed strings, counts and
+sizes become nullable ``Int64``, and file URLs are split into a
+dictionary-encoded prefix and a file name. ``expand_files`` restores the
+original ``file_url`` column on the (small) slices displayed by the
+application. Missing values stay missing (``<NA>``): an unknown file size is
+not a size of 0.
+
+A report comparing the memory usage before and after compaction is printed
+with::
+
+    python -m catalog.compact
+"""
+
+import argparse
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+STRING_DTYPE = pd.StringDtype("pyarrow")
+
+DATASET_CATEGORIES = ["dataset_origin"]
+FILE_CATEGORIES = ["dataset_origin", "dataset_id", "file_type"]
+URL_PREFIX = "file_url_prefix"
+URL_NAME = "file_url_name"
+URL_PATTERN = r"^(?P<prefix>.*/)?(?P<name>[^/]*)$"
+
+
+def _pandas_type(arrow_type: pa.DataType):
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return STRING_DTYPE
+    if pa.types.is_int64(arrow_type):
+        return pd.Int64Dtype()
+    return None
+
+
+def _compact(table: pa.Table, categories: list, integers: list) -> pa.Table:
+    for position, name in enumerate(table.column_names):
+        column = table.column(name)
+        if name in categories and not pa.types.is_dictionary(column.type):
+            column = pc.dictionary_encode(column)
+        elif name in integers:
+            column = pc.cast(column, pa.int64(), safe=False)
+        else:
+            continue
+        table = table.set_column(position, name, column)
+    return table
+
+
+def _to_pandas(table: pa.Table) -> pd.DataFrame:
+    return table.to_pandas(types_mapper=_pandas_type)
+
+
+def compact_datasets(datasets: pa.Table) -> pd.DataFrame:
+    """Convert the datasets table read by the catalog loader to a compact frame."""
+    return _to_pandas(_compact(datasets, DATASET_CATEGORIES, ["file_number"]))
+
+
+def compact_files(files: pa.Table) -> pd.DataFrame:
+    """Convert the files table read by the catalog loader to a compact frame.
+
+    The ``file_url`` column is replaced by ``file_url_prefix`` (categorical)
+    and ``file_url_name``; use ``expand_files`` to restore it.
+    """
+    compacted = _compact(files, FILE_CATEGORIES, ["file_size"])
+    if "file_url" in compacted.column_names:
+        urls = compacted.column("file_url")
+        parts = pc.extract_regex(urls, URL_PATTERN)
+        # The fields of the parts of a missing URL are empty strings.
+        missing = pa.scalar(None, pa.string())
+        prefixes = pc.if_else(urls.is_valid(), pc.struct_field(parts, "prefix"), missing)
+        names = pc.if_else(urls.is_valid(), pc.struct_field(parts, "name"), missing)
+        compacted = compacted.drop_columns(["file_url"])
+        compacted = compacted.append_column(URL_PREFIX, pc.dictionary_encode(prefixes))
+        compacted = compacted.append_column(URL_NAME, names)
+    return _to_pandas(compacted)
+
+
+def read_datasets(catalog_loader) -> pd.DataFrame:
+    """Read the compact datasets table of a ``catalog.loader.CatalogLoader``."""
+    table = catalog_loader.datasets_table(dictionary_columns=DATASET_CATEGORIES)
+    return compact_datasets(table)
+
+
+def read_files(catalog_loader) -> pd.DataFrame:
+    """Read the compact files table of a ``catalog.loader.CatalogLoader``."""
+    return compact_files(catalog_loader.files_table(dictionary_columns=FILE_CATEGORIES))
+
+
+def expand_files(files: pd.DataFrame) -> pd.DataFrame:
+    """Restore the ``file_url`` column of a (slice of a) compact files table.
+
+    Tables that were not compacted are returned unchanged.
+    """
+    if URL_PREFIX not in files:
+        return files
+    expanded = files.drop(columns=[URL_PREFIX, URL_NAME])
+    expanded["file_url"] = files[URL_PREFIX].astype(STRING_DTYPE) + files[URL_NAME]
+    return expanded
+
+
+def memory_report(tables: dict, compact_tables: dict) -> pd.DataFrame:
+    """Compare the memory usage of the catalog tables before and after compaction.
+
+    Parameters
+    ----------
+    tables: dict
+        Original tables keyed by name.
+    compact_tables: dict
+        Compact tables keyed by the same names.
+
+    Returns
+    -------
+    pd.DataFrame
+        Memory usage in MB per table, and the reduction factor.
+    """
+    rows = []
+    for name, table in tables.items():
+        before = table.memory_usage(deep=True).sum() / 1024**2
+        after = compact_tables[name].memory_usage(deep=True).sum() / 1024**2
+        rows.append({"table": name, "before (MB)": before, "after (MB)": after})
+    report = pd.DataFrame(rows).set_index("table")
+    report.loc["total"] = report.sum()
+    report["ratio"] = report["before (MB)"] / report["after (MB)"]
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the memory saved by the compact catalog.")
+    parser.add_argument("--datasets", help="Path to datasets.parquet (defaults to the cached catalog).")
+    parser.add_argument("--files", help="Path to files.parquet (defaults to the cached catalog).")
+    args = parser.parse_args()
+
+    from catalog import cache, loader
+    paths = cache.fetch_catalog() if not (args.datasets and args.files) else {}
+    catalog_loader = loader.CatalogLoader({
+        "datasets": args.datasets or paths["datasets"],
+        "files": args.files or paths["files"],
+    })
+    tables = {"datasets": catalog_loader.datasets(), "files": catalog_loader.files()}
+    compact_tables = {
+        "datasets": read_datasets(catalog_loader),
+        "files": read_files(catalog_loader),
+    }
+    print(memory_report(tables, compact_tables).round(2).to_string())
+
+
+if __name__ == "__main__":
+    main()
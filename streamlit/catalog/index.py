@@ -0,0 +1,135 @@
+"""Dataset ID index over the catalog tables.
+
+The index is built once when the catalog is loaded. Dataset IDs are
+lower-cased and mapped to integer codes shared by the datasets and files
+tables, so that:
+
+- an exact ID lookup is a single dictionary access,
+- a substring lookup intersects trigram posting lists and only checks the
+  few remaining candidate IDs,
+- the rows of a dataset are read from precomputed ranges instead of scanning
+  the whole table.
+"""
+
+import numpy as np
+import pandas as pd
+
+NGRAM = 3
+
+
+def get_ngrams(text: str, n: int = NGRAM) -> set:
+    """Return the set of character n-grams of a string."""
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def _remap(codes: np.ndarray, mapping: np.ndarray) -> np.ndarray:
+    """Translate factorized codes, keeping -1 for missing values."""
+    return np.where(codes >= 0, mapping[np.maximum(codes, 0)], -1) if len(mapping) else codes
+
+
+def _group_rows(codes: np.ndarray, n_codes: int) -> tuple:
+    """Group row positions by code.
+
+    Returns
+    -------
+    tuple
+        ``(order, offsets)`` where the rows of code ``c`` are
+        ``order[offsets[c]:offsets[c + 1]]``, in table order.
+    """
+    valid = codes >= 0
+    order = np.flatnonzero(valid)[np.argsort(codes[valid], kind="stable")]
+    counts = np.bincount(codes[valid], minlength=n_codes)
+    offsets = np.zeros(n_codes + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return order, offsets
+
+
+class CatalogIndex:
+    """Lookup of datasets and files rows by dataset ID.
+
+    Parameters
+    ----------
+    datasets: pd.DataFrame
+        The datasets table, with a ``dataset_id`` column.
+    files: pd.DataFrame
+        The files table, with a ``dataset_id`` column.
+    """
+
+    def __init__(self, datasets: pd.DataFrame, files: pd.DataFrame):
+        # Lower-case the distinct IDs only, the files table repeating each
+        # dataset ID many times (and possibly being categorical).
+        dataset_codes, dataset_keys = pd.factorize(datasets["dataset_id"])
+        file_codes, file_keys = pd.factorize(files["dataset_id"])
+        lowered = pd.Index(dataset_keys).append(pd.Index(file_keys)).astype(str).str.lower()
+        key_codes, keys = pd.factorize(lowered)
+        dataset_codes = _remap(dataset_codes, key_codes[:len(dataset_keys)])
+        file_codes = _remap(file_codes, key_codes[len(dataset_keys):])
+
+        # Dataset code of each row of the files table, -1 if it has no ID.
+        self.file_codes = file_codes
+        self._keys = np.asarray(keys, dtype=object)
+        self._codes = {key: code for code, key in enumerate(self._keys)}
+        self._dataset_order, self._dataset_offsets = _group_rows(dataset_codes, len(keys))
+        self._file_order, self._file_offsets = _group_rows(file_codes, len(keys))
+
+        postings = {}
+        for code, key in enumerate(self._keys):
+            for ngram in get_ngrams(key):
+                postings.setdefault(ngram, []).append(code)
+        self._postings = {
+            ngram: np.array(posting, dtype=np.int64) for ngram, posting in postings.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def exact(self, dataset_id: str) -> int | None:
+        """Return the code of a dataset ID, or None if it is unknown."""
+        return self._codes.get(str(dataset_id).lower())
+
+    def contains(self, query: str) -> np.ndarray:
+        """Return the sorted codes of the dataset IDs containing ``query``."""
+        query = str(query).lower()
+        if len(query) < NGRAM:
+            candidates = range(len(self._keys))
+        else:
+            postings = sorted(
+                (self._postings.get(ngram) for ngram in get_ngrams(query)),
+                key=lambda posting: -1 if posting is None else len(posting),
+            )
+            if postings[0] is None:
+                return np.empty(0, dtype=np.int64)
+            candidates = postings[0]
+            for posting in postings[1:]:
+                candidates = np.intersect1d(candidates, posting, assume_unique=True)
+                if not len(candidates):
+                    return candidates
+        return np.array(
+            [code for code in candidates if query in self._keys[code]], dtype=np.int64
+        )
+
+    def search(self, query: str) -> np.ndarray:
+        """Resolve a query to dataset ID codes.
+
+        An exact (case-insensitive) match wins; otherwise all the dataset IDs
+        containing the query are returned.
+        """
+        code = self.exact(query)
+        if code is not None:
+            return np.array([code], dtype=np.int64)
+        return self.contains(query)
+
+    @staticmethod
+    def _rows(order: np.ndarray, offsets: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        if len(codes) == 1:
+            return order[offsets[codes[0]]:offsets[codes[0] + 1]]
+        rows = [order[offsets[code]:offsets[code + 1]] for code in codes]
+        return np.sort(np.concatenate(rows)) if rows else np.empty(0, dtype=np.int64)
+
+    def dataset_rows(self, codes: np.ndarray) -> np.ndarray:
+        """Return the positions of the datasets rows of the given codes, in table order."""
+        return self._rows(self._dataset_order, self._dataset_offsets, codes)
+
+    def file_rows(self, codes: np.ndarray) -> np.ndarray:
+        """Return the positions of the files rows of the given codes, in table order."""
+        return self._rows(self._file_order, self._file_offsets, codes)
@@ -0,0 +1,122 @@
+"""Lazy access to the MDverse catalog parquet files.
+
+Only the columns used by the application are read, and filters on
+``dataset_id`` are pushed down to the parquet reader so that row groups whose
+statistics cannot match are skipped entirely.
+"""
+
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+DATASET_COLUMNS = [
+    "dataset_url",
+    "dataset_origin",
+    "dataset_id",
+    "title",
+    "date_creation",
+    "author",
+    "description",
+    "file_number",
+]
+
+FILE_COLUMNS = [
+    "dataset_id",
+    "file_type",
+    "file_size",
+    "file_name",
+    "file_url",
+]
+
+
+class CatalogLoader:
+    """Projected and filtered reads over the catalog parquet files.
+
+    Parameters
+    ----------
+    paths: dict
+        Local paths of the catalog files keyed by ``"datasets"`` and
+        ``"files"``, as returned by ``catalog.cache.fetch_catalog``.
+    """
+
+    def __init__(self, paths: dict):
+        self._paths = {name: Path(paths[name]) for name in ("datasets", "files")}
+        self._datasets = ds.dataset(self._paths["datasets"], format="parquet")
+        self._files = ds.dataset(self._paths["files"], format="parquet")
+
+    def _dictionary_dataset(self, name: str, dictionary_columns: list) -> ds.Dataset:
+        # The parquet reader builds the dictionaries of these columns itself
+        # (from the dictionary pages when they are encoded that way).
+        read_options = ds.ParquetReadOptions(dictionary_columns=dictionary_columns)
+        file_format = ds.ParquetFileFormat(read_options=read_options)
+        return ds.dataset(self._paths[name], format=file_format)
+
+    @staticmethod
+    def _read(dataset: ds.Dataset, columns: list, dataset_ids=None) -> pa.Table:
+        expression = None
+        if dataset_ids is not None:
+            if isinstance(dataset_ids, str):
+                expression = ds.field("dataset_id") == dataset_ids
+            else:
+                expression = ds.field("dataset_id").isin(list(dataset_ids))
+        return dataset.to_table(columns=columns, filter=expression)
+
+    def datasets(self, columns: list = DATASET_COLUMNS, dataset_ids=None) -> pd.DataFrame:
+        """Read the datasets table.
+
+        Parameters
+        ----------
+        columns: list
+            Columns to read, defaults to the ones displayed by the application.
+        dataset_ids: str or iterable of str
+            Only read the rows of these datasets (exact match).
+
+        Returns
+        -------
+        pd.DataFrame
+            The projected and filtered datasets.
+        """
+        return self._read(self._datasets, columns, dataset_ids).to_pandas()
+
+    def datasets_table(
+        self, columns: list = DATASET_COLUMNS, dataset_ids=None, dictionary_columns: list = ()
+    ) -> pa.Table:
+        """Read the datasets table as an Arrow table (see ``datasets``).
+
+        The ``dictionary_columns`` are read dictionary-encoded.
+        """
+        dataset = self._dictionary_dataset("datasets", list(dictionary_columns))
+        return self._read(dataset, columns, dataset_ids)
+
+    def files(self, columns: list = FILE_COLUMNS, dataset_ids=None) -> pd.DataFrame:
+        """Read the files table.
+
+        Parameters
+        ----------
+        columns: list
+            Columns to read, defaults to the ones displayed by the application.
+        dataset_ids: str or iterable of str
+            Only read the rows of these datasets (exact match).
+
+        Returns
+        -------
+        pd.DataFrame
+            The projected and filtered files.
+        """
+        return self._read(self._files, columns, dataset_ids).to_pandas()
+
+    def files_table(
+        self, columns: list = FILE_COLUMNS, dataset_ids=None, dictionary_columns: list = ()
+    ) -> pa.Table:
+        """Read the files table as an Arrow table (see ``files``).
+
+        The ``dictionary_columns`` are read dictionary-encoded.
+        """
+        dataset = self._dictionary_dataset("files", list(dictionary_columns))
+        return self._read(dataset, columns, dataset_ids)
+
+    def files_for_dataset(self, dataset_id: str, columns: list = FILE_COLUMNS) -> pd.DataFrame:
+        """Read the files of a single dataset without loading the whole table."""
+        return self.files(columns=columns, dataset_ids=dataset_id)
@@ -0,0 +1,267 @@
+"""Ranked search-as-you-type over the datasets of the catalog.
+
+An inverted index maps every word of the ``dataset_id``, ``title``, ``author``
+and ``description`` columns to the datasets containing it, weighted by the
+field it was found in. A query matches the datasets containing all of its
+words, the last one being allowed to be a prefix. Words that match nothing
+are corrected with a one-edit fuzzy lookup over the ID, title and author
+vocabulary.
+
+The index is built once per catalog version and is read-only afterwards, so
+it can be shared by all Streamlit sessions.
+
+A benchmark replaying a keystroke trace is available with::
+
+    python -m catalog.search --trace keystrokes.txt
+"""
+
+import argparse
+import bisect
+import random
+import re
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+FIELD_WEIGHTS = {
+    "dataset_id": 4.0,
+    "title": 3.0,
+    "author": 2.0,
+    "description": 1.0,
+}
+FUZZY_FIELDS = ("dataset_id", "title", "author")
+# Weight of a whole dataset ID, so that typing an ID ranks it first.
+ID_WEIGHT = 8.0
+PREFIX_FACTOR = 0.8
+FUZZY_FACTOR = 0.5
+# Maximum number of vocabulary terms a prefix or fuzzy word expands to.
+MAX_EXPANSIONS = 64
+FUZZY_MIN_LENGTH = 4
+FUZZY_MAX_LENGTH = 20
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list:
+    """Split a text into lower-cased words."""
+    return TOKEN_PATTERN.findall(str(text).lower())
+
+
+def get_deletions(term: str) -> set:
+    """Return the strings obtained by deleting one character of a term."""
+    return {term[:i] + term[i + 1:] for i in range(len(term))}
+
+
+class SearchIndex:
+    """Inverted index over the datasets table.
+
+    Parameters
+    ----------
+    datasets: pd.DataFrame
+        The datasets table. Missing searchable columns are ignored.
+    """
+
+    def __init__(self, datasets: pd.DataFrame):
+        self._n_datasets = len(datasets)
+        term_weights = {}
+        fuzzy_terms = set()
+
+        def add(term, row, weight):
+            rows = term_weights.setdefault(term, {})
+            if rows.get(row, 0.0) < weight:
+                rows[row] = weight
+
+        for field, weight in FIELD_WEIGHTS.items():
+            if field not in datasets:
+                continue
+            values = datasets[field].fillna("").astype(str).to_numpy()
+            for row, value in enumerate(values):
+                for term in set(tokenize(value)):
+                    add(term, row, weight)
+                    if field in FUZZY_FIELDS:
+                        fuzzy_terms.add(term)
+        if "dataset_id" in datasets:
+            ids = datasets["dataset_id"].fillna("").astype(str).str.lower()
+            for row, dataset_id in enumerate(ids):
+                add(dataset_id, row, ID_WEIGHT)
+
+        self._terms = sorted(term_weights)
+        self._term_ids = {term: i for i, term in enumerate(self._terms)}
+        offsets = np.zeros(len(self._terms) + 1, dtype=np.int64)
+        rows, weights = [], []
+        for i, term in enumerate(self._terms):
+            postings = term_weights[term]
+            offsets[i + 1] = offsets[i] + len(postings)
+            rows.extend(postings.keys())
+            weights.extend(postings.values())
+        self._offsets = offsets
+        self._rows = np.array(rows, dtype=np.int32)
+        self._weights = np.array(weights, dtype=np.float32)
+        self._frequencies = np.diff(offsets)
+
+        self._deletions = {}
+        for term in fuzzy_terms:
+            if FUZZY_MIN_LENGTH <= len(term) <= FUZZY_MAX_LENGTH:
+                for deletion in get_deletions(term):
+                    self._deletions.setdefault(deletion, []).append(self._term_ids[term])
+
+    def __len__(self) -> int:
+        return self._n_datasets
+
+    def _most_frequent(self, term_ids) -> list:
+        term_ids = np.fromiter(term_ids, dtype=np.int64)
+        if len(term_ids) > MAX_EXPANSIONS:
+            top = np.argpartition(-self._frequencies[term_ids], MAX_EXPANSIONS)[:MAX_EXPANSIONS]
+            term_ids = term_ids[top]
+        return term_ids.tolist()
+
+    def _expand(self, word: str, prefix: bool) -> list:
+        """Return ``(term_id, factor)`` pairs matching a query word."""
+        expansions = []
+        term_id = self._term_ids.get(word)
+        if term_id is not None:
+            expansions.append((term_id, 1.0))
+        if prefix:
+            start = bisect.bisect_right(self._terms, word)
+            stop = bisect.bisect_left(self._terms, word + "\U0010ffff", lo=start)
+            expansions.extend(
+                (i, PREFIX_FACTOR) for i in self._most_frequent(range(start, stop))
+            )
+        if expansions or len(word) < FUZZY_MIN_LENGTH:
+            return expansions
+
+        candidates = set(self._deletions.get(word, ()))
+        for deletion in get_deletions(word):
+            candidates.update(self._deletions.get(deletion, ()))
+            if deletion in self._term_ids:
+                candidates.add(self._term_ids[deletion])
+        return [(i, FUZZY_FACTOR) for i in self._most_frequent(candidates)]
+
+    def search(self, query: str, k: int = 10) -> list:
+        """Return the best matching datasets for a query.
+
+        Parameters
+        ----------
+        query: str
+            Text typed by the user. The last word is matched as a prefix
+            unless the query ends with a space.
+        k: int
+            Maximum number of results.
+
+        Returns
+        -------
+        list
+            ``(row, score)`` tuples sorted by decreasing score, ``row`` being
+            a position in the datasets table.
+        """
+        words = tokenize(query)
+        if not words:
+            return []
+        last_is_prefix = not query[-1].isspace()
+        whole_id = self._term_ids.get(str(query).strip().lower())
+
+        scores = np.zeros(self._n_datasets, dtype=np.float32)
+        matched = np.ones(self._n_datasets, dtype=bool)
+        for position, word in enumerate(words):
+            prefix = last_is_prefix and position == len(words) - 1
+            word_scores = np.zeros(self._n_datasets, dtype=np.float32)
+            for term_id, factor in self._expand(word, prefix):
+                start, stop = self._offsets[term_id], self._offsets[term_id + 1]
+                rows = self._rows[start:stop]
+                word_scores[rows] = np.maximum(word_scores[rows], self._weights[start:stop] * factor)
+            matched &= word_scores > 0
+            scores += word_scores
+        if whole_id is not None:
+            start, stop = self._offsets[whole_id], self._offsets[whole_id + 1]
+            rows = self._rows[start:stop]
+            matched[rows] = True
+            scores[rows] += ID_WEIGHT
+
+        candidates = np.flatnonzero(matched)
+        if len(candidates) > k:
+            top = np.argpartition(-scores[candidates], k)[:k]
+            candidates = candidates[top]
+        # Stable sort keeps the catalog order between equal scores.
+        candidates = np.sort(candidates)
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(int(row), float(scores[row])) for row in candidates]
+
+
+def record_trace(queries: list) -> list:
+    """Turn full queries into the successive states of a search box.
+
+    Parameters
+    ----------
+    queries: list
+        Queries typed by users.
+
+    Returns
+    -------
+    list
+        One entry per keystroke.
+    """
+    return [query[:i] for query in queries for i in range(1, len(query) + 1)]
+
+
+def replay_trace(search_index: SearchIndex, trace: list, k: int = 10) -> dict:
+    """Replay a keystroke trace and measure the search latency.
+
+    Returns
+    -------
+    dict
+        Number of queries and latency percentiles in milliseconds.
+    """
+    latencies = np.empty(len(trace))
+    for i, query in enumerate(trace):
+        start = time.perf_counter()
+        search_index.search(query, k=k)
+        latencies[i] = (time.perf_counter() - start) * 1000
+    return {
+        "queries": len(trace),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "max_ms": float(latencies.max()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the dataset search index.")
+    parser.add_argument("--datasets",
+                        help="Path to datasets.parquet (defaults to the cached catalog).")
+    parser.add_argument("--trace",
+                        help="Keystroke trace: one search box state per line.")
+    parser.add_argument("--synthetic", type=int, default=200,
+                        help="Number of catalog queries typed when no trace is given.")
+    parser.add_argument("-k", type=int, default=10, help="Number of results per query.")
+    args = parser.parse_args()
+
+    if args.datasets:
+        datasets = pd.read_parquet(args.datasets)
+    else:
+        from catalog import cache
+        datasets = pd.read_parquet(cache.fetch_catalog_file("datasets.parquet"))
+
+    start = time.perf_counter()
+    search_index = SearchIndex(datasets)
+    print(f"Index built for {len(search_index)} datasets in {time.perf_counter() - start:.2f} s")
+
+    if args.trace:
+        trace = Path(args.trace).read_text().splitlines()
+    else:
+        rng = random.Random(0)
+        rows = rng.sample(range(len(datasets)), min(args.synthetic, len(datasets)))
+        queries = [
+            " ".join(tokenize(datasets.iloc[row][field])[:3])
+            for row, field in zip(rows, rng.choices(list(FIELD_WEIGHTS), k=len(rows)))
+        ]
+        trace = record_trace([query for query in queries if query])
+
+    for key, value in replay_trace(search_index, trace, k=args.k).items():
+        print(f"{key}: {value:.3f}" if isinstance(value, float) else f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
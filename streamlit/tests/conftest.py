@@ -0,0 +1,38 @@
+import os
+import sys
+import warnings
+
+import MDAnalysis as mda
+import numpy as np
+import pytest
+
+# The app runs from streamlit/, where analysis and catalog are top-level packages
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+@pytest.fixture
+def trajectory(tmp_path):
+    """Structure and trajectory files of a small random system, 12 frames of 20 atoms."""
+    rng = np.random.default_rng(0)
+    n_atoms, n_frames = 20, 12
+    universe = mda.Universe.empty(n_atoms, trajectory=True, atom_resindex=np.zeros(n_atoms, dtype=int))
+    universe.add_TopologyAttr("name", ["CA" if i % 2 else "CB" for i in range(n_atoms)])
+    universe.add_TopologyAttr("type", ["C"] * n_atoms)
+    universe.add_TopologyAttr("element", ["C"] * n_atoms)
+    universe.add_TopologyAttr("resname", ["ALA"])
+    universe.add_TopologyAttr("resid", [1])
+    positions = rng.normal(scale=5, size=(n_atoms, 3)).astype(np.float32)
+    universe.atoms.positions = positions
+    structure = tmp_path / "system.pdb"
+    with warnings.catch_warnings():
+        # The PDB writer warns about every attribute the system lacks.
+        warnings.simplefilter("ignore")
+        universe.atoms.write(str(structure))
+
+    frames = tmp_path / "system.trr"
+    with mda.Writer(str(frames), n_atoms) as writer:
+        for frame in range(n_frames):
+            universe.trajectory.ts.time = 2.0 * frame
+            universe.atoms.positions = positions + rng.normal(scale=0.5, size=positions.shape)
+            writer.write(universe.atoms)
+    return structure, frames
@@ -0,0 +1,93 @@
+"""CatalogIndex and SearchIndex over small datasets and files tables."""
+
+import pandas as pd
+
+from catalog.index import CatalogIndex
+from catalog.search import SearchIndex
+
+
+def make_tables():
+    datasets = pd.DataFrame({
+        "dataset_id": ["ZEN-100", "zen-200", "GMX-100", None],
+        "title": ["Lysozyme in water", "Membrane protein", "Lysozyme folding", "Untitled"],
+        "author": ["Doe", "Smith", "Smithson", "Nobody"],
+        "description": ["", "POPC bilayer", "Folding of lysozyme", ""],
+    })
+    files = pd.DataFrame({
+        "dataset_id": pd.Categorical(["zen-200", "ZEN-100", "zen-200", "GMX-100", None, "ZEN-100"]),
+        "file_name": ["b.xtc", "a.pdb", "b.pdb", "c.gro", "orphan.txt", "a.xtc"],
+    })
+    return datasets, files
+
+
+def test_catalog_index_exact_lookup_ignores_case():
+    datasets, files = make_tables()
+    index = CatalogIndex(datasets, files)
+
+    codes = index.search("zen-100")
+
+    assert len(codes) == 1
+    assert index.dataset_rows(codes).tolist() == [0]
+    assert files.loc[index.file_rows(codes), "file_name"].tolist() == ["a.pdb", "a.xtc"]
+
+
+def test_catalog_index_substring_lookup():
+    datasets, files = make_tables()
+    index = CatalogIndex(datasets, files)
+
+    codes = index.search("100")
+
+    assert index.dataset_rows(codes).tolist() == [0, 2]
+    assert index.file_rows(codes).tolist() == [1, 3, 5]
+    assert len(index.search("zen-")) == 2
+    assert len(index.search("nothing")) == 0
+    assert index.exact("missing") is None
+
+
+def test_catalog_index_file_codes():
+    datasets, files = make_tables()
+    index = CatalogIndex(datasets, files)
+
+    codes = index.file_codes
+
+    assert codes[4] == -1
+    assert codes[0] == codes[2] == index.exact("ZEN-200")
+    assert codes[1] == codes[5] == index.exact("zen-100")
+
+
+def test_search_index_ranks_fields():
+    datasets, _ = make_tables()
+    index = SearchIndex(datasets)
+
+    rows = [row for row, _ in index.search("lysozyme")]
+
+    # The title outweighs the description.
+    assert rows == [0, 2]
+    assert len(index) == len(datasets)
+
+
+def test_search_index_prefix_and_whole_words():
+    datasets, _ = make_tables()
+    index = SearchIndex(datasets)
+
+    assert {row for row, _ in index.search("smith")} == {1, 2}
+    assert [row for row, _ in index.search("smith ")] == [1]
+    assert [row for row, _ in index.search("lysozyme fold")] == [2]
+    assert index.search("") == []
+
+
+def test_search_index_whole_id_ranks_first():
+    datasets, _ = make_tables()
+    index = SearchIndex(datasets)
+
+    results = index.search("GMX-100")
+
+    assert results[0][0] == 2
+
+
+def test_search_index_corrects_one_edit():
+    datasets, _ = make_tables()
+    index = SearchIndex(datasets)
+
+    assert [row for row, _ in index.search("membrame ")] == [1]
+    assert len(index.search("lysozyme", k=1)) == 1
@@ -0,0 +1,47 @@
+"""Compaction of the catalog tables keeps missing values missing."""
+
+import pandas as pd
+import pyarrow as pa
+
+from analysis import results
+from catalog import compact
+
+
+def make_files():
+    return pa.table({
+        "dataset_origin": ["zenodo", "zenodo", "figshare"],
+        "dataset_id": ["1", "1", "2"],
+        "file_type": ["xtc", "pdb", "gro"],
+        "file_name": ["a.xtc", "a.pdb", "b.gro"],
+        "file_size": pa.array([1024, None, 0], pa.int64()),
+        "file_url": ["https://zenodo.org/record/1/files/a.xtc", None, "https://figshare.com/b.gro"],
+    })
+
+
+def test_compact_files_keeps_unknown_sizes():
+    files = compact.compact_files(make_files())
+
+    assert files["file_size"].dtype == pd.Int64Dtype()
+    assert files["file_size"].iloc[0] == 1024
+    assert files["file_size"].iloc[1] is pd.NA
+    assert files["file_size"].iloc[2] == 0
+    assert isinstance(files["dataset_id"].dtype, pd.CategoricalDtype)
+
+
+def test_expand_files_restores_urls():
+    files = compact.expand_files(compact.compact_files(make_files()))
+
+    assert files["file_url"].iloc[0] == "https://zenodo.org/record/1/files/a.xtc"
+    assert files["file_url"].iloc[1] is pd.NA
+    assert files["file_url"].iloc[2] == "https://figshare.com/b.gro"
+
+
+def test_result_key_accepts_unknown_sizes():
+    files = compact.expand_files(compact.compact_files(make_files()))
+    files = files.rename(columns={"file_url": "URL", "file_size": "File size"}).iloc[[0, 2]]
+    unknown = files.assign(**{"File size": pd.array([None, 0], dtype="Int64")})
+
+    key = results.result_key("rmsd", "1", files, {})
+
+    assert key == results.result_key("rmsd", "1", files, {})
+    assert key != results.result_key("rmsd", "1", unknown, {})
@@ -0,0 +1,71 @@
+"""SelectionReader against the coordinates MDAnalysis reads from the trajectory."""
+
+import os
+
+import MDAnalysis as mda
+import numpy as np
+import pytest
+
+from analysis.tools.mdanalysis.coordinate_cache import CoordinateCache, SelectionReader
+
+
+def read_with_mdanalysis(structure, frames, selection):
+    universe = mda.Universe(str(structure), str(frames))
+    atoms = universe.select_atoms(selection)
+    coordinates = np.array([atoms.positions.copy() for _ in universe.trajectory])
+    times = np.array([ts.time for ts in universe.trajectory])
+    return atoms.indices, coordinates, times
+
+
+def test_selection_reader_reads_any_order(tmp_path, trajectory):
+    structure, frames = trajectory
+    indices, expected, times = read_with_mdanalysis(structure, frames, "name CA")
+    cache = CoordinateCache(str(tmp_path / "cache"))
+
+    with SelectionReader(cache, str(structure), str(frames), "name CA") as reader:
+        assert not reader.cached
+        assert (reader.n_frames, reader.n_atoms) == expected.shape[:2]
+        assert np.array_equal(reader.atom_indices, indices)
+        positions = np.array([7, 0, 11, 3])
+        coordinates, chunk_times = reader.read(positions)
+
+    np.testing.assert_allclose(coordinates, expected[positions], atol=1e-5)
+    np.testing.assert_allclose(chunk_times, times[positions])
+    # Some frames were not read: nothing is stored.
+    assert not os.listdir(tmp_path / "cache" / "coordinates")
+
+
+def test_selection_reader_caches_complete_reads(tmp_path, trajectory):
+    structure, frames = trajectory
+    indices, expected, times = read_with_mdanalysis(structure, frames, "name CA")
+    cache = CoordinateCache(str(tmp_path / "cache"))
+
+    with SelectionReader(cache, str(structure), str(frames), "name CA") as reader:
+        for positions in np.array_split(np.arange(reader.n_frames)[::-1], 3):
+            reader.read(positions)
+
+    with SelectionReader(cache, str(structure), str(frames), "name CA") as reader:
+        assert reader.cached
+        assert np.array_equal(reader.atom_indices, indices)
+        coordinates, cached_times = reader.read(np.arange(reader.n_frames))
+
+    np.testing.assert_allclose(coordinates, expected, atol=1e-5)
+    np.testing.assert_allclose(cached_times, times)
+    assert not [name for name in os.listdir(tmp_path / "cache" / "coordinates")
+                if name.startswith(".")]
+
+
+@pytest.mark.parametrize("selection", ["name CA", "name CB"])
+def test_selection_reader_keys_selections_apart(tmp_path, trajectory, selection):
+    structure, frames = trajectory
+    _, expected, _ = read_with_mdanalysis(structure, frames, selection)
+    cache = CoordinateCache(str(tmp_path / "cache"))
+    for group in ("name CA", "name CB"):
+        with SelectionReader(cache, str(structure), str(frames), group) as reader:
+            reader.read(np.arange(reader.n_frames))
+
+    with SelectionReader(cache, str(structure), str(frames), selection) as reader:
+        assert reader.cached
+        coordinates, _ = reader.read(np.arange(reader.n_frames))
+
+    np.testing.assert_allclose(coordinates, expected, atol=1e-5)
@@ -0,0 +1,55 @@
+"""download_file against a local HTTP server, with known and unknown sizes."""
+
+import http.server
+import threading
+
+import pytest
+
+from analysis import download
+
+CONTENTS = {"/a.xtc": b"x" * 3000, "/empty.txt": b""}
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        content = CONTENTS.get(self.path)
+        if content is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.mark.parametrize("path, expected_size", [
+    ("/a.xtc", 3000), ("/a.xtc", None), ("/empty.txt", 0), ("/empty.txt", None),
+])
+def test_download_file(tmp_path, server, path, expected_size):
+    file_cache = download.FileCache(tmp_path)
+
+    downloaded = download.download_file(server + path, expected_size, file_cache)
+
+    assert downloaded.read_bytes() == CONTENTS[path]
+    assert downloaded.suffix == path[path.rindex("."):]
+    assert download.download_file(server + path, expected_size, file_cache) == downloaded
+
+
+def test_download_file_checks_the_size(tmp_path, server):
+    file_cache = download.FileCache(tmp_path)
+
+    with pytest.raises(IOError, match="expected 10"):
+        download.download_file(server + "/a.xtc", 10, file_cache)
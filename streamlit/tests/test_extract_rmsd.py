@@ -0,0 +1,35 @@
+"""extract_rmsd.py run as the Galaxy wrapper runs it, with every kernel."""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "analysis", "tools",
+                      "mdanalysis", "extract_rmsd.py")
+
+
+def extract_rmsd(tmp_path, trajectory, name, *options):
+    structure, frames = trajectory
+    (tmp_path / "strs.txt").write_text(f"{structure}\n{structure}\n")
+    (tmp_path / "trajs.txt").write_text(f"{frames}\n{frames}\n")
+    outfile = tmp_path / name
+    subprocess.run(
+        [sys.executable, SCRIPT, "--trajs", str(tmp_path / "trajs.txt"),
+         "--strs", str(tmp_path / "strs.txt"), "--traj-format", "trr", "--str-format", "pdb",
+         "--outfile", str(outfile), "--output-format", "json", "--group", "name CA",
+         "--start", "0", "--end", "10", "--step", "1", *options],
+        check=True, capture_output=True, cwd=tmp_path,
+    )
+    return outfile.read_bytes()
+
+
+@pytest.mark.parametrize("options", [(), ("--workers", "2")])
+def test_json_output_does_not_depend_on_the_kernel(tmp_path, trajectory, options):
+    loop = extract_rmsd(tmp_path, trajectory, "loop.json", "--kernel", "loop")
+    batched = extract_rmsd(tmp_path, trajectory, "batched.json", *options)
+
+    assert batched == loop
+    # Two copies of a trajectory: the 4 RMSDs of every frame are 0.
+    assert batched.count(b"0.0") == 4 * 10
@@ -0,0 +1,57 @@
+"""rmsd_tile against MDAnalysis.analysis.rms.rmsd, pair by pair and frame by frame."""
+
+import numpy as np
+import pytest
+from MDAnalysis.analysis import rms
+
+from analysis.tools.mdanalysis import rmsd_kernels
+
+
+@pytest.fixture
+def ensemble():
+    rng = np.random.default_rng(1)
+    base = rng.normal(scale=5, size=(1, 3, 15, 3))
+    return (base + rng.normal(scale=0.8, size=(4, 3, 15, 3))).astype(np.float32)
+
+
+@pytest.mark.parametrize("superposition", [False, True])
+def test_rmsd_tile_matches_mdanalysis(ensemble, superposition):
+    values = rmsd_kernels.rmsd_tile(ensemble[:2], ensemble, superposition=superposition)
+
+    assert values.shape == (2, 4, 3)
+    for i in range(2):
+        for j in range(4):
+            for frame in range(3):
+                expected = rms.rmsd(ensemble[i, frame], ensemble[j, frame],
+                                    center=superposition, superposition=superposition)
+                assert values[i, j, frame] == pytest.approx(expected, abs=1e-5)
+
+
+def test_rmsd_tile_of_a_reflection_is_not_zero(ensemble):
+    mirrored = ensemble[:1] * np.array([-1, 1, 1], dtype=np.float32)
+
+    values = rmsd_kernels.rmsd_tile(ensemble[:1], mirrored, superposition=True)
+
+    expected = rms.rmsd(ensemble[0, 0], mirrored[0, 0], center=True, superposition=True)
+    assert values[0, 0, 0] == pytest.approx(expected, abs=1e-5)
+    assert values[0, 0, 0] > 0.1
+
+
+def test_pairwise_rmsd_matches_tiles(ensemble):
+    data = rmsd_kernels.pairwise_rmsd(ensemble, superposition=True, block_size=3)
+
+    expected = rmsd_kernels.rmsd_tile(ensemble, ensemble, superposition=True)
+    expected[np.arange(len(ensemble)), np.arange(len(ensemble))] = 0
+    np.testing.assert_allclose(data, expected, atol=1e-5)
+
+
+@pytest.mark.parametrize("superposition", [False, True])
+def test_rmsd_tile_of_equal_structures_is_zero(ensemble, superposition):
+    copies = np.concatenate([ensemble[:1], ensemble[:1]])
+
+    values = rmsd_kernels.rmsd_tile(copies, copies, superposition=superposition)
+
+    if superposition:
+        np.testing.assert_allclose(values, 0, atol=1e-12)
+    else:
+        assert np.all(values == 0)
@@ -0,0 +1,55 @@
+"""run_tool with a wrapper given by a path relative to the current directory."""
+
+import os
+import subprocess
+import sys
+
+from analysis.tools import registry
+
+STREAMLIT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+TOOL = """<tool id="echo_text" name="Echo text" version="1.0">
+    <command><![CDATA[
+        sh '$__tool_directory__/echo_text.sh' '$text' '$output'
+    ]]></command>
+    <inputs>
+        <param name="text" type="text" />
+    </inputs>
+    <outputs>
+        <data name="output" format="txt" />
+    </outputs>
+</tool>
+"""
+
+
+def write_tool(directory):
+    directory.mkdir()
+    (directory / "echo_text.xml").write_text(TOOL)
+    (directory / "echo_text.sh").write_text('printf "%s\\n" "$1" > "$2"\n')
+    return directory / "echo_text.xml"
+
+
+def test_tool_directory_is_absolute(tmp_path, monkeypatch):
+    write_tool(tmp_path / "tools")
+    monkeypatch.chdir(tmp_path)
+
+    tool, files = registry.parse_tool("tools/echo_text.xml")
+
+    assert tool.directory == tmp_path.resolve() / "tools"
+    assert f"'{tmp_path.resolve()}/tools/echo_text.sh'" in tool.render({"text": "hi"})
+    assert files == [tmp_path.resolve() / "tools" / "echo_text.xml"]
+
+
+def test_run_tool_from_a_relative_xml_path(tmp_path):
+    xml_path = write_tool(tmp_path / "tools")
+    env = dict(os.environ, MDVERSE_JOBS_DIR=str(tmp_path / "jobs"))
+
+    process = subprocess.run(
+        [sys.executable, "-m", "analysis.tools.run_tool",
+         "--xml", os.path.relpath(xml_path, STREAMLIT_DIR), "--param", "text=hello", "--wait"],
+        cwd=STREAMLIT_DIR, env=env, capture_output=True, text=True, timeout=60,
+    )
+
+    assert process.returncode == 0, process.stderr
+    assert "Status : done" in process.stdout
+    output = next((tmp_path / "jobs" / "work").glob("*/output.txt"))
+    assert output.read_text() == "hello\n"
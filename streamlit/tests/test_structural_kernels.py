@@ -0,0 +1,86 @@
+"""Frame passes of the RMSD preview and accumulators of the dynamics analyses."""
+
+import numpy as np
+import pytest
+from MDAnalysis.analysis import align, rms
+
+from analysis.structural import kernels
+
+
+@pytest.mark.parametrize("n_frames", [1, 7, 100, 101, 2500, 12345])
+@pytest.mark.parametrize("preview", [False, True])
+def test_frame_passes_read_every_frame_once(n_frames, preview):
+    passes = list(kernels.frame_passes(n_frames, preview))
+
+    frames = np.concatenate([pass_frames for _, pass_frames in passes])
+    assert np.array_equal(np.sort(frames), np.arange(n_frames))
+    assert passes[-1][0] == 1
+    for stride, pass_frames in passes:
+        assert np.all(pass_frames % stride == 0)
+
+
+def test_frame_passes_preview_starts_coarse():
+    passes = list(kernels.frame_passes(12345, preview=True))
+
+    strides = [stride for stride, _ in passes]
+    assert strides == kernels.preview_strides(12345) == [124, 12, 1]
+    assert len(passes[0][1]) <= kernels.PREVIEW_FRAMES
+    assert [stride for stride, _ in kernels.frame_passes(12345)] == [1]
+
+
+@pytest.fixture
+def frames():
+    rng = np.random.default_rng(2)
+    reference = rng.normal(scale=5, size=(12, 3))
+    rotations = [align.rotation_matrix(rng.normal(size=(12, 3)), reference)[0] for _ in range(30)]
+    noise = rng.normal(scale=0.3, size=(30, 12, 3))
+    return np.stack([(reference + n) @ r + 10 * rng.normal(size=3)
+                     for n, r in zip(noise, rotations)]).astype(np.float32)
+
+
+def test_rmsf_accumulator_matches_superposed_fluctuations(frames):
+    accumulator = kernels.RMSFAccumulator(frames[0], np.arange(12))
+    for start in range(0, len(frames), 7):
+        chunk = frames[start:start + 7]
+        accumulator.update(chunk, np.arange(len(chunk)), np.arange(start, start + len(chunk)))
+    result = accumulator.result()
+
+    reference = frames[0] - frames[0].mean(axis=0)
+    superposed = []
+    for frame in frames.astype(np.float64):
+        centered = frame - frame.mean(axis=0)
+        rotation, _ = align.rotation_matrix(centered, reference)
+        superposed.append(centered @ rotation.T)
+    superposed = np.array(superposed)
+    expected = np.sqrt(((superposed - superposed.mean(axis=0)) ** 2).sum(axis=2).mean(axis=0))
+
+    assert result["analysis"].eq("RMSF").all()
+    assert result["x"].tolist() == list(range(12))
+    np.testing.assert_allclose(result["value"], expected, atol=1e-4)
+
+
+def test_superpose_minimizes_the_rmsd(frames):
+    reference = frames[0] - frames[0].mean(axis=0, dtype=np.float64)
+
+    superposed = kernels.superpose(reference, frames)
+
+    for frame, positions in zip(frames, superposed):
+        expected = rms.rmsd(frame, frames[0], center=True, superposition=True)
+        assert np.sqrt(((positions - reference) ** 2).sum(axis=1).mean()) == pytest.approx(expected, abs=1e-4)
+
+
+def test_rmsd_matrix_accumulator_samples_frames(frames):
+    accumulator = kernels.RMSDMatrixAccumulator(len(frames), 12, max_frames=10)
+    times = np.arange(len(frames)) * 2.0
+    for start in range(0, len(frames), 4):
+        positions = np.arange(start, min(start + 4, len(frames)))
+        accumulator.update(frames[positions], times[positions], positions)
+    result = accumulator.result()
+
+    sampled = np.arange(0, len(frames), 3)
+    assert len(result) == len(sampled) ** 2
+    matrix = result.pivot(index="y", columns="x", values="value").to_numpy()
+    np.testing.assert_allclose(matrix, matrix.T)
+    assert matrix[1, 4] == pytest.approx(
+        rms.rmsd(frames[sampled[1]], frames[sampled[4]], center=True, superposition=True), abs=1e-4
+    )
@@ -1,6 +1,7 @@
 """Helper functions to manage the Streamlit application."""
 
 import streamlit as st
+import numpy as np
 import pandas as pd
 
 import itables
@@ -10,39 +11,113 @@ import streamlit.components.v1 as components
 
 
 from analysis import analysis_manager as am
+from catalog import cache, capabilities, compact, index, loader, search
+
+FILES_PER_PAGE = 50
+SIZE_UNITS = np.array(["bytes", "KB", "MB", "GB", "TB", "PB", "EB", "ZB", "YB"])
+
+@st.cache_resource
+def get_catalog_loader() -> loader.CatalogLoader:
+    """Return the lazy catalog loader shared by all sessions.
+
+    Returns
+    -------
+    loader.CatalogLoader
+        Loader reading the locally cached catalog files.
+    """
+    # Files are downloaded once per Zenodo record and shared by all workers
+    # through the on-disk cache (see catalog.cache for the configuration).
+    return loader.CatalogLoader(cache.fetch_catalog())
+
+@st.cache_resource
+def load_tables() -> dict:
+    """Read the compact catalog tables, once for all sessions.
+
+    Returns
+    -------
+    dict
+        The datasets and files pd.DataFrame objects. They are shared by all
+        the sessions and must not be modified.
+    """
+    # Only the columns displayed by the application are read, and they are
+    # compacted while being read from the parquet files.
+    catalog_loader = get_catalog_loader()
+    return {
+        "datasets": compact.read_datasets(catalog_loader),
+        "files": compact.read_files(catalog_loader),
+    }
+
+@st.cache_resource
+def get_catalog_index(
+    record: str, _datasets: pd.DataFrame, _files: pd.DataFrame
+) -> index.CatalogIndex:
+    """Build the dataset ID index, once per catalog version.
+
+    Parameters
+    ----------
+    record: str
+        Zenodo record of the catalog, used as the cache key.
+    _datasets: pd.DataFrame
+        The datasets table (not hashed by Streamlit).
+    _files: pd.DataFrame
+        The files table (not hashed by Streamlit).
+
+    Returns
+    -------
+    index.CatalogIndex
+        Index shared by all the sessions.
+    """
+    return index.CatalogIndex(_datasets, _files)
+
+@st.cache_resource
+def get_capability_index(
+    record: str, _files: pd.DataFrame, _catalog_index: index.CatalogIndex
+) -> capabilities.CapabilityIndex:
+    """Compute the eligibility of every dataset for every analysis, once.
+
+    Parameters
+    ----------
+    record: str
+        Zenodo record of the catalog, used as the cache key.
+    _files: pd.DataFrame
+        The files table (not hashed by Streamlit).
+    _catalog_index: index.CatalogIndex
+        Index returned by get_catalog_index.
+
+    Returns
+    -------
+    capabilities.CapabilityIndex
+        Index shared by all the sessions.
+    """
+    return capabilities.CapabilityIndex(_files, _catalog_index, am.CAPABILITIES)
 
-@st.cache_data
 def load_data() -> dict:
     """Retrieve our data and loads it into the pd.DataFrame object.
 
     Returns
     -------
     dict
-        returns a dict containing the pd.DataFrame objects of our datasets.
+        returns a dict containing the pd.DataFrame objects of our datasets,
+        and the indexes built over them.
     """
-    # DATA_URL needs to be the URL of the last version of the data.
-    # I cannot be the identifier provided by the master DOI.
-    DATA_URL = "https://zenodo.org/record/7856806"
-    dfs = {}
-    datasets = pd.read_parquet(
-        f"{DATA_URL}/files/datasets.parquet"
-    )
-    files = pd.read_parquet(
-        f"{DATA_URL}/files/files.parquet"
-    )
-
-    dfs["datasets"] = datasets
-    dfs["files"] = files
+    # Tables and indexes are cached as resources so that they are not
+    # copied on every rerun.
+    dfs = dict(load_tables())
+    dfs["index"] = get_catalog_index(cache.ZENODO_RECORD, dfs["datasets"], dfs["files"])
+    dfs["capabilities"] = get_capability_index(cache.ZENODO_RECORD, dfs["files"], dfs["index"])
     return dfs
 
-@st.cache_data
-def find_dataset_by_id(datasets: pd.DataFrame, dataset_id: str) -> pd.DataFrame:
+def find_dataset_by_id(
+    datasets: pd.DataFrame, catalog_index: index.CatalogIndex, dataset_id: str
+) -> pd.DataFrame:
     """Find a dataset in the pd.DataFrame using a dataset ID.
 
     Parameters
     ----------
     datasets: pd.DataFrame
         Contains all the information from our extracted MD data.
+    catalog_index: index.CatalogIndex
+        Index of the dataset IDs built by load_data.
     dataset_id: str
         The dataset ID used for searching.
 
@@ -62,8 +137,8 @@ def find_dataset_by_id(datasets: pd.DataFrame, dataset_id: str) -> pd.DataFrame:
         "file_number",
     ]
 
-    # Filter data for datasets containing the specified dataset_id
-    results = datasets[datasets["dataset_id"].str.contains(dataset_id, case=False, regex=False)]
+    # Filter data for datasets matching the specified dataset_id
+    results = datasets.iloc[catalog_index.dataset_rows(catalog_index.search(dataset_id))]
 
     # Select only the specified columns
     results = results[to_keep]
@@ -85,14 +160,17 @@ def find_dataset_by_id(datasets: pd.DataFrame, dataset_id: str) -> pd.DataFrame:
     else:
         return None
 
-@st.cache_data
-def find_files_by_dataset_id(files: pd.DataFrame, dataset_id: str) -> pd.DataFrame:
+def find_files_by_dataset_id(
+    files: pd.DataFrame, catalog_index: index.CatalogIndex, dataset_id: str
+) -> pd.DataFrame:
     """Find a dataset in the pd.DataFrame using a dataset ID.
 
     Parameters
     ----------
     data: pd.DataFrame
         Contains all the information from our extracted MD data.
+    catalog_index: index.CatalogIndex
+        Index of the dataset IDs built by load_data.
     dataset_id: str
         The dataset ID used for searching.
 
@@ -108,8 +186,9 @@ def find_files_by_dataset_id(files: pd.DataFrame, dataset_id: str) -> pd.DataFra
         "file_url",
     ]
 
-    # Filter data for datasets containing the specified dataset_id
-    results = files[files["dataset_id"].str.contains(dataset_id, case=False, regex=False)]
+    # Filter data for datasets matching the specified dataset_id
+    results = files.iloc[catalog_index.file_rows(catalog_index.search(dataset_id))]
+    results = compact.expand_files(results)
 
     # Select only the specified columns
     results = results[to_keep]
@@ -126,21 +205,155 @@ def find_files_by_dataset_id(files: pd.DataFrame, dataset_id: str) -> pd.DataFra
     else:
         return None
 
-def display_search_bar():
-    """Configure the display of the search bar.
+@st.cache_resource
+def get_search_index(record: str, _datasets: pd.DataFrame) -> search.SearchIndex:
+    """Build the dataset search index, once per catalog version.
+
+    Parameters
+    ----------
+    record: str
+        Zenodo record of the catalog, used as the cache key.
+    _datasets: pd.DataFrame
+        The datasets table (not hashed by Streamlit).
 
     Returns
     -------
-    int
-        search id.
+    search.SearchIndex
+        Index shared by all the sessions.
+    """
+    return search.SearchIndex(_datasets)
+
+def search_datasets(data: dict, query: str, k: int = 10) -> list:
+    """Search the datasets matching a query, reusing the last results.
+
+    Parameters
+    ----------
+    data: dict
+        The catalog returned by load_data.
+    query: str
+        Text typed in the search bar.
+    k: int
+        Maximum number of results.
+
+    Returns
+    -------
+    list
+        Dataset IDs of the best matches.
+    """
+    last_search = st.session_state.get("last_search")
+    if last_search is not None and last_search[0] == query:
+        return last_search[1]
+
+    datasets = data["datasets"]
+    search_index = get_search_index(cache.ZENODO_RECORD, datasets)
+    rows = [row for row, _ in search_index.search(query, k=k)]
+    results = datasets["dataset_id"].iloc[rows].astype(str).tolist()
+    st.session_state["last_search"] = (query, results)
+    return results
+
+def display_search_bar(data: dict):
+    """Configure the display of the search bar.
+
+    Parameters
+    ----------
+    data: dict
+        The catalog returned by load_data.
     """
     placeholder = (
-        "Enter dataset ID."
+        "Enter dataset ID, title or author."
+    )
+    query = st.sidebar.text_input("Datasets quick search", placeholder=placeholder)
+
+    if not query:
+        st.session_state["querydatasetid"] = query
+        return
+
+    matches = search_datasets(data, query)
+    if not matches:
+        st.session_state["querydatasetid"] = query
+        return
+
+    datasets = data["datasets"]
+    catalog_index = data["index"]
+    titles = {}
+    for dataset_id in matches:
+        rows = catalog_index.dataset_rows(catalog_index.search(dataset_id))
+        titles[dataset_id] = datasets["title"].iloc[rows[0]] if len(rows) else ""
+
+    search_id = st.sidebar.selectbox(
+        "Matching datasets:",
+        matches,
+        format_func=lambda dataset_id: f"{dataset_id} - {titles[dataset_id]}"[:80],
     )
-    search_id = st.sidebar.text_input("Datasets quick search", placeholder=placeholder)
 
     st.session_state["querydatasetid"] = search_id
 
+def format_sizes(sizes: pd.Series) -> pd.Series:
+    """Convert sizes in bytes into KB, MB, GB, etc. formats.
+
+    Parameters
+    ----------
+    sizes: pd.Series
+        Sizes in bytes.
+
+    Returns
+    -------
+    pd.Series
+        Human readable sizes, e.g. "1.5 MB".
+    """
+    values = pd.to_numeric(sizes, errors="coerce").fillna(0).to_numpy(dtype=np.float64)
+    exponents = np.zeros(len(values), dtype=np.int64)
+    positive = values >= 1
+    exponents[positive] = np.floor(np.log(values[positive]) / np.log(1024))
+    # Correct floating point rounding around exact powers of 1024.
+    exponents += values >= np.power(1024.0, exponents + 1)
+    exponents = np.clip(exponents, 0, len(SIZE_UNITS) - 1)
+    scaled = values / np.power(1024.0, exponents)
+    labels = np.char.add(np.char.mod("%.1f ", scaled), SIZE_UNITS[exponents])
+    return pd.Series(labels, index=sizes.index)
+
+def format_files_summary(files: pd.DataFrame) -> str:
+    """Summarize the number of files and their total size per file type.
+
+    Parameters
+    ----------
+    files: pd.DataFrame
+        Files returned by find_files_by_dataset_id.
+
+    Returns
+    -------
+    str
+        Markdown summary.
+    """
+    sizes = pd.to_numeric(files["File size"], errors="coerce").fillna(0)
+    summary = sizes.groupby(files["File type"].astype(str)).agg(["count", "sum"])
+    lines = (
+        "**" + summary.index.to_series() + ":** "
+        + summary["count"].astype(str) + " file(s), "
+        + format_sizes(summary["sum"])
+    )
+    total = f"**Total:** {len(files)} file(s), {format_sizes(pd.Series([sizes.sum()])).iloc[0]}"
+    return "  \n".join([total, *lines])
+
+def format_files_list(files: pd.DataFrame) -> str:
+    """Render a list of files as markdown.
+
+    Parameters
+    ----------
+    files: pd.DataFrame
+        Files to display, typically one page of them.
+
+    Returns
+    -------
+    str
+        Markdown listing the name and size of each file.
+    """
+    lines = (
+        "\n    📄  " + files["File name"].astype(str)
+        + "    \n    🗄️  " + format_sizes(files["File size"]) + "\n\n        "
+    )
+    return "".join(lines)
+
 def update_contents(data: pd.DataFrame) -> None:
     """Change the content display according to the cursor position.
 
@@ -157,7 +370,9 @@ def update_contents(data: pd.DataFrame) -> None:
     datasets = data["datasets"]
     files = data["files"]
 
-    result_data = find_dataset_by_id(datasets, datasetid)
+    catalog_index = data["index"]
+
+    result_data = find_dataset_by_id(datasets, catalog_index, datasetid)
     
     if result_data is None or result_data.empty:
         st.sidebar.write("No result found.")
@@ -172,33 +387,27 @@ def update_contents(data: pd.DataFrame) -> None:
     **Description:**\n *{result_data["Description"]}*\n
     """
 
-    result_files = find_files_by_dataset_id(files, datasetid)
-    if result_files is None or result_files.empty:
-        st.sidebar.write("No files found.")
-    
-    def format_size(size_str):
-        """ Converts a size in bytes into KB, MB, GB, etc. formats. """
-        size = int(size_str)
-        for unit in ['bytes', 'KB', 'MB', 'GB', 'TB', 'PB', 'EB', 'ZB', 'YB']:
-            if size < 1024.0:
-                return f"{size:.1f} {unit}"
-            size /= 1024.0
-        return f"{size:.1f} YB"  #  Returns in Yottabytes if the value is extremely large
-
-    def format_file_info(row):
-        return f"""
-    📄  {row['File name']}    
-    🗄️  {format_size(row['File size'])}\n
-        """
-
-    files_contents = "".join(result_files.apply(format_file_info, axis=1))
-
     datasetinfo_expander = st.sidebar.expander("Dataset informations:")
     datasetinfo_expander.markdown(contents)
 
+    result_files = find_files_by_dataset_id(files, catalog_index, datasetid)
+    if result_files is None or result_files.empty:
+        # The dataset is still described, but there is nothing to analyse.
+        st.sidebar.write("No files found.")
+        st.session_state["content"] = ""
+        return
+
     filesinfo_expander = st.sidebar.expander("Files:", expanded=True)
-    filesinfo_expander.markdown(files_contents)
+    filesinfo_expander.markdown(format_files_summary(result_files))
 
+    n_pages = max(1, -(-len(result_files) // FILES_PER_PAGE))
+    page = 1
+    if n_pages > 1:
+        page = filesinfo_expander.number_input(
+            f"Page (of {n_pages}):", min_value=1, max_value=n_pages, value=1, step=1
+        )
+    page_files = result_files.iloc[(page - 1) * FILES_PER_PAGE:page * FILES_PER_PAGE]
+    filesinfo_expander.markdown(format_files_list(page_files))
 
     # st.session_state["content"] = contents + files_contents
     st.session_state["content"] = [datasetinfo_expander, filesinfo_expander]
@@ -227,7 +436,7 @@ def display_details(data: pd.DataFrame) -> None:
         return
     
     if size_selected > 1:
-        display_search_bar()
+        display_search_bar(data)
     
     update_contents(data)
 
@@ -236,7 +445,7 @@ def display_details(data: pd.DataFrame) -> None:
     
     with st.sidebar:
         [comp for comp in st.session_state["content"]]
-    am.init_analysis_tools()
+    am.init_analysis_tools(data)
     
             
 